@@ -0,0 +1,191 @@
+"""
+Process-wide answer key for vectorized scoring.
+
+Keeps two NumPy arrays indexed by question ID: the 0-indexed correct answer
+(as saved in notebook progress: 0-4 for A-E, 1/0 for Certo/Errado; -1 when
+unknown) and the question type. Scoring a set of answers is then a single
+array comparison, with no query to `questions`.
+
+The key is loaded on startup and patched by the question write functions in
+crud. Each worker process keeps its own copy; the writes of other processes
+reach it through question_sync, and the questions it does not know yet are read
+from the database before scoring (`ensure_known`).
+"""
+from sqlalchemy.orm import Session
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import threading
+import logging
+
+import numpy as np
+
+from backend import models
+from backend.question_sync import question_rows, question_sync
+
+logger = logging.getLogger(__name__)
+
+TIPO_DESCONHECIDO = 0
+TIPO_MULTIPLA = 1
+TIPO_CERTO_ERRADO = 2
+
+_TIPOS = {"multipla": TIPO_MULTIPLA, "certo_errado": TIPO_CERTO_ERRADO}
+_TIPO_NAMES = {code: tipo for tipo, code in _TIPOS.items()}
+_GABARITO_MULTIPLA = {'A': 0, 'B': 1, 'C': 2, 'D': 3, 'E': 4}
+SEM_RESPOSTA = -2 # Marks missing/invalid answers; never equal to a correct index
+
+def codificar(gabarito: Optional[str], tipo: Optional[str]) -> Tuple[int, int]:
+    """
+    Converts (gabarito, tipo) into (correct index, type code) as stored in the arrays.
+    """
+    tipo_code = _TIPOS.get(tipo, TIPO_DESCONHECIDO)
+    if gabarito is None:
+        return -1, tipo_code
+    if tipo_code == TIPO_MULTIPLA:
+        return _GABARITO_MULTIPLA.get(gabarito.strip().upper(), -1), tipo_code
+    if tipo_code == TIPO_CERTO_ERRADO:
+        return (1 if gabarito.strip().lower() == "certo" else 0), tipo_code
+    return -1, tipo_code
+
+def _to_answer(value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return SEM_RESPOSTA
+
+class AnswerKey:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._correct = np.full(0, -1, dtype=np.int8)
+        self._tipo = np.zeros(0, dtype=np.int8)
+        self.loaded = False
+
+    def load(self, db: Session) -> int:
+        """
+        Builds the arrays from every question in the database. Returns the number of questions.
+        """
+        question_sync.start(db)
+        rows = db.query(models.Question.id, models.Question.gabarito, models.Question.tipo).all()
+        size = max((row[0] for row in rows), default=0) + 1
+        correct = np.full(size, -1, dtype=np.int8)
+        tipo = np.zeros(size, dtype=np.int8)
+        for q_id, gabarito, q_tipo in rows:
+            correct[q_id], tipo[q_id] = codificar(gabarito, q_tipo)
+        with self._lock:
+            self._correct, self._tipo = correct, tipo
+            self.loaded = True
+        logger.info(f"Answer key loaded with {len(rows)} questions.")
+        return len(rows)
+
+    def ensure_loaded(self, db: Session) -> None:
+        if not self.loaded:
+            self.load(db)
+        question_sync.sync(db)
+
+    def refresh(self, db: Session, question_ids: List[int]) -> None:
+        """
+        Reloads the given questions from the database (question_sync listener).
+        """
+        if not self.loaded:
+            return
+        rows = question_rows(db, question_ids, models.Question.gabarito, models.Question.tipo)
+        self.set_many(rows)
+        for q_id in set(question_ids).difference(row[0] for row in rows):
+            self.remove(q_id)
+
+    def ensure_known(self, db: Session, question_ids: Iterable[int]) -> None:
+        """
+        Reads from the database the questions the key has no valid answer for (e.g. created
+        or edited by another process since the last sync) and patches them in.
+        """
+        ids = np.fromiter((int(q) for q in question_ids), dtype=np.int64)
+        correct, _ = self.lookup(ids)
+        missing = np.unique(ids[correct < 0]).tolist()
+        if missing:
+            self.set_many(question_rows(db, missing, models.Question.gabarito, models.Question.tipo))
+
+    def _grow(self, size: int) -> None:
+        # Arrays are replaced, never resized in place, so readers holding the
+        # previous arrays keep a consistent view. Must be called with the lock held.
+        size = max(size, int(len(self._correct) * 1.5) + 1)
+        correct = np.full(size, -1, dtype=np.int8)
+        tipo = np.zeros(size, dtype=np.int8)
+        correct[:len(self._correct)] = self._correct
+        tipo[:len(self._tipo)] = self._tipo
+        self._correct, self._tipo = correct, tipo
+
+    def set(self, question_id: int, gabarito: Optional[str], tipo: Optional[str]) -> None:
+        """
+        Patches the key after a question is created or updated.
+        """
+        self.set_many([(question_id, gabarito, tipo)])
+
+    def set_many(self, rows: Iterable[Tuple[int, Optional[str], Optional[str]]]) -> None:
+        """
+        Patches the key for several (id, gabarito, tipo) rows at once.
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        with self._lock:
+            max_id = max(row[0] for row in rows)
+            if max_id >= len(self._correct):
+                self._grow(max_id + 1)
+            for q_id, gabarito, q_tipo in rows:
+                self._correct[q_id], self._tipo[q_id] = codificar(gabarito, q_tipo)
+
+    def remove(self, question_id: int) -> None:
+        """
+        Forgets a deleted question; answers to it are no longer counted as correct.
+        """
+        with self._lock:
+            if question_id < len(self._correct):
+                self._correct[question_id] = -1
+                self._tipo[question_id] = TIPO_DESCONHECIDO
+
+    def lookup(self, question_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (correct indices, type codes) for an array of question IDs.
+        Unknown IDs get -1 and TIPO_DESCONHECIDO.
+        """
+        correct, tipo = self._correct, self._tipo
+        ids = np.asarray(question_ids, dtype=np.int64)
+        known = (ids >= 0) & (ids < len(correct))
+        safe_ids = np.where(known, ids, 0)
+        return (
+            np.where(known, correct[safe_ids], -1).astype(np.int8),
+            np.where(known, tipo[safe_ids], TIPO_DESCONHECIDO).astype(np.int8),
+        )
+
+    def tipo(self, db: Session, question_id: int) -> Optional[str]:
+        """
+        Tipo of a question ("multipla" or "certo_errado") from the key, read from the
+        database when the key does not know it; None for unknown questions.
+        """
+        self.ensure_known(db, [question_id])
+        _, tipo = self.lookup(np.asarray([question_id], dtype=np.int64))
+        return _TIPO_NAMES.get(int(tipo[0]))
+
+    def correct_mask(self, question_ids: Iterable[int], answers: Iterable[Any], db: Optional[Session] = None) -> np.ndarray:
+        """
+        Vectorized check of notebook answers (0-indexed) against the key.
+        Returns a boolean array aligned with the inputs. With `db`, questions missing
+        from the key are read from the database first (ensure_known).
+        """
+        ids = np.fromiter((int(q) for q in question_ids), dtype=np.int64)
+        given = np.fromiter((_to_answer(a) for a in answers), dtype=np.int64, count=len(ids))
+        if db is not None:
+            self.ensure_known(db, ids)
+        correct, _ = self.lookup(ids)
+        return (given == correct) & (correct >= 0)
+
+    def score(self, respostas: Dict[Any, Any], db: Optional[Session] = None) -> Tuple[int, int]:
+        """
+        Scores a notebook progress dict {question_id: answer}.
+        Returns (answered, correct).
+        """
+        if not respostas:
+            return 0, 0
+        mask = self.correct_mask(respostas.keys(), respostas.values(), db)
+        return len(respostas), int(mask.sum())
+
+answer_key = AnswerKey()
+question_sync.register(answer_key.refresh)
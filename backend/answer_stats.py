@@ -0,0 +1,147 @@
+"""
+In-memory coalescing of the per-alternative answer counters.
+
+Every answer increments one counter of `QuestionStatistics` (count_a..count_e,
+count_certo, count_errado). Instead of one UPDATE per answer, increments are
+accumulated here and written in batches by `flush`, which runs on the answer
+write path once enough increments are pending or enough time has passed, and
+once more on application shutdown. Inside a write-queue batch the flush is only
+committed with the batch, so the increments are put back if the batch fails.
+"""
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, Optional
+import threading
+import time
+import logging
+
+from backend import models
+from backend.write_queue import on_rollback
+
+logger = logging.getLogger(__name__)
+
+FLUSH_THRESHOLD = 200 # Pending increments that trigger a flush
+FLUSH_INTERVAL_SECONDS = 5.0 # Maximum age of a pending increment
+
+MULTIPLA_COLUMNS = ["count_a", "count_b", "count_c", "count_d", "count_e"]
+CERTO_ERRADO_COLUMNS = {0: "count_errado", 1: "count_certo"}
+DISTRIBUTION_KEYS = {
+    "count_a": "A",
+    "count_b": "B",
+    "count_c": "C",
+    "count_d": "D",
+    "count_e": "E",
+    "count_certo": "Certo",
+    "count_errado": "Errado",
+}
+
+_lock = threading.Lock()
+_pending: Dict[int, Dict[str, int]] = {}
+_pending_total = 0
+_last_flush = time.monotonic()
+
+def column_for_answer(tipo: str, answer: Optional[int]) -> Optional[str]:
+    """
+    Maps the answer index sent by the frontend to a counter column.
+    Multiple choice uses 0..4 for A..E; certo/errado uses 1 for Certo and 0 for Errado.
+    """
+    if answer is None:
+        return None
+    if tipo == "certo_errado":
+        return CERTO_ERRADO_COLUMNS.get(answer)
+    if 0 <= answer < len(MULTIPLA_COLUMNS):
+        return MULTIPLA_COLUMNS[answer]
+    return None
+
+def record(question_id: int, column: str) -> None:
+    """
+    Accumulates one increment of `column` for a question.
+    """
+    global _pending_total
+    with _lock:
+        counters = _pending.setdefault(question_id, {})
+        counters[column] = counters.get(column, 0) + 1
+        _pending_total += 1
+
+def should_flush() -> bool:
+    with _lock:
+        if not _pending_total:
+            return False
+        return (
+            _pending_total >= FLUSH_THRESHOLD
+            or time.monotonic() - _last_flush >= FLUSH_INTERVAL_SECONDS
+        )
+
+def pending_for(question_id: int) -> Dict[str, int]:
+    with _lock:
+        return dict(_pending.get(question_id, {}))
+
+def flush(db: Session) -> int:
+    """
+    Writes every pending increment in a single transaction.
+    Returns the number of questions updated. On failure the increments are put back.
+    """
+    global _pending, _pending_total, _last_flush
+    with _lock:
+        batch = _pending
+        batch_total = _pending_total
+        _pending = {}
+        _pending_total = 0
+        _last_flush = time.monotonic()
+
+    if not batch:
+        return 0
+
+    try:
+        existing = {
+            row.question_id for row in db.query(models.QuestionStatistics.question_id).filter(
+                models.QuestionStatistics.question_id.in_(list(batch.keys()))
+            ).all()
+        }
+        for question_id in batch.keys() - existing:
+            db.add(models.QuestionStatistics(question_id=question_id, total_attempts=0, correct_attempts=0))
+        db.flush()
+
+        for question_id, counters in batch.items():
+            db.query(models.QuestionStatistics).filter(
+                models.QuestionStatistics.question_id == question_id
+            ).update(
+                {getattr(models.QuestionStatistics, col): getattr(models.QuestionStatistics, col) + n for col, n in counters.items()},
+                synchronize_session=False
+            )
+        db.commit()
+        on_rollback(db, lambda: _merge_back(batch, batch_total))
+    except Exception:
+        db.rollback()
+        logger.error("Failed to flush answer distribution counters; keeping them in memory.", exc_info=True)
+        _merge_back(batch, batch_total)
+        raise
+
+    logger.info(f"Flushed answer distribution for {len(batch)} questions ({batch_total} answers).")
+    return len(batch)
+
+def _merge_back(batch: Dict[int, Dict[str, int]], batch_total: int) -> None:
+    global _pending_total
+    with _lock:
+        for question_id, counters in batch.items():
+            current = _pending.setdefault(question_id, {})
+            for col, n in counters.items():
+                current[col] = current.get(col, 0) + n
+        _pending_total += batch_total
+
+def distribution(stats: Optional[models.QuestionStatistics], question_id: int) -> Dict[str, int]:
+    """
+    Returns the answer distribution of a question as {"A": n, ..., "Errado": n},
+    combining the persisted counters with the increments not yet flushed.
+    """
+    pending = pending_for(question_id)
+    return {
+        label: ((getattr(stats, col) or 0) if stats is not None else 0) + pending.get(col, 0)
+        for col, label in DISTRIBUTION_KEYS.items()
+    }
+
+def distributions(rows: Iterable[models.QuestionStatistics], question_ids: Iterable[int]) -> Dict[int, Dict[str, int]]:
+    """
+    Bulk version of `distribution` for a set of questions.
+    """
+    stats_map = {row.question_id: row for row in rows}
+    return {q_id: distribution(stats_map.get(q_id), q_id) for q_id in question_ids}
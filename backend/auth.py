@@ -1,11 +1,11 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 import logging
+import time
 
 # Configura o logger para exibir mensagens INFO ou DEBUG
 logging.basicConfig(level=logging.INFO)
@@ -14,6 +14,9 @@ logger = logging.getLogger(__name__)
 # Importações relativas
 from backend import models, schemas, crud
 from backend.database import get_db
+from backend.cache import TTLCache
+from backend import password_hashing
+from backend.password_hashing import pwd_context
 
 # Tente importar bcrypt diretamente para verificar a versão
 try:
@@ -22,20 +25,54 @@ except ImportError:
     print("Aviso: A biblioteca 'bcrypt' não foi encontrada. Certifique-se de que 'passlib[bcrypt]' está instalada.")
     print("Para instalar: pip install 'passlib[bcrypt]'")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 SECRET_KEY = "sua_chave_secreta_muito_segura_e_longa"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/token")
 
+# Cache de usuários autenticados, por token. Cada entrada guarda a versão do
+# usuário no momento da leitura; invalidate_principal incrementa a versão e
+# descarta todas as entradas daquele usuário sem precisar percorrer o cache.
+# A invalidação vale só para o processo atual: os demais workers continuam usando
+# o usuário em cache por até PRINCIPAL_CACHE_TTL_SECONDS, por isso o TTL é curto
+# (o cache só evita reler o usuário a cada requisição de uma mesma rajada).
+PRINCIPAL_CACHE_SIZE = 10000
+PRINCIPAL_CACHE_TTL_SECONDS = 5
+_principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
+_principal_versions: Dict[int, int] = {}
+
+def invalidate_principal(user_id: int) -> None:
+    """
+    Descarta os usuários em cache para user_id (ex.: após aprovação, rejeição ou mudança de papel).
+    Em outros processos a mudança vale após no máximo PRINCIPAL_CACHE_TTL_SECONDS.
+    """
+    _principal_versions[user_id] = _principal_versions.get(user_id, 0) + 1
+
+def _hash_or_503(fn, *args):
+    """
+    Executa o bcrypt no pool de processos; responde 503 quando o pool está saturado,
+    demora mais que HASH_TIMEOUT_SECONDS ou perdeu um worker.
+    """
+    try:
+        return fn(*args)
+    except password_hashing.HashPoolUnavailable as e:
+        if isinstance(e, password_hashing.HashPoolSaturated):
+            logger.warning("Pool de hashing de senhas saturado; requisição recusada.")
+        else:
+            logger.exception("Pool de hashing de senhas indisponível; requisição recusada.")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Servidor sobrecarregado. Tente novamente em alguns segundos.",
+            headers={"Retry-After": "5"},
+        )
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
     Verifica se uma senha em texto puro corresponde a uma senha hasheada.
     """
     logger.info(f"Verificando senha: plain_password (parcial)={plain_password[:3]}..., hashed_password (parcial)={hashed_password[:10]}...")
-    result = pwd_context.verify(plain_password, hashed_password)
+    result = _hash_or_503(password_hashing.verify_password, plain_password, hashed_password)
     logger.info(f"Resultado da verificação: {result}")
     return result
 
@@ -43,7 +80,7 @@ def get_password_hash(password: str) -> str:
     """
     Gera o hash de uma senha em texto puro.
     """
-    hashed = pwd_context.hash(password)
+    hashed = _hash_or_503(password_hashing.hash_password, password)
     logger.info(f"Senha hasheada (parcial): {hashed[:10]}...")
     return hashed
 
@@ -82,7 +119,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     logger.info(f"Token de acesso criado para sub: {data.get('sub')}")
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     """
     Obtém o usuário atual a partir do token JWT.
     """
@@ -91,6 +128,11 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         detail="Não foi possível validar as credenciais",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cached = _principal_cache.get(token)
+    if cached is not None:
+        principal, version = cached
+        if version == _principal_versions.get(principal.id, 0):
+            return principal
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -102,12 +144,17 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError as e:
         logger.error(f"Erro ao decodificar token JWT: {e}")
         raise credentials_exception
+    version = _principal_versions.get(user_id, 0) # Lida antes da consulta para não cachear um usuário já invalidado
     user = crud.get_user_by_username(db, username=username) # A busca aqui continua por username (sub do token)
     if user is None or not user.is_active:
         logger.warning(f"Usuário '{username}' não encontrado ou inativo para token válido.")
         raise credentials_exception
     logger.info(f"Usuário '{username}' obtido do token com sucesso.")
-    return schemas.User(id=user.id, username=user.username, email=user.email, is_active=user.is_active, role=user.role)
+    principal = schemas.User(id=user.id, username=user.username, email=user.email, is_active=user.is_active, role=user.role)
+    if user.id == user_id:
+        # Válido até a expiração do token, limitado a PRINCIPAL_CACHE_TTL_SECONDS
+        _principal_cache.set(token, (principal, version), ttl=payload.get("exp", 0) - time.time())
+    return principal
 
 async def get_current_admin_user(current_user: schemas.User = Depends(get_current_user)):
     """
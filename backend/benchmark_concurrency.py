@@ -0,0 +1,77 @@
+"""
+Load test: latency of a cheap endpoint while slow requests run concurrently.
+
+Start the API (e.g. `uvicorn backend.main:app`) and run:
+
+    python backend/benchmark_concurrency.py --token <JWT> --slow-concurrency 20
+
+While `--slow-concurrency` clients keep hitting `--slow-path`, `--probe-concurrency`
+clients hit `--probe-path` and the probe latencies are reported. If slow requests
+block the event loop, the probe p99 grows with the slow concurrency; with the
+endpoints running in the threadpool it should stay close to the idle value.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+async def worker(client, path, headers, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = await client.get(path, headers=headers)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+async def run(args):
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    limits = httpx.Limits(max_connections=args.slow_concurrency + args.probe_concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        deadline = time.perf_counter() + args.duration
+        slow_latencies, probe_latencies, errors = [], [], []
+        tasks = [
+            worker(client, args.slow_path, headers, deadline, slow_latencies, errors)
+            for _ in range(args.slow_concurrency)
+        ] + [
+            worker(client, args.probe_path, headers, deadline, probe_latencies, errors)
+            for _ in range(args.probe_concurrency)
+        ]
+        await asyncio.gather(*tasks)
+
+    for name, latencies in (("slow", slow_latencies), ("probe", probe_latencies)):
+        if not latencies:
+            print(f"{name:>5}: no requests completed")
+            continue
+        print(
+            f"{name:>5}: {len(latencies)} requests, "
+            f"p50={statistics.median(latencies):.1f}ms "
+            f"p95={percentile(latencies, 95):.1f}ms "
+            f"p99={percentile(latencies, 99):.1f}ms "
+            f"max={max(latencies):.1f}ms"
+        )
+    if errors:
+        print(f"errors: {len(errors)} (first: {errors[0]})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--token", help="Bearer token used on both paths")
+    parser.add_argument("--slow-path", default="/api/users/me/wrong-questions")
+    parser.add_argument("--probe-path", default="/api/users/me/")
+    parser.add_argument("--slow-concurrency", type=int, default=20)
+    parser.add_argument("--probe-concurrency", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=15.0, help="Seconds")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds per request")
+    asyncio.run(run(parser.parse_args()))
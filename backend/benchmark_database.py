@@ -0,0 +1,94 @@
+"""
+Read/write throughput of the engine under concurrent load.
+
+Runs reader threads (point SELECTs) and writer threads (UPDATE + COMMIT) against
+a scratch table and reports operations per second and errors such as
+"database is locked". On SQLite it compares the default settings with the
+pragmas from database.SQLITE_PRAGMAS:
+
+    python backend/benchmark_database.py --readers 16 --writers 4
+
+With --url the same load runs once against that database (e.g. Postgres).
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.database import build_engine, is_sqlite
+
+ROWS = 10000
+
+def setup(engine):
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS bench_rows"))
+        conn.execute(text("CREATE TABLE bench_rows (id INTEGER PRIMARY KEY, payload TEXT, counter INTEGER NOT NULL)"))
+        conn.execute(
+            text("INSERT INTO bench_rows (id, payload, counter) VALUES (:id, :payload, 0)"),
+            [{"id": i, "payload": "x" * 200} for i in range(ROWS)],
+        )
+
+def reader(engine, deadline, counts, errors):
+    while time.perf_counter() < deadline:
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT payload, counter FROM bench_rows WHERE id = :id"), {"id": random.randrange(ROWS)}).fetchone()
+            counts["reads"] += 1
+        except Exception as e:
+            errors.append(str(e).splitlines()[0])
+
+def writer(engine, deadline, counts, errors):
+    while time.perf_counter() < deadline:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("UPDATE bench_rows SET counter = counter + 1 WHERE id = :id"), {"id": random.randrange(ROWS)})
+            counts["writes"] += 1
+        except Exception as e:
+            errors.append(str(e).splitlines()[0])
+
+def run(label, engine, args):
+    setup(engine)
+    deadline = time.perf_counter() + args.duration
+    counts = {"reads": 0, "writes": 0} # Approximate under contention; good enough for a benchmark
+    errors = []
+    threads = [threading.Thread(target=reader, args=(engine, deadline, counts, errors)) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(engine, deadline, counts, errors)) for _ in range(args.writers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:>10}: reads/s={counts['reads'] / elapsed:9.0f}  writes/s={counts['writes'] / elapsed:8.0f}  "
+        f"errors={len(errors)}" + (f" (first: {errors[0]})" if errors else "")
+    )
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS bench_rows"))
+    engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Database URL; defaults to a temporary SQLite file")
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per run")
+    args = parser.parse_args()
+    pool = args.readers + args.writers
+
+    if args.url and not is_sqlite(args.url):
+        run("configured", build_engine(args.url, pool_size=pool, max_overflow=0), args)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            url = args.url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+            run("default", build_engine(url, pool_size=pool, max_overflow=0, sqlite_pragmas=False), args)
+            if not args.url:
+                # journal_mode=WAL persists in the file; start the tuned run from a new one
+                url = f"sqlite:///{os.path.join(tmp, 'bench_tuned.db')}"
+            run("tuned", build_engine(url, pool_size=pool, max_overflow=0), args)
@@ -0,0 +1,71 @@
+"""
+Serialization time and response size of the largest endpoints.
+
+Runs the app in-process against the configured database (DATABASE_URL or
+./meubanco.db) as the given user and, for each endpoint, compares:
+  - stdlib json.dumps vs orjson (the API's default response class) on the payload;
+  - bytes on the wire without and with gzip (GZipMiddleware).
+
+    python backend/benchmark_responses.py --user-id 2 --notebook-id 5
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+import orjson
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi.testclient import TestClient
+from backend import auth, main, models
+from backend.database import SessionLocal
+from backend.main import GZIP_MINIMUM_SIZE
+
+def time_per_call(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--notebook-id", type=int, help="Notebook for resolve_data; defaults to the user's first")
+    parser.add_argument("--question-id", type=int, help="Question for comments; defaults to the first question")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    user = db.get(models.User, args.user_id)
+    if user is None:
+        sys.exit(f"User {args.user_id} not found")
+    notebook_id = args.notebook_id or db.query(models.Notebook.id).filter(models.Notebook.user_id == user.id).limit(1).scalar()
+    question_id = args.question_id or db.query(models.Question.id).limit(1).scalar()
+    db.close()
+
+    token = auth.create_access_token({"sub": user.username, "id": user.id})
+    headers = {"Authorization": f"Bearer {token}"}
+    paths = ["/api/favorites/", "/api/users/me/wrong-questions"]
+    if notebook_id:
+        paths.insert(0, f"/api/notebooks/{notebook_id}/resolve_data")
+    if question_id:
+        paths.append(f"/api/questions/{question_id}/comments")
+
+    client = TestClient(main.app)
+    print(f"{'endpoint':<45} {'json ms':>8} {'orjson ms':>9} {'bytes':>9} {'gzip bytes':>10}")
+    for path in paths:
+        response = client.get(path, headers={**headers, "Accept-Encoding": "identity"})
+        if response.status_code != 200:
+            print(f"{path:<45} HTTP {response.status_code}")
+            continue
+        payload = response.json()
+        stdlib_ms = time_per_call(lambda: json.dumps(payload, ensure_ascii=False).encode("utf-8"), args.iterations)
+        orjson_ms = time_per_call(lambda: orjson.dumps(payload), args.iterations)
+        raw = len(response.content)
+        compressed = client.get(path, headers={**headers, "Accept-Encoding": "gzip"})
+        # httpx decodes the body, so recompress it at the middleware level to get the wire size
+        wire = len(gzip.compress(response.content, compresslevel=6)) if compressed.headers.get("content-encoding") == "gzip" else raw
+        note = "" if raw >= GZIP_MINIMUM_SIZE else "  (below gzip threshold)"
+        print(f"{path:<45} {stdlib_ms:8.3f} {orjson_ms:9.3f} {raw:9d} {wire:10d}{note}")
@@ -0,0 +1,71 @@
+"""
+Per-item cost of serializing question lists, before and after the fast path.
+
+Builds N in-memory questions (no database needed) and times, per question:
+  - orm:       FastAPI validating ORM rows through response_model (from_attributes);
+  - validated: schemas.Question(**render) re-validated by response_model;
+  - fast:      crud.question_payloads (cached JSON-ready dicts) rendered by JSONResponse.
+
+    python backend/benchmark_serialization.py --questions 1000
+"""
+import argparse
+import os
+import sys
+import time
+from typing import List
+
+import orjson
+from pydantic import TypeAdapter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend import crud, models, schemas
+from backend.responses import JSONResponse
+
+adapter = TypeAdapter(List[schemas.Question])
+
+def make_questions(n: int) -> List[models.Question]:
+    return [
+        models.Question(
+            id=i, enunciado=f"<p>Enunciado da questão {i} com um texto de tamanho realista para a prova.</p>",
+            item_a="<p>Alternativa A</p>", item_b="<p>Alternativa B</p>", item_c="<p>Alternativa C</p>",
+            item_d="<p>Alternativa D</p>", item_e="<p>Alternativa E</p>",
+            materia="Português", assunto="Crase", banca="CESPE", orgao="TRF", cargo="Analista", ano=2024,
+            escolaridade="Superior", dificuldade="Média", regiao="Nacional", gabarito="C",
+            informacoes=None, tipo="multipla", is_anulada=False, is_desatualizada=False, version=1,
+        )
+        for i in range(1, n + 1)
+    ]
+
+def response_model_path(items) -> bytes:
+    # What FastAPI does with a response_model: dump models, validate again, dump to JSON-able data
+    prepared = [item.model_dump() if isinstance(item, schemas.Question) else item for item in items]
+    validated = adapter.validate_python(prepared, from_attributes=True)
+    return orjson.dumps(adapter.dump_python(validated, mode="json"))
+
+def orm(questions):
+    return response_model_path(questions)
+
+def validated(questions):
+    return response_model_path([schemas.Question(**crud.render_question(q)) for q in questions])
+
+def fast(questions):
+    return JSONResponse(crud.question_payloads(questions)).body
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    questions = make_questions(args.questions)
+    for q in questions:
+        crud.render_question(q) # Warm the render cache, as in steady state
+
+    print(f"{'path':<10} {'us/item':>8} {'bytes':>9}")
+    for name, fn in (("orm", orm), ("validated", validated), ("fast", fast)):
+        body = fn(questions)
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            fn(questions)
+        per_item = (time.perf_counter() - start) / args.rounds / args.questions * 1e6
+        print(f"{name:<10} {per_item:8.2f} {len(body):9d}")
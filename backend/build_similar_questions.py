@@ -0,0 +1,32 @@
+"""
+Builds the similar-questions index (backend/similar_questions.py) and saves it to
+SIMILAR_QUESTIONS_INDEX_PATH, so the API loads it on startup instead of tokenizing
+the whole bank:
+
+    python backend/build_similar_questions.py
+
+Run it after a bulk import or ahead of a deploy; the API rebuilds the file by itself
+when it no longer matches the questions table.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend import similar_questions
+from backend.database import SessionLocal
+from backend.similar_questions import similar_question_index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default=similar_questions.SIMILAR_QUESTIONS_INDEX_PATH)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        total = similar_question_index.rebuild(db, args.path)
+    finally:
+        db.close()
+    print(f"{total} questions indexed in {time.perf_counter() - start:.1f}s; saved to {args.path}")
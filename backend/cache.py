@@ -0,0 +1,87 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+import threading
+import time
+
+class LRUCache:
+    """
+    Thread-safe in-memory cache with least-recently-used eviction.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def peek(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        """
+        Value of `key` without counting a hit or miss or refreshing its LRU position.
+        """
+        with self._lock:
+            return self._data.get(key, default)
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+class TTLCache(LRUCache):
+    """
+    LRUCache whose entries also expire after `ttl` seconds (or a per-entry ttl).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        super().__init__(maxsize)
+        self.ttl = ttl
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        entry = super().get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            self.pop(key)
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return default
+        return value
+
+    def peek(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        entry = super().peek(key)
+        if entry is None or time.monotonic() >= entry[0]:
+            return default
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        super().set(key, (time.monotonic() + ttl, value))
@@ -1,12 +1,23 @@
-from sqlalchemy.orm import Session, joinedload
-from backend import models, schemas
-from typing import List, Optional, Dict, Any, Union
-from sqlalchemy import distinct, func
+from sqlalchemy.orm import Session, joinedload, object_session, undefer_group
+from backend import models, schemas, answer_stats, question_text, near_duplicates, recommendations, review_schedule, topic_tree
+from backend.answer_key import answer_key
+from backend.near_duplicates import near_duplicate_index
+from backend.similar_questions import similar_question_index
+from backend.question_facets import question_facets
+from backend.question_sync import question_sync
+from backend.cache import LRUCache, TTLCache
+from backend.singleflight import single_flight
+from typing import Callable, List, Optional, Dict, Any, Tuple, Union
+from sqlalchemy import bindparam, distinct, func, insert, select, update
+import hashlib
 import json
+import logging
 from fastapi.encoders import jsonable_encoder
 from datetime import datetime, date # Import datetime
 import re # Importar módulo de expressões regulares
 
+logger = logging.getLogger(__name__)
+
 # Função auxiliar para remover tags <p> e </p>
 def strip_p_tags(text: Optional[str]) -> Optional[str]:
     if text is None:
@@ -15,6 +26,13 @@ def strip_p_tags(text: Optional[str]) -> Optional[str]:
     cleaned_text = re.sub(r'</?p>', '', text).strip()
     return cleaned_text
 
+def question_content_hash(question: Union[Dict[str, Any], models.Question, schemas.QuestionCreate]) -> str:
+    """
+    SHA-256 of the statement and alternatives with HTML, case and whitespace normalized;
+    equal for the same question typed or formatted differently. Used to dedupe imports.
+    """
+    return hashlib.sha256("\x1f".join(question_text.normalized_fields(question)).encode("utf-8")).hexdigest()
+
 # --- CRUD Functions for Users ---
 
 def get_user(db: Session, user_id: int):
@@ -77,14 +95,14 @@ def update_user_status(db: Session, user_id: int, is_active: bool):
 
 def get_question(db: Session, question_id: int):
     """
-    Gets a question by ID.
+    Gets a question by ID, with all its text columns.
     """
-    return db.query(models.Question).filter(models.Question.id == question_id).first()
+    return db.query(models.Question).options(
+        undefer_group("texto"), undefer_group("comentario")
+    ).filter(models.Question.id == question_id).first()
 
-def get_questions(
-    db: Session,
-    skip: int = 0,
-    limit: int = 100,
+def filter_questions(
+    query,
     materia: Optional[str] = None,
     assuntos: Optional[List[str]] = None,
     banca: Optional[Union[str, List[str]]] = None,
@@ -95,18 +113,20 @@ def get_questions(
     dificuldade: Optional[Union[str, List[str]]] = None,
     regiao: Optional[Union[str, List[str]]] = None,
     exclude_anuladas: Optional[bool] = False,
-    exclude_desatualizadas: Optional[bool] = False
-) -> List[models.Question]:
+    exclude_desatualizadas: Optional[bool] = False,
+    topic_id: Optional[int] = None
+):
     """
-    Lists questions with optional filters, including annulment/outdated status.
-    Accepts single values or lists for filtering fields.
+    Applies the question list filters to a query on `questions` (get_questions, exports).
+    Accepts single values or lists for filtering fields. `topic_id` keeps the questions of
+    that assunto and of all its sub-assuntos (topic_tree).
     """
-    query = db.query(models.Question)
-
     if materia:
         query = query.filter(models.Question.materia == materia)
     if assuntos:
         query = query.filter(models.Question.assunto.in_(assuntos))
+    if topic_id is not None:
+        query = topic_tree.filter_subtree(query, topic_id)
 
     if banca:
         if isinstance(banca, list):
@@ -155,9 +175,40 @@ def get_questions(
     if exclude_desatualizadas:
         query = query.filter(models.Question.is_desatualizada == False)
 
+    return query
+
+def get_questions(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    materia: Optional[str] = None,
+    assuntos: Optional[List[str]] = None,
+    banca: Optional[Union[str, List[str]]] = None,
+    orgao: Optional[Union[str, List[str]]] = None,
+    cargo: Optional[Union[str, List[str]]] = None,
+    ano: Optional[Union[int, List[int]]] = None,
+    escolaridade: Optional[Union[str, List[str]]] = None,
+    dificuldade: Optional[Union[str, List[str]]] = None,
+    regiao: Optional[Union[str, List[str]]] = None,
+    exclude_anuladas: Optional[bool] = False,
+    exclude_desatualizadas: Optional[bool] = False,
+    topic_id: Optional[int] = None
+) -> List[models.Question]:
+    """
+    Lists questions with optional filters, including annulment/outdated status.
+    Accepts single values or lists for filtering fields.
+    """
+    query = filter_questions(
+        db.query(models.Question), materia=materia, assuntos=assuntos, banca=banca, orgao=orgao, cargo=cargo,
+        ano=ano, escolaridade=escolaridade, dificuldade=dificuldade, regiao=regiao,
+        exclude_anuladas=exclude_anuladas, exclude_desatualizadas=exclude_desatualizadas, topic_id=topic_id
+    )
     return query.offset(skip).limit(limit).all()
 
 
+COUNT_CACHE_TTL_SECONDS = 5 # Identical filter counts within this window share one query
+
+@single_flight(ttl=COUNT_CACHE_TTL_SECONDS)
 def count_questions(
     db: Session,
     materia: Optional[str] = None,
@@ -170,7 +221,8 @@ def count_questions(
     dificuldade: Optional[List[str]] = None,
     regiao: Optional[List[str]] = None,
     exclude_anuladas: Optional[bool] = False,
-    exclude_desatualizadas: Optional[bool] = False
+    exclude_desatualizadas: Optional[bool] = False,
+    topic_id: Optional[int] = None
 ) -> Dict[str, Any]:
     """
     Counts the number of questions based on filters and returns their IDs,
@@ -181,6 +233,8 @@ def count_questions(
         query = query.filter(models.Question.materia == materia)
     if assuntos:
         query = query.filter(models.Question.assunto.in_(assuntos))
+    if topic_id is not None:
+        query = topic_tree.filter_subtree(query, topic_id)
     if banca:
         query = query.filter(models.Question.banca.in_(banca))
     if orgao:
@@ -207,6 +261,7 @@ def create_question(db: Session, question: schemas.QuestionCreate):
     """
     Creates a new question in the database.
     """
+    signature = near_duplicates.signature(question)
     db_question = models.Question(
         enunciado=question.enunciado,
         item_a=question.item_a,
@@ -228,11 +283,20 @@ def create_question(db: Session, question: schemas.QuestionCreate):
         comentarioProfessor=question.comentarioProfessor,
         tipo=question.tipo,
         is_anulada=question.is_anulada,
-        is_desatualizada=question.is_desatualizada
+        is_desatualizada=question.is_desatualizada,
+        content_hash=question_content_hash(question),
+        minhash=near_duplicates.to_bytes(signature),
+        topic_id=topic_tree.topic_id(db, question.materia, question.assunto)
     )
     db.add(db_question)
     db.commit()
     db.refresh(db_question)
+    question_sync.applied([db_question.id])
+    answer_key.set(db_question.id, db_question.gabarito, db_question.tipo)
+    near_duplicate_index.set(db_question.id, signature)
+    similar_question_index.set(db_question.id, db_question.enunciado, db_question.assunto)
+    question_facets.set(db_question.id, db_question.materia, db_question.assunto, db_question.is_anulada, db_question.is_desatualizada)
+    count_questions.invalidate()
     return db_question
 
 def update_question(db: Session, question_id: int, question_update: schemas.QuestionCreate):
@@ -243,9 +307,20 @@ def update_question(db: Session, question_id: int, question_update: schemas.Ques
     if db_question:
         for key, value in question_update.dict(exclude_unset=True).items():
             setattr(db_question, key, value)
+        db_question.content_hash = question_content_hash(db_question)
+        signature = near_duplicates.signature(db_question)
+        db_question.minhash = near_duplicates.to_bytes(signature)
+        db_question.topic_id = topic_tree.topic_id(db, db_question.materia, db_question.assunto)
         db.add(db_question)
+        db.add(models.QuestionChange(question_id=question_id))
         db.commit()
         db.refresh(db_question)
+        invalidate_question_render(question_id)
+        answer_key.set(db_question.id, db_question.gabarito, db_question.tipo)
+        near_duplicate_index.set(db_question.id, signature)
+        similar_question_index.set(db_question.id, db_question.enunciado, db_question.assunto)
+        question_facets.set(db_question.id, db_question.materia, db_question.assunto, db_question.is_anulada, db_question.is_desatualizada)
+        count_questions.invalidate()
         return db_question
     return None
 
@@ -260,8 +335,12 @@ def update_question_status(db: Session, question_id: int, status_update: schemas
         if status_update.is_desatualizada is not None:
             db_question.is_desatualizada = status_update.is_desatualizada
         db.add(db_question)
+        db.add(models.QuestionChange(question_id=question_id))
         db.commit()
         db.refresh(db_question)
+        invalidate_question_render(question_id)
+        question_facets.set(db_question.id, db_question.materia, db_question.assunto, db_question.is_anulada, db_question.is_desatualizada)
+        count_questions.invalidate()
         return db_question
     return None
 
@@ -272,10 +351,166 @@ def delete_question(db: Session, question_id: int):
     db_question = db.query(models.Question).filter(models.Question.id == question_id).first()
     if db_question:
         db.delete(db_question)
+        db.add(models.QuestionChange(question_id=question_id))
         db.commit()
+        invalidate_question_render(question_id)
+        answer_key.remove(question_id)
+        near_duplicate_index.remove(question_id)
+        similar_question_index.remove(question_id)
+        question_facets.remove(question_id)
+        count_questions.invalidate()
         return True
     return False
 
+BULK_INSERT_BATCH_SIZE = 500 # Rows per multi-row INSERT
+
+def create_questions_bulk(db: Session, questions: List[Dict[str, Any]], batch_size: int = BULK_INSERT_BATCH_SIZE) -> List[int]:
+    """
+    Inserts many questions (dicts with the QuestionCreate fields) with multi-row INSERTs
+    in one transaction, then patches the answer key once. Returns the new IDs, in order.
+    The content_hash and minhash of each row are computed when missing.
+    """
+    topics = topic_tree.topic_ids(db, ((q["materia"], q["assunto"]) for q in questions))
+    questions = [{
+        **q,
+        "content_hash": q.get("content_hash") or question_content_hash(q),
+        "minhash": q["minhash"] if "minhash" in q else near_duplicates.signature_bytes(q),
+        "topic_id": topics[(q["materia"], q["assunto"])],
+    } for q in questions]
+    ids: List[int] = []
+    for start in range(0, len(questions), batch_size):
+        batch = questions[start:start + batch_size]
+        ids.extend(db.scalars(
+            insert(models.Question).returning(models.Question.id, sort_by_parameter_order=True), batch
+        ).all())
+    db.commit()
+    question_sync.applied(ids)
+    answer_key.set_many((q_id, q['gabarito'], q.get('tipo', 'multipla')) for q_id, q in zip(ids, questions))
+    near_duplicate_index.set_many((q_id, near_duplicates.from_bytes(q['minhash'])) for q_id, q in zip(ids, questions))
+    similar_question_index.set_many((q_id, q['enunciado'], q['assunto']) for q_id, q in zip(ids, questions))
+    question_facets.set_many((q_id, q['materia'], q['assunto'], q.get('is_anulada'), q.get('is_desatualizada'))
+                             for q_id, q in zip(ids, questions))
+    count_questions.invalidate()
+    return ids
+
+def backfill_question_hashes(db: Session, batch_size: int = BULK_INSERT_BATCH_SIZE) -> int:
+    """
+    Computes content_hash for the questions created before it existed. Returns how many were filled.
+    """
+    table = models.Question.__table__
+    statement = table.update().where(table.c.id == bindparam("b_id")).values(content_hash=bindparam("b_hash"))
+    filled = 0
+    while True:
+        rows = db.execute(
+            table.select().with_only_columns(table.c.id, *(table.c[f] for f in question_text.QUESTION_TEXT_FIELDS))
+            .where(table.c.content_hash.is_(None)).limit(batch_size)
+        ).mappings().all()
+        if not rows:
+            break
+        # Core UPDATE: the hash is derived data, so the question version (render cache key) stays the same
+        db.execute(statement, [{"b_id": row["id"], "b_hash": question_content_hash(dict(row))} for row in rows])
+        db.commit()
+        filled += len(rows)
+    if filled:
+        logger.info(f"content_hash filled for {filled} questions.")
+    return filled
+
+def backfill_question_topics(db: Session, progress: Optional[Callable[[float, str], None]] = None,
+                             batch_size: int = BULK_INSERT_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Links the questions created before the topic tree existed to the node of their assunto
+    (topic_tree.topic_id, which creates the missing ones as roots). Runs as the
+    "question_topics" background job, one commit per batch.
+    """
+    table = models.Question.__table__
+    statement = table.update().where(table.c.id == bindparam("b_id")).values(topic_id=bindparam("b_topic"))
+    total = db.query(models.Question.id).filter(models.Question.topic_id.is_(None)).count() or 1
+    summary = {"questoes": 0, "assuntos": 0}
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(table.c.id, table.c.materia, table.c.assunto)
+            .where(table.c.topic_id.is_(None), table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        topics = topic_tree.topic_ids(db, ((materia, assunto) for _, materia, assunto in rows))
+        # Core UPDATE: the topic is not rendered, so the question version (render cache key) stays the same
+        db.execute(statement, [{"b_id": q_id, "b_topic": topics[(materia, assunto)]} for q_id, materia, assunto in rows])
+        db.commit()
+        last_id = rows[-1][0]
+        summary["questoes"] += len(rows)
+        if progress:
+            progress(min(summary["questoes"] / total, 1.0), f"{summary['questoes']} questões ligadas aos assuntos")
+    summary["assuntos"] = db.query(models.Topic.id).count()
+    logger.info(f"Question topics filled: {summary}")
+    return summary
+
+def question_topics_outdated(db: Session) -> bool:
+    """
+    Whether some question is not linked to the topic tree yet (backfill_question_topics).
+    """
+    return db.query(models.Question.id).filter(models.Question.topic_id.is_(None)).first() is not None
+
+def get_topics(db: Session, materia: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    The nodes of the assunto tree (of one materia), parents before children and siblings
+    in outline order, with their depth and the number of questions in their subtree.
+    """
+    closure = models.TopicClosure
+    depth = select(func.max(closure.depth)).where(closure.descendant_id == models.Topic.id).scalar_subquery()
+    query = db.query(models.Topic.id, models.Topic.materia, models.Topic.nome, models.Topic.parent_id,
+                     models.Topic.posicao, depth.label("depth"))
+    if materia:
+        query = query.filter(models.Topic.materia == materia)
+    rows = query.all()
+    counts = dict(
+        db.query(closure.ancestor_id, func.count(models.Question.id))
+        .join(models.Question, models.Question.topic_id == closure.descendant_id)
+        .filter(closure.ancestor_id.in_([row.id for row in rows]))
+        .group_by(closure.ancestor_id).all()
+    ) if rows else {}
+
+    children: Dict[Optional[int], List[Any]] = {}
+    for row in sorted(rows, key=lambda row: (row.posicao, row.nome)):
+        children.setdefault(row.parent_id, []).append(row)
+    ordered, stack = [], list(reversed(children.get(None, [])))
+    while stack:
+        row = stack.pop()
+        ordered.append({"id": row.id, "materia": row.materia, "nome": row.nome, "parent_id": row.parent_id,
+                        "depth": row.depth, "total_questoes": counts.get(row.id, 0)})
+        stack.extend(reversed(children.get(row.id, [])))
+    return sorted(ordered, key=lambda topic: topic["materia"]) if not materia else ordered
+
+def get_question_hashes(db: Session) -> set:
+    """
+    The content_hash of every question (reads only that column).
+    """
+    return {h for (h,) in db.query(models.Question.content_hash).filter(models.Question.content_hash.isnot(None))}
+
+def get_question_version(db: Session, question_id: int) -> Optional[int]:
+    """
+    Returns only the version of a question (None if it does not exist), for ETags.
+    """
+    return db.query(models.Question.version).filter(models.Question.id == question_id).scalar()
+
+def get_question_teacher_comment(db: Session, question_id: int) -> Optional[tuple]:
+    """
+    Returns (version, comentarioProfessor) of a question, reading only those columns; None if it does not exist.
+    """
+    return db.query(models.Question.version, models.Question.comentarioProfessor).filter(
+        models.Question.id == question_id
+    ).first()
+
+def get_questions_fingerprint(db: Session) -> tuple:
+    """
+    (count, max id, sum of versions) of the questions table; changes whenever a
+    question is created, edited or deleted. Used as the ETag of the taxonomy fields.
+    """
+    return tuple(db.query(
+        func.count(models.Question.id), func.max(models.Question.id), func.sum(models.Question.version)
+    ).one())
+
 def get_unique_question_fields(db: Session, field_name: str) -> List[str]:
     """
     Returns a list of unique values for a specific field in the questions table.
@@ -299,10 +534,20 @@ def get_question_statistics(db: Session, question_id: int):
         db.refresh(stats)
     return stats
 
-def update_question_statistics(db: Session, question_id: int, is_correct: bool):
+def update_question_statistics(db: Session, question_id: int, is_correct: bool, answer: Optional[int] = None):
     """
     Updates the statistics of a question.
+    When the chosen alternative is given, its counter is accumulated in memory
+    and written in batches by answer_stats.flush. A due flush runs before the attempt
+    is recorded; its failure is only logged (the counters stay pending), so it never
+    fails a request whose attempt was already committed.
     """
+    if answer is not None and answer_stats.should_flush():
+        try:
+            answer_stats.flush(db)
+        except Exception:
+            logger.warning("Answer distribution flush failed; counters kept for the next flush.")
+
     stats = get_question_statistics(db, question_id) # Ensures statistics exist
     stats.total_attempts += 1
     if is_correct:
@@ -310,14 +555,190 @@ def update_question_statistics(db: Session, question_id: int, is_correct: bool):
     db.add(stats)
     db.commit()
     db.refresh(stats)
+
+    if answer is not None:
+        answer_key.ensure_loaded(db)
+        column = answer_stats.column_for_answer(answer_key.tipo(db, question_id), answer) # Tipo from the key, no query
+        if column:
+            answer_stats.record(question_id, column)
     return stats
 
+def question_statistics_payload(stats: Optional[models.QuestionStatistics], question_id: int) -> schemas.QuestionStatistics:
+    """
+    Builds the statistics schema of a question, including the answer distribution.
+    """
+    return schemas.QuestionStatistics(
+        question_id=question_id,
+        total_attempts=(stats.total_attempts or 0) if stats else 0,
+        correct_attempts=(stats.correct_attempts or 0) if stats else 0,
+        answer_distribution=answer_stats.distribution(stats, question_id)
+    )
+
+RECALIBRATION_BATCH_SIZE = 500
+
+def recalibrate_question_statistics(
+    db: Session,
+    progress: Optional[Callable[[float, str], None]] = None,
+    batch_size: int = RECALIBRATION_BATCH_SIZE
+) -> Dict[str, int]:
+    """
+    Recomputes correct_attempts from the per-alternative counters and the current answer
+    key, e.g. after gabaritos were corrected. Only questions whose counters account for
+    every attempt are recalibrated (older attempts predate the counters); annulled ones
+    are skipped. Runs as the "recalibrate" background job, one commit per batch.
+    """
+    answer_stats.flush(db)
+    total = db.query(func.count(models.QuestionStatistics.id)).scalar() or 0
+    summary = {"verificadas": 0, "recalibradas": 0, "ignoradas": 0}
+    last_id = 0
+    while True:
+        rows = (
+            db.query(models.QuestionStatistics, models.Question.gabarito, models.Question.tipo, models.Question.is_anulada)
+            .join(models.Question, models.Question.id == models.QuestionStatistics.question_id)
+            .filter(models.QuestionStatistics.id > last_id)
+            .order_by(models.QuestionStatistics.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        for stats, gabarito, tipo, is_anulada in rows:
+            summary["verificadas"] += 1
+            column = answer_stats.column_for_answer(tipo, indice_correto(gabarito, tipo))
+            counted = sum(getattr(stats, col) or 0 for col in answer_stats.DISTRIBUTION_KEYS)
+            if is_anulada or column is None or counted != (stats.total_attempts or 0):
+                summary["ignoradas"] += 1
+                continue
+            correct = getattr(stats, column) or 0
+            if correct != stats.correct_attempts:
+                # Conditional on the total read, so an answer recorded meanwhile is not lost
+                summary["recalibradas"] += db.execute(
+                    update(models.QuestionStatistics)
+                    .where(models.QuestionStatistics.id == stats.id,
+                           models.QuestionStatistics.total_attempts == stats.total_attempts)
+                    .values(correct_attempts=correct)
+                ).rowcount
+        last_id = rows[-1][0].id
+        db.commit()
+        db.expunge_all()
+        if progress:
+            progress(summary["verificadas"] / total if total else 1.0, f"{summary['verificadas']} de {total} questões verificadas")
+    logger.info(f"Question statistics recalibrated: {summary}")
+    return summary
+
+def get_question_statistics_bulk(db: Session, question_ids: List[int]) -> List[schemas.QuestionStatistics]:
+    """
+    Returns the statistics of several questions in a single query.
+    Questions without a statistics record get zeroed statistics (nothing is created).
+    """
+    rows = db.query(models.QuestionStatistics).filter(
+        models.QuestionStatistics.question_id.in_(question_ids)
+    ).all()
+    stats_map = {row.question_id: row for row in rows}
+    return [question_statistics_payload(stats_map.get(q_id), q_id) for q_id in question_ids]
+
+def get_split_statistics_bulk(db: Session, user_id: int, question_ids: List[int]) -> Dict[int, Dict[str, Dict[str, int]]]:
+    """
+    Splits the statistics of several questions between the user and everyone else.
+    Uses one query for the totals and one for the user's progress; answers are scored against the in-memory answer key.
+    """
+    answer_key.ensure_loaded(db)
+    totals = {
+        row.question_id: row for row in db.query(models.QuestionStatistics).filter(
+            models.QuestionStatistics.question_id.in_(question_ids)
+        ).all()
+    }
+    user_attempts = {q_id: 0 for q_id in question_ids}
+    user_corrects = {q_id: 0 for q_id in question_ids}
+
+    progresses = db.query(models.NotebookProgress.respostas).filter(
+        models.NotebookProgress.user_id == user_id
+    ).all()
+    for (respostas,) in progresses:
+        respostas = json.loads(respostas) if isinstance(respostas, str) else respostas
+        if not respostas:
+            continue
+        answered = [q_id for q_id in question_ids if respostas.get(str(q_id)) is not None]
+        if not answered:
+            continue
+        mask = answer_key.correct_mask(answered, [respostas[str(q_id)] for q_id in answered], db)
+        for q_id, acertou in zip(answered, mask):
+            user_attempts[q_id] += 1
+            user_corrects[q_id] += int(acertou)
+
+    result = {}
+    for q_id in question_ids:
+        total = totals.get(q_id)
+        total_attempts = (total.total_attempts or 0) if total else 0
+        correct_attempts = (total.correct_attempts or 0) if total else 0
+        result[q_id] = {
+            "total": {"tentativas": total_attempts, "acertos": correct_attempts},
+            "usuario": {"tentativas": user_attempts[q_id], "acertos": user_corrects[q_id]},
+            "outros": {
+                "tentativas": total_attempts - user_attempts[q_id],
+                "acertos": correct_attempts - user_corrects[q_id]
+            }
+        }
+    return result
+
+def get_questions_context(db: Session, user_id: int, question_ids: List[int]) -> List[schemas.QuestionContext]:
+    """
+    Returns, for each question, everything the question screen needs around it:
+    statistics with answer distribution, user/others split, the user's note,
+    favorite status and comment count. Every part is fetched with set-based queries.
+    """
+    if not question_ids:
+        return []
+
+    statistics = {s.question_id: s for s in get_question_statistics_bulk(db, question_ids)}
+    split = get_split_statistics_bulk(db, user_id, question_ids)
+
+    notes = {
+        note.question_id: note for note in db.query(models.QuestionNote).options(
+            joinedload(models.QuestionNote.question)
+        ).filter(
+            models.QuestionNote.user_id == user_id,
+            models.QuestionNote.question_id.in_(question_ids)
+        ).all()
+    }
+    for note in notes.values():
+        note.materia = note.question.materia if note.question else None
+        note.assunto = note.question.assunto if note.question else None
+        note.title = "Anotação" # Default title for the frontend
+
+    favorite_notebooks: Dict[int, List[int]] = {}
+    for q_id, notebook_id in db.query(models.FavoriteQuestion.question_id, models.FavoriteQuestion.notebook_id).filter(
+        models.FavoriteQuestion.user_id == user_id,
+        models.FavoriteQuestion.question_id.in_(question_ids)
+    ).all():
+        favorite_notebooks.setdefault(q_id, []).append(notebook_id)
+
+    comment_counts = dict(
+        db.query(models.Comment.question_id, func.count(models.Comment.id)).filter(
+            models.Comment.question_id.in_(question_ids)
+        ).group_by(models.Comment.question_id).all()
+    )
+
+    return [
+        schemas.QuestionContext(
+            question_id=q_id,
+            statistics=statistics[q_id],
+            split=split[q_id],
+            note=schemas.QuestionNoteResponse.model_validate(notes[q_id]) if q_id in notes else None,
+            is_favorited=q_id in favorite_notebooks,
+            favorite_notebook_ids=favorite_notebooks.get(q_id, []),
+            comment_count=comment_counts.get(q_id, 0)
+        )
+        for q_id in question_ids
+    ]
+
 # NEW FUNCTION: User Statistics
 def get_user_overall_stats(db: Session, user_id: int) -> schemas.UserStats:
     """
     Calculates and returns general study statistics for a user.
     This aggregates data from all of the user's notebook progresses.
     """
+    answer_key.ensure_loaded(db)
     all_user_progresses = db.query(models.NotebookProgress).filter(
         models.NotebookProgress.user_id == user_id
     ).all()
@@ -332,25 +753,8 @@ def get_user_overall_stats(db: Session, user_id: int) -> schemas.UserStats:
         
         total_questoes_resolvidas += len(respostas_salvas)
 
-        if respostas_salvas: # ✅ Correção aqui: de 'respostas_salavas' para 'respostas_salvas'
-            question_ids_in_answers = [int(q_id) for q_id in respostas_salvas.keys()]
-            questions_for_scoring = db.query(models.Question.id, models.Question.gabarito, models.Question.tipo).filter(
-                models.Question.id.in_(question_ids_in_answers)
-            ).all()
-            
-            gabarito_map_multipla = {'A': 0, 'B': 1, 'C': 2, 'D': 3, 'E': 4}
-
-            for q_id, gabarito, tipo in questions_for_scoring:
-                user_answer = respostas_salvas.get(str(q_id))
-                
-                if tipo == "multipla":
-                    correct_index = gabarito_map_multipla.get(gabarito.upper())
-                    if user_answer is not None and user_answer == correct_index:
-                        total_acertos += 1
-                elif tipo == "certo_errado":
-                    correct_value = 1 if gabarito.lower() == 'certo' else 0
-                    if user_answer is not None and user_answer == correct_value:
-                        total_acertos += 1
+        # Scored against the in-memory answer key; no query to the questions table
+        total_acertos += answer_key.score(respostas_salvas, db)[1]
     
     total_erros = total_questoes_resolvidas - total_acertos
     percentual_acerto = (total_acertos / total_questoes_resolvidas) * 100 if total_questoes_resolvidas > 0 else 0.0
@@ -432,26 +836,10 @@ def get_notebook_with_questions(db: Session, notebook_id: int, user_id: int):
             ).all()
         }
 
-        for q in questions:
-            q_dict = q.__dict__.copy() # Copy to avoid modifying the SQLAlchemy object directly
-            
-            # Use transformar_alternativas to get the formatted alternatives
-            q_dict['alternativas'] = transformar_alternativas(q)
-
-            correta_index = None
-            if q.tipo == "multipla":
-                # Maps 'A'->0, 'B'->1, etc.
-                gabarito_map = {'A': 0, 'B': 1, 'C': 2, 'D': 3, 'E': 4}
-                correta_index = gabarito_map.get(q.gabarito.upper())
-            elif q.tipo == "certo_errado":
-                # 'Certo' -> 1, 'Errado' -> 0
-                correta_index = 1 if q.gabarito.lower() == 'certo' else (0 if q.gabarito.lower() == 'errado' else None)
-            
-            q_dict['correta'] = correta_index
-            q_dict['is_favorited'] = q.id in favorite_question_ids # Add favorited status
-            processed_questions.append(schemas.Question(**q_dict)) # Convert to Question schema
-
-    db_notebook.questions_data = processed_questions # Add the list of Question objects to the notebook
+        # Alternatives, correct index and cleaned text come from the render cache
+        processed_questions = question_payloads(questions, favorite_ids=favorite_question_ids)
+
+    db_notebook.questions_data = processed_questions # Add the list of question payloads to the notebook
 
     # Load progress SEPARATELY
     db_notebook.progress_data = get_notebook_progress(db, notebook_id, user_id) # Call the existing function
@@ -467,7 +855,11 @@ def get_user_notebooks(db: Session, user_id: int) -> List[models.Notebook]:
     """
     Lists all notebooks of a specific user, including progress statistics.
     """
+    answer_key.ensure_loaded(db)
     notebooks = db.query(models.Notebook).filter(models.Notebook.user_id == user_id).all()
+    progresses = {}
+    for progress in db.query(models.NotebookProgress).filter(models.NotebookProgress.user_id == user_id).all():
+        progresses.setdefault(progress.notebook_id, progress)
     for notebook in notebooks:
         # Convert back from JSON string to Python objects
         notebook.questoes_ids = json.loads(notebook.questoes_ids)
@@ -476,37 +868,12 @@ def get_user_notebooks(db: Session, user_id: int) -> List[models.Notebook]:
         # Add question count for display in MyNotebooks
         notebook.total_questoes = len(notebook.questoes_ids)
 
-        # Fetch progress for each notebook to get correct/answered
-        progress = db.query(models.NotebookProgress).filter(
-            models.NotebookProgress.notebook_id == notebook.id,
-            models.NotebookProgress.user_id == user_id
-        ).first()
+        # Correct/answered come from the progress fetched above, scored against the answer key
+        progress = progresses.get(notebook.id)
         if progress:
             # Check if responses is a JSON string before trying to load
             respostas_salvas = json.loads(progress.respostas) if isinstance(progress.respostas, str) else progress.respostas
-            notebook.respondidas = len(respostas_salvas)
-            
-            acertos_count = 0
-            if respostas_salvas:
-                question_ids_in_answers = [int(q_id) for q_id in respostas_salvas.keys()]
-                questions_for_scoring = db.query(models.Question.id, models.Question.gabarito, models.Question.tipo).filter(
-                    models.Question.id.in_(question_ids_in_answers)
-                ).all()
-                
-                gabarito_map_multipla = {'A': 0, 'B': 1, 'C': 2, 'D': 3, 'E': 4}
-
-                for q_id, gabarito, tipo in questions_for_scoring:
-                    user_answer = respostas_salvas.get(str(q_id))
-                    
-                    if tipo == "multipla":
-                        correct_index = gabarito_map_multipla.get(gabarito.upper())
-                        if user_answer is not None and user_answer == correct_index:
-                            acertos_count += 1
-                    elif tipo == "certo_errado":
-                        correct_value = 1 if gabarito.lower() == 'certo' else 0
-                        if user_answer is not None and user_answer == correct_value:
-                            acertos_count += 1
-            notebook.acertos = acertos_count
+            notebook.respondidas, notebook.acertos = answer_key.score(respostas_salvas, db)
         else:
             notebook.respondidas = 0
             notebook.acertos = 0
@@ -524,6 +891,13 @@ def delete_notebook(db: Session, notebook_id: int):
         db_progress = db.query(models.NotebookProgress).filter(models.NotebookProgress.notebook_id == notebook_id).first()
         if db_progress:
             db.delete(db_progress)
+        # The user's answer history stays, without the notebook
+        db.query(models.UserQuestionState).filter(
+            models.UserQuestionState.user_id == db_notebook.user_id, # Uses the user's index
+            models.UserQuestionState.notebook_id == notebook_id
+        ).update(
+            {models.UserQuestionState.notebook_id: None}, synchronize_session=False
+        )
         
         db.delete(db_notebook)
         db.commit()
@@ -576,6 +950,18 @@ def create_or_update_notebook_progress(db: Session, notebook_id: int, user_id: i
         models.NotebookProgress.user_id == user_id
     ).first()
 
+    # Answers that are new or changed since the last save count as attempts
+    anteriores = {}
+    if db_progress:
+        anteriores = (json.loads(db_progress.respostas) if isinstance(db_progress.respostas, str) else db_progress.respostas) or {}
+    novas = {q_id: resposta for q_id, resposta in progress_data.respostas.items()
+             if resposta is not None and anteriores.get(q_id) != resposta}
+    if novas:
+        answer_key.ensure_loaded(db)
+        acertos = answer_key.correct_mask(novas.keys(), novas.values(), db)
+        record_user_answers(db, user_id, {int(q_id): bool(acertou) for q_id, acertou in zip(novas, acertos)},
+                            notebook_id=notebook_id)
+
     if db_progress:
         db_progress.index = progress_data.index
         db_progress.respostas = json.dumps(progress_data.respostas) # Convert dict to JSON string
@@ -594,6 +980,63 @@ def create_or_update_notebook_progress(db: Session, notebook_id: int, user_id: i
     db_progress.respostas = json.loads(db_progress.respostas) if isinstance(db_progress.respostas, str) else db_progress.respostas
     return db_progress
 
+def record_user_answers(db: Session, user_id: int, results: Dict[int, bool], answered_at: Optional[datetime] = None,
+                        notebook_id: Optional[int] = None) -> None:
+    """
+    Adds one attempt per {question_id: correct} to the user's UserQuestionState and
+    UserTopicStats rows (created when missing) and advances the review schedule of each
+    question (review_schedule). Does not commit: runs inside the caller's transaction.
+    """
+    question_facets.ensure_loaded(db)
+    question_facets.ensure_known(db, results.keys())
+    answered_at = answered_at or datetime.utcnow()
+    answers = [(q_id, correct, code) for (q_id, correct), code
+               in zip(results.items(), question_facets.topics_of(results.keys()).tolist()) if code] # Deleted questions are skipped
+    if not answers:
+        return
+
+    states = {
+        state.question_id: state for state in db.query(models.UserQuestionState).filter(
+            models.UserQuestionState.user_id == user_id,
+            models.UserQuestionState.question_id.in_([q_id for q_id, _, _ in answers])
+        )
+    }
+    topics: Dict[Tuple[str, str], List[int]] = {}
+    for q_id, correct, code in answers:
+        state = states.get(q_id)
+        if state is None:
+            state = models.UserQuestionState(user_id=user_id, question_id=q_id, tentativas=0, acertos=0, repeticoes=0,
+                                             intervalo_dias=0, facilidade=review_schedule.INITIAL_EASE)
+            db.add(state)
+        state.tentativas += 1
+        state.acertos += int(correct)
+        state.ultimo_acerto = correct
+        state.respondida_em = answered_at
+        state.notebook_id = notebook_id
+        state.repeticoes, state.intervalo_dias, state.facilidade, state.revisar_em = review_schedule.next_review(
+            state.repeticoes, state.intervalo_dias, state.facilidade, correct, answered_at,
+            scheduled=state.revisar_em is not None
+        )
+        counts = topics.setdefault(question_facets.topic(code), [0, 0])
+        counts[0] += 1
+        counts[1] += int(correct)
+
+    existing = {
+        (row.materia, row.assunto): row for row in db.query(models.UserTopicStats).filter(
+            models.UserTopicStats.user_id == user_id,
+            models.UserTopicStats.assunto.in_({assunto for _, assunto in topics})
+        )
+    }
+    for (materia, assunto), (tentativas, acertos) in topics.items():
+        row = existing.get((materia, assunto))
+        if row is None:
+            row = models.UserTopicStats(user_id=user_id, materia=materia, assunto=assunto, tentativas=0, acertos=0)
+            db.add(row)
+        row.tentativas += tentativas
+        row.acertos += acertos
+        row.atualizado_em = answered_at
+    invalidate_recommendations(user_id)
+
 # --- CRUD Functions for Comments ---
 
 def create_comment(db: Session, question_id: int, user_id: int, content: str):
@@ -611,6 +1054,16 @@ def create_comment(db: Session, question_id: int, user_id: int, content: str):
     db.refresh(db_comment)
     return db_comment
 
+_COMMENT_SCHEMA_FIELDS = [name for name in schemas.Comment.model_fields if name != 'user']
+
+def comment_schema(comment: models.Comment) -> schemas.Comment:
+    """
+    Maps a comment row (with its author loaded) to the Comment schema without re-validating it.
+    """
+    fields = {name: getattr(comment, name) for name in _COMMENT_SCHEMA_FIELDS}
+    fields['user'] = schemas.UserForComment.model_construct(id=comment.author.id, username=comment.author.username)
+    return schemas.Comment.model_construct(**fields)
+
 def get_comments_for_question(db: Session, question_id: int, order_by: str = "createdAt", order_direction: str = "desc"):
     """
     Gets all comments for a question, with sorting options.
@@ -630,14 +1083,7 @@ def get_comments_for_question(db: Session, question_id: int, order_by: str = "cr
 
     comments = query.options(joinedload(models.Comment.author)).all() # Loads the author together
 
-    formatted_comments = []
-    for comment in comments:
-        comment_dict = comment.__dict__.copy()
-        # Ensure 'user' is a UserForComment object for the return schema
-        comment_dict['user'] = schemas.UserForComment(id=comment.author.id, username=comment.author.username)
-        formatted_comments.append(schemas.Comment(**comment_dict))
-    
-    return formatted_comments
+    return [comment_schema(comment) for comment in comments]
 
 def update_comment(db: Session, comment_id: int, user_id: int, content: str):
     """
@@ -652,10 +1098,7 @@ def update_comment(db: Session, comment_id: int, user_id: int, content: str):
         db.add(db_comment)
         db.commit()
         db.refresh(db_comment)
-        db_comment.author # Loads the author for the schema
-        comment_dict = db_comment.__dict__.copy()
-        comment_dict['user'] = schemas.UserForComment(id=db_comment.author.id, username=db_comment.author.username)
-        return schemas.Comment(**comment_dict)
+        return comment_schema(db_comment)
     return None
 
 def delete_comment(db: Session, comment_id: int, user_id: int):
@@ -717,16 +1160,7 @@ def vote_comment(db: Session, comment_id: int, user_id: int, vote_type: str):
     # Ensure the author is loaded for the return
     comment.author = comment.author or db.query(models.User).filter_by(id=comment.user_id).first()
 
-    comment_dict = comment.__dict__.copy()
-    comment_dict['user'] = schemas.UserForComment(id=comment.author.id, username=comment.author.username)
-
-    return schemas.Comment(**comment_dict)
-
-    # Ensure the comment author comes with the response
-    comment.author = comment.author if comment.author else db.query(models.User).filter_by(id=comment.user_id).first()
-    comment_dict = comment.__dict__.copy()
-    comment_dict['user'] = schemas.UserForComment(id=comment.author.id, username=comment.author.username)
-    return schemas.Comment(**comment_dict)
+    return comment_schema(comment)
 
 def get_comments_with_vote_status(db: Session, question_id: int, user_id: int):
     comments = (
@@ -748,16 +1182,10 @@ def get_comments_with_vote_status(db: Session, question_id: int, user_id: int):
 
     formatted_comments = []
     for c in comments:
-        comment_dict = c.__dict__.copy()
-        comment_dict["user"] = schemas.UserForComment(
-            id=c.author.id,
-            username=c.author.username
-        )
-        comment_data = schemas.Comment(**comment_dict)
-        formatted_comments.append({
-            **comment_data.model_dump(),
-            "voted_by_me": vote_map.get(c.id)
-        })
+        comment_data = {name: getattr(c, name) for name in _COMMENT_SCHEMA_FIELDS}
+        comment_data["user"] = {"id": c.author.id, "username": c.author.username}
+        comment_data["voted_by_me"] = vote_map.get(c.id)
+        formatted_comments.append(comment_data)
 
     return formatted_comments
 
@@ -858,6 +1286,23 @@ def get_all_theory_metadata(db: Session) -> List[schemas.TheoryMeta]:
     
     return result
 
+def get_theories_fingerprint(db: Session) -> tuple:
+    """
+    (count, last update, sum of versions) of the theories; ETag of the metadata tree.
+    """
+    return tuple(db.query(
+        func.count(models.Theory.id), func.max(models.Theory.updated_at), func.sum(models.Theory.version)
+    ).one())
+
+def get_theory_version(db: Session, materia: str, assunto: str):
+    """
+    Returns (id, version, updated_at) of a theory without loading its content, or None.
+    """
+    return db.query(models.Theory.id, models.Theory.version, models.Theory.updated_at).filter(
+        func.lower(models.Theory.materia) == materia.strip().lower(),
+        func.lower(models.Theory.assunto) == assunto.strip().lower()
+    ).first()
+
 def get_theory(db: Session, materia: str, assunto: str):
     return db.query(models.Theory).filter(
         func.lower(models.Theory.materia) == materia.strip().lower(),
@@ -920,10 +1365,11 @@ def get_favorite_question(db: Session, user_id: int, question_id: int, notebook_
         models.FavoriteQuestion.notebook_id == notebook_id
     ).first()
 
-def get_all_favorite_questions_for_user(db: Session, user_id: int) -> List[schemas.FavoriteQuestion]:
+def get_all_favorite_questions_for_user(db: Session, user_id: int) -> List[Dict[str, Any]]:
     """
     Returns all favorite questions of a user, with complete question data
-    and the name of the notebook from which it was favorited.
+    and the name of the notebook from which it was favorited, as dicts
+    shaped like schemas.FavoriteQuestion.
     """
     favorite_entries = db.query(models.FavoriteQuestion).filter(
         models.FavoriteQuestion.user_id == user_id
@@ -931,39 +1377,25 @@ def get_all_favorite_questions_for_user(db: Session, user_id: int) -> List[schem
         joinedload(models.FavoriteQuestion.question),
         joinedload(models.FavoriteQuestion.notebook)
     ).all()
+    prefetch_renders([entry.question for entry in favorite_entries if entry.question is not None])
 
     favorited_questions_data = []
     for entry in favorite_entries:
         question_data = entry.question
         notebook_name = entry.notebook.nome if entry.notebook else "Caderno Desconhecido"
         
-        # Map question data to the frontend Question schema
-        q_dict = question_data.__dict__.copy()
-        # Use transformar_alternativas to get the formatted alternatives
-        q_dict['alternativas'] = transformar_alternativas(question_data) # Pass the question object here
-
-        correta_index = None
-        if q_dict.get('tipo') == "multipla":
-            gabarito_map = {'A': 0, 'B': 1, 'C': 2, 'D': 3, 'E': 4}
-            correta_index = gabarito_map.get(q_dict.get('gabarito', '').upper())
-        elif q_dict.get('tipo') == "certo_errado":
-            correta_index = 1 if q_dict.get('gabarito', '').lower() == 'certo' else (0 if q_dict.get('gabarito', '').lower() == 'errado' else None)
-        
-        q_dict['correta'] = correta_index
-        q_dict['is_favorited'] = True # Always True for questions in this list
-
         # Ensure favorited_at is a valid datetime. If None, use datetime.now() as fallback.
         safe_favorited_at = entry.favorited_at if entry.favorited_at else datetime.now()
 
-        favorited_questions_data.append(schemas.FavoriteQuestion(
-            id=entry.id,
-            user_id=entry.user_id,
-            question_id=entry.question_id,
-            notebook_id=entry.notebook_id,
-            favorited_at=safe_favorited_at, # Use the safe value
-            question=schemas.Question(**q_dict), # Pass the mapped question
-            notebook_name=notebook_name
-        ))
+        favorited_questions_data.append({
+            "question_id": entry.question_id,
+            "notebook_id": entry.notebook_id,
+            "id": entry.id,
+            "user_id": entry.user_id,
+            "favorited_at": safe_favorited_at, # Use the safe value
+            "question": question_payload(question_data, is_favorited=True), # Always favorited in this list
+            "notebook_name": notebook_name
+        })
     return favorited_questions_data
 
 def get_note_by_user_and_question(db: Session, user_id: int, question_id: int):
@@ -1056,82 +1488,168 @@ def search_questions(db: Session, query: Optional[str]) -> List[models.Question]
 def search_questions_by_enunciado(db: Session, search: str) -> List[models.Question]:
     return db.query(models.Question).filter(models.Question.enunciado.ilike(f"%{search}%")).limit(5).all()
 
-def get_user_wrong_questions(db: Session, user_id: int):
+def _answered_questions(db: Session, states: List[Tuple[int, Optional[int]]]) -> List[Tuple[Any, models.Question, Optional[models.Notebook]]]:
+    # [(question ID, notebook ID)] of UserQuestionState rows -> [(row, question, notebook)], in the same order.
+    # The queries join the questions, so rows are only left out when a question is deleted meanwhile;
+    # notebook is None when the notebook was deleted.
+    questoes = {
+        q.id: q for q in db.query(models.Question).filter(models.Question.id.in_({state[0] for state in states})).all()
+    } if states else {}
+    notebooks = {
+        nb.id: nb for nb in db.query(models.Notebook).filter(
+            models.Notebook.id.in_({state[1] for state in states if state[1] is not None})
+        ).all()
+    } if states else {}
+    prefetch_renders(list(questoes.values()))
+    return [(state, questoes[state[0]], notebooks.get(state[1])) for state in states if state[0] in questoes]
+
+def get_user_wrong_questions(db: Session, user_id: int, skip: int = 0, limit: Optional[int] = None):
     """
-    Retorna todas as questões que o usuário errou, com nome do caderno.
+    Retorna as questões cuja resposta mais recente do usuário está errada, com nome do caderno
+    em que foram respondidas, das mais recentes para as mais antigas. Lê UserQuestionState pelo
+    índice ix_user_question_state_erradas, sem reprocessar o histórico de respostas.
     """
-    from .models import NotebookProgress, Notebook, Question
-    from .schemas import FavoriteQuestion
-    from datetime import datetime
-    import json
+    # Os joins vêm antes do OFFSET/LIMIT: questões e cadernos excluídos não encurtam a página
+    states = db.query(models.UserQuestionState.question_id, models.UserQuestionState.notebook_id).join(
+        models.Question, models.Question.id == models.UserQuestionState.question_id
+    ).join(
+        models.Notebook, models.Notebook.id == models.UserQuestionState.notebook_id # O formato exige o caderno
+    ).filter(
+        models.UserQuestionState.user_id == user_id,
+        models.UserQuestionState.ultimo_acerto == False
+    ).order_by(models.UserQuestionState.respondida_em.desc()).offset(skip).limit(limit).all()
 
     wrong_questions = []
-
-    progresses = db.query(NotebookProgress).filter(NotebookProgress.user_id == user_id).all()
-
-    g_map = {'A': 0, 'B': 1, 'C': 2, 'D': 3, 'E': 4}
-
-    for progress in progresses:
-        # Lê e trata as respostas do progresso
-        respostas = json.loads(progress.respostas) if isinstance(progress.respostas, str) else progress.respostas
-        if not isinstance(respostas, dict):
-            continue
-
-        # Converte chaves para inteiro
-        try:
-            respostas = {int(k): v for k, v in respostas.items()}
-        except Exception:
-            continue
-
-        # Recupera caderno e questões
-        notebook = db.query(Notebook).filter_by(id=progress.notebook_id).first()
-        if not respostas or not notebook:
+    for _, q, notebook in _answered_questions(db, states):
+        if notebook is None: # Excluído entre as duas consultas
             continue
+        wrong_questions.append({ # Mesmo formato de schemas.FavoriteQuestion
+            "question_id": q.id,
+            "notebook_id": notebook.id,
+            "id": 0, # ID fictício, pois não é um favorito real
+            "user_id": user_id,
+            "favorited_at": datetime.now(),
+            "question": question_payload(q), # Questão renderizada (cache) com alternativas
+            "notebook_name": notebook.nome
+        })
+    return wrong_questions
 
-        questoes = db.query(Question).filter(Question.id.in_(respostas.keys())).all()
-
-        for q in questoes:
-            resposta_usuario = respostas.get(q.id)
-            acertou = False
-
-            try:
-                resposta_usuario = int(resposta_usuario)
-            except (ValueError, TypeError):
-                resposta_usuario = None
-
-            if q.tipo == "multipla":
-                index_correto = g_map.get(q.gabarito.upper())
-                if resposta_usuario is not None and resposta_usuario == index_correto: # Adicionado 'is not None'
-                    acertou = True
-            elif q.tipo == "certo_errado":
-                correto = 1 if q.gabarito.lower() == "certo" else 0
-                if resposta_usuario is not None and resposta_usuario == correto: # Adicionado 'is not None'
-                    acertou = True
-
-            if not acertou:
-                # Certifique-se de que a questão tem as alternativas formatadas para o schema
-                q_dict = q.__dict__.copy()
-                q_dict['alternativas'] = transformar_alternativas(q) # Chamar a função aqui
-                
-                correta_index = None
-                if q_dict.get('tipo') == "multipla":
-                    gabarito_map = {'A': 0, 'B': 1, 'C': 2, 'D': 3, 'E': 4}
-                    correta_index = gabarito_map.get(q_dict.get('gabarito', '').upper())
-                elif q_dict.get('tipo') == "certo_errado":
-                    correta_index = 1 if q_dict.get('gabarito', '').lower() == 'certo' else (0 if q_dict.get('gabarito', '').lower() == 'errado' else None)
-                q_dict['correta'] = correta_index
-
-                wrong_questions.append(schemas.FavoriteQuestion(
-                    id=0, # ID fictício, pois não é um favorito real
-                    user_id=user_id,
-                    question_id=q.id,
-                    notebook_id=notebook.id,
-                    notebook_name=notebook.nome,
-                    favorited_at=datetime.now(),
-                    question=schemas.Question(**q_dict) # Passar o objeto Question com alternativas
-                ))
+def get_due_reviews(db: Session, user_id: int, skip: int = 0, limit: int = 50, until: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """
+    The user's questions due for review (review_schedule) by `until` (now by default), most
+    overdue first, as schemas.ReviewQuestion dicts. A range scan on the (user_id, revisar_em)
+    index, paginated with skip/limit. Questions whose notebook was deleted are listed without it.
+    """
+    state = models.UserQuestionState
+    states = db.query(
+        state.question_id, state.notebook_id, state.revisar_em, state.repeticoes, state.intervalo_dias,
+        state.facilidade, state.tentativas, state.acertos
+    ).join(models.Question, models.Question.id == state.question_id).filter(
+        state.user_id == user_id,
+        state.revisar_em <= (until or datetime.utcnow())
+    ).order_by(state.revisar_em, state.id).offset(skip).limit(limit).all() # id: the index's implicit last column
+
+    return [{
+        "question_id": q.id,
+        "notebook_id": notebook.id if notebook else None,
+        "notebook_name": notebook.nome if notebook else None,
+        "revisar_em": row.revisar_em,
+        "repeticoes": row.repeticoes,
+        "intervalo_dias": row.intervalo_dias,
+        "facilidade": row.facilidade,
+        "tentativas": row.tentativas,
+        "acertos": row.acertos,
+        "question": question_payload(q)
+    } for row, q, notebook in _answered_questions(db, states)]
+
+# --- Study recommendations ---
+
+RECOMMENDATION_CACHE_SIZE = 2000 # Users whose latest queue is kept in memory
+RECOMMENDATION_CACHE_TTL_SECONDS = 300 # Answers saved by other workers show up after this
+RECOMMENDATION_QUEUE_SIZE = 50 # Items ranked per computation; requests take a prefix
+
+_recommendation_cache = TTLCache(maxsize=RECOMMENDATION_CACHE_SIZE, ttl=RECOMMENDATION_CACHE_TTL_SECONDS)
+_answer_generations: Dict[int, int] = {} # Bumped on each answer, so cached queues of the user are skipped
+
+def invalidate_recommendations(user_id: int) -> None:
+    _answer_generations[user_id] = _answer_generations.get(user_id, 0) + 1
+
+def get_next_questions(db: Session, user_id: int, edital_id: Optional[int] = None, limit: int = 20) -> Optional[List[Dict[str, Any]]]:
+    """
+    The user's "next best questions" (recommendations.rank), computed from UserTopicStats,
+    UserQuestionState and the facet index. With `edital_id`, only the edital's materias are
+    considered; returns None if the edital does not exist or belongs to someone else.
+    The queue is cached until the user answers again.
+    """
+    generation = _answer_generations.get(user_id, 0)
+    key = (user_id, generation, edital_id)
+    queue = _recommendation_cache.get(key)
+    if queue is None:
+        materias = None
+        if edital_id is not None:
+            edital = db.query(models.VerticalizedSyllabus.conteudo).filter(
+                models.VerticalizedSyllabus.id == edital_id,
+                models.VerticalizedSyllabus.user_id == user_id
+            ).first()
+            if edital is None:
+                return None
+            materias = list((edital.conteudo or {}).keys())
+
+        question_facets.ensure_loaded(db)
+        queue = recommendations.rank(db, user_id, materias, RECOMMENDATION_QUEUE_SIZE, seed=abs(hash(key)))
+        _recommendation_cache.set(key, queue)
+    return queue[:limit]
+
+USER_STATS_REBUILD_BATCH_SIZE = 200 # Users per transaction
+
+def rebuild_user_study_stats(db: Session, progress: Optional[Callable[[float, str], None]] = None,
+                             batch_size: int = USER_STATS_REBUILD_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Recomputes UserQuestionState (with the review schedule) and UserTopicStats from every
+    notebook progress (each answer saved in a notebook counts as one attempt), e.g. for the
+    answers saved before these tables existed. Runs as the "user_study_stats" background job,
+    one commit per batch of users.
+    """
+    answer_key.ensure_loaded(db)
+    question_facets.ensure_loaded(db)
+    user_ids = [row[0] for row in db.query(models.NotebookProgress.user_id).distinct().order_by(models.NotebookProgress.user_id)]
+    summary = {"usuarios": 0, "respostas": 0}
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        db.query(models.UserQuestionState).filter(models.UserQuestionState.user_id.in_(batch)).delete(synchronize_session=False)
+        db.query(models.UserTopicStats).filter(models.UserTopicStats.user_id.in_(batch)).delete(synchronize_session=False)
+        progresses = db.query(
+            models.NotebookProgress.user_id, models.NotebookProgress.notebook_id, models.NotebookProgress.respostas,
+            models.NotebookProgress.updated_at, models.NotebookProgress.created_at
+        ).filter(models.NotebookProgress.user_id.in_(batch)).order_by(models.NotebookProgress.id).all()
+        for user_id, notebook_id, respostas, updated_at, created_at in progresses:
+            respostas = json.loads(respostas) if isinstance(respostas, str) else respostas
+            respostas = {q_id: resposta for q_id, resposta in (respostas or {}).items() if resposta is not None}
+            if not respostas:
+                continue
+            acertos = answer_key.correct_mask(respostas.keys(), respostas.values(), db)
+            # Flushed per progress, so the next one of the same user finds the rows just added
+            record_user_answers(db, user_id, {int(q_id): bool(acertou) for q_id, acertou in zip(respostas, acertos)},
+                                answered_at=updated_at or created_at, notebook_id=notebook_id)
+            db.flush()
+            summary["respostas"] += len(respostas)
+        db.commit()
+        db.expunge_all()
+        summary["usuarios"] += len(batch)
+        if progress:
+            progress(summary["usuarios"] / len(user_ids), f"{summary['usuarios']} de {len(user_ids)} usuários processados")
+    logger.info(f"User study statistics rebuilt: {summary}")
+    return summary
 
-    return wrong_questions
+def user_study_stats_outdated(db: Session) -> bool:
+    """
+    Whether notebook answers were saved before UserQuestionState existed or before it kept
+    the notebook and review schedule, so rebuild_user_study_stats has to run.
+    """
+    state = models.UserQuestionState
+    if db.query(state.id).filter(state.notebook_id.is_(None)).first() is not None:
+        return True
+    return db.query(state.id).first() is None and db.query(models.NotebookProgress.id).first() is not None
 
 # As funções abaixo foram movidas para o final do arquivo para melhor organização
 # e para garantir que 'models' e 'schemas' já estejam definidos.
@@ -1141,6 +1659,59 @@ def get_user_wrong_questions(db: Session, user_id: int):
 
 # --- CRUD Functions for Simulado Results ---
 
+def find_possible_duplicates(db: Session, question: Any, exclude_id: Optional[int] = None, limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    Indexed questions whose text is nearly the same as `question` (near_duplicates),
+    most similar first, with their classification so the admin can tell them apart.
+    """
+    signature = near_duplicates.signature(question)
+    if signature is None:
+        return []
+    near_duplicate_index.ensure_loaded(db)
+    return _similarity_matches(db, near_duplicate_index.find(signature, exclude_id=exclude_id, limit=limit))
+
+def _similarity_matches(db: Session, matches: List[Tuple[int, float]]) -> List[Dict[str, Any]]:
+    # [(question ID, similarity)] -> schemas.PossibleDuplicate/SimilarQuestion dicts, in the same order
+    if not matches:
+        return []
+    rows = {row.id: row for row in db.query(
+        models.Question.id, models.Question.materia, models.Question.assunto, models.Question.banca, models.Question.ano
+    ).filter(models.Question.id.in_([q_id for q_id, _ in matches]))}
+    return [
+        {"question_id": q_id, "similaridade": similarity, "materia": rows[q_id].materia,
+         "assunto": rows[q_id].assunto, "banca": rows[q_id].banca, "ano": rows[q_id].ano}
+        for q_id, similarity in matches if q_id in rows
+    ]
+
+def get_similar_questions(db: Session, question_id: int, limit: int = 10) -> Optional[List[Dict[str, Any]]]:
+    """
+    The questions whose statement and assunto are closest to those of `question_id`
+    (similar_questions, TF-IDF cosine), most similar first; None if the question does not exist.
+    """
+    question = db.query(models.Question.enunciado, models.Question.assunto).filter(models.Question.id == question_id).first()
+    if question is None:
+        return None
+    similar_question_index.ensure_loaded(db)
+    return _similarity_matches(db, similar_question_index.similar(question_id, question.enunciado, question.assunto, limit))
+
+NEAR_DUPLICATE_REPORT_LIMIT = 5000 # Groups listed in the report; the totals cover all of them
+
+def near_duplicate_report(db: Session, progress: Optional[Callable[[float, str], None]] = None) -> Dict[str, Any]:
+    """
+    Groups of near-duplicate questions across the whole bank, largest first. Runs as
+    the "near_duplicate_report" background job.
+    """
+    near_duplicate_index.ensure_loaded(db)
+    if progress:
+        progress(0.1, "Comparando as questões")
+    groups = near_duplicate_index.clusters()
+    return {
+        "grupos": len(groups),
+        "questoes_em_grupos": sum(len(group["ids"]) for group in groups),
+        "limiar": near_duplicates.SIMILARITY_THRESHOLD,
+        "lista": groups[:NEAR_DUPLICATE_REPORT_LIMIT],
+    }
+
 def get_questions_by_ids(db: Session, question_ids: List[int]) -> List[models.Question]:
     """
     Obtém uma lista de questões pelos seus IDs.
@@ -1177,9 +1748,109 @@ def transformar_alternativas(questao):
         if item_content:
             alternativas.append({'id': idx, 'text': strip_p_tags(item_content)}) # Aplicar strip_p_tags
     
-    print(f"DEBUG: Alternativas transformadas para questão {questao.id}: {alternativas}")
+    logger.debug(f"Alternativas transformadas para questão {questao.id}: {alternativas}")
     return alternativas
 
+# --- Question render cache ---
+
+RENDER_CACHE_SIZE = 5000 # Rendered questions kept in memory
+_render_cache = LRUCache(maxsize=RENDER_CACHE_SIZE)
+_QUESTION_FIELDS = [attr.key for attr in models.Question.__mapper__.column_attrs]
+_QUESTION_SCHEMA_FIELDS = [name for name in schemas.Question.model_fields if name != 'is_favorited']
+# Schema fields read straight from non-deferred columns; sparse fieldsets made only of these skip the render
+QUESTION_METADATA_FIELDS = frozenset(
+    attr.key for attr in models.Question.__mapper__.column_attrs if not attr.deferred
+) & frozenset(schemas.Question.model_fields)
+
+def indice_correto(gabarito: Optional[str], tipo: Optional[str]) -> Optional[int]:
+    """
+    Maps the answer key to the 0-indexed answer used by notebooks:
+    'A'->0 ... 'E'->4 for multiple choice, 'Certo'->1 and 'Errado'->0 for certo/errado.
+    """
+    if gabarito is None:
+        return None
+    if tipo == "multipla":
+        return {'A': 0, 'B': 1, 'C': 2, 'D': 3, 'E': 4}.get(gabarito.upper())
+    if tipo == "certo_errado":
+        return 1 if gabarito.lower() == 'certo' else (0 if gabarito.lower() == 'errado' else None)
+    return None
+
+def _is_render_cached(question: models.Question) -> bool:
+    cached = _render_cache.peek(question.id) # Not a render: no hit/miss, no LRU refresh
+    return cached is not None and cached[0] == question.version
+
+def prefetch_renders(questions: List[models.Question]) -> None:
+    """
+    Loads in one query the deferred text columns of the questions whose render is
+    not cached yet, instead of one lazy load per question while rendering them.
+    """
+    missing = [q.id for q in questions if 'enunciado' not in q.__dict__ and not _is_render_cached(q)]
+    db = object_session(questions[0]) if missing else None
+    if db is None:
+        return
+    # Rows of questions already in the session only fill their unloaded attributes
+    db.query(models.Question).options(
+        undefer_group("texto"), undefer_group("comentario")
+    ).filter(models.Question.id.in_(missing)).all()
+
+def _cached_render(question: models.Question):
+    cached = _render_cache.get(question.id)
+    if cached is not None and cached[0] == question.version:
+        return cached
+
+    payload = {key: getattr(question, key) for key in _QUESTION_FIELDS}
+    payload['alternativas'] = transformar_alternativas(question)
+    payload['conteudo'] = strip_p_tags(question.enunciado)
+    payload['correta'] = indice_correto(question.gabarito, question.tipo)
+    payload['correct_alternative_id'] = mapear_gabarito_para_indice(question.gabarito)
+    api_payload = {name: payload[name] for name in _QUESTION_SCHEMA_FIELDS}
+    cached = (question.version, payload, api_payload)
+    _render_cache.set(question.id, cached)
+    return cached
+
+def render_question(question: models.Question) -> Dict[str, Any]:
+    """
+    Returns the normalized render of a question: its columns plus the formatted
+    alternatives ('alternativas'), the statement without <p> tags ('conteudo'),
+    the 0-indexed correct answer ('correta') and the 1-indexed one used by
+    simulados ('correct_alternative_id').
+    Renders are cached by question ID and version; the returned dict is shared
+    and must not be modified.
+    """
+    return _cached_render(question)[1]
+
+def question_payload(question: models.Question, is_favorited: bool = False) -> Dict[str, Any]:
+    """
+    Returns the question as sent to the frontend: a JSON-ready dict with the
+    fields of schemas.Question, copied from the render cache. List endpoints
+    return these directly instead of validating a Question schema per item.
+    """
+    return {**_cached_render(question)[2], 'is_favorited': is_favorited}
+
+def question_payloads(
+    questions: List[models.Question],
+    favorite_ids: Optional[set] = None,
+    fields: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Payloads of a list of questions. With `fields` (sparse fieldset) only those keys are
+    returned; when they are all metadata columns the text columns are never loaded.
+    """
+    favorite_ids = favorite_ids or set()
+    if fields and QUESTION_METADATA_FIELDS.issuperset(f for f in fields if f != 'is_favorited'):
+        return [
+            {f: (q.id in favorite_ids if f == 'is_favorited' else getattr(q, f)) for f in fields}
+            for q in questions
+        ]
+    prefetch_renders(questions)
+    payloads = [question_payload(q, is_favorited=q.id in favorite_ids) for q in questions]
+    if fields:
+        payloads = [{f: payload[f] for f in fields} for payload in payloads]
+    return payloads
+
+def invalidate_question_render(question_id: int) -> None:
+    _render_cache.pop(question_id)
+
 def obter_tipo_por_materia(materia: str) -> str:
     # Defina conforme sua regra de negócio. Exemplo:
     basicos = ["Português", "RLM", "Informática", "Ética", "Direito Administrativo", "Direito Constitucional"] 
@@ -1335,6 +2006,22 @@ def get_syllabus_by_id(db: Session, syllabus_id: int, user_id: int):
         models.VerticalizedSyllabus.user_id == user_id
     ).first()
 
+def get_syllabus_version(db: Session, syllabus_id: int, user_id: int) -> Optional[int]:
+    return db.query(models.VerticalizedSyllabus.version).filter(
+        models.VerticalizedSyllabus.id == syllabus_id,
+        models.VerticalizedSyllabus.user_id == user_id
+    ).scalar()
+
+def get_user_syllabi_fingerprint(db: Session, user_id: int) -> tuple:
+    """
+    (count, max id, sum of versions) of a user's syllabi; ETag of the list.
+    """
+    return tuple(db.query(
+        func.count(models.VerticalizedSyllabus.id),
+        func.max(models.VerticalizedSyllabus.id),
+        func.sum(models.VerticalizedSyllabus.version)
+    ).filter(models.VerticalizedSyllabus.user_id == user_id).one())
+
 def update_syllabus(db: Session, syllabus_id: int, user_id: int, syllabus_update: schemas.VerticalizedSyllabusUpdate):
     db_syllabus = get_syllabus_by_id(db, syllabus_id, user_id)
     if not db_syllabus:
@@ -1458,6 +2145,45 @@ def get_syllabi_with_calendars(db: Session, user_id: int) -> List[models.Vertica
         models.VerticalizedSyllabus.user_id == user_id
     ).all()
 
+SUGESTOES_CACHE_TTL_SECONDS = 30
+
+@single_flight(ttl=SUGESTOES_CACHE_TTL_SECONDS)
+def get_sugestoes_de_estudo(db: Session, edital_id: int, banca: Optional[str], horas_semana: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Sugere horas de estudo por matéria do edital, com peso = nº de tópicos + nº de questões da banca.
+    Retorna None se o edital não existir.
+    """
+    edital = db.query(models.VerticalizedSyllabus).filter(models.VerticalizedSyllabus.id == edital_id).first()
+    if not edital:
+        return None
+
+    materias = list(edital.conteudo.keys())
+    # Uma única consulta agrupada em vez de um COUNT por matéria
+    questoes_banca = dict(
+        db.query(models.Question.materia, func.count(models.Question.id)).filter(
+            models.Question.materia.in_(materias),
+            models.Question.banca == banca
+        ).group_by(models.Question.materia).all()
+    )
+
+    total_peso = sum(len(edital.conteudo[m]) + questoes_banca.get(m, 0) for m in materias)
+    sugestoes = []
+    for materia in materias:
+        topicos = len(edital.conteudo[materia])
+        peso = topicos + questoes_banca.get(materia, 0)
+        horas_sugeridas = round((peso / total_peso) * horas_semana, 2) if total_peso > 0 else 0
+        sugestoes.append({
+            "materia": materia,
+            "topicos": topicos,
+            "questoes_banca": questoes_banca.get(materia, 0),
+            "peso": peso,
+            "horas_sugeridas": horas_sugeridas
+        })
+
+    # Ordenar matérias por peso (mais prioridade primeiro)
+    sugestoes.sort(key=lambda x: x["peso"], reverse=True)
+    return sugestoes
+
 def get_user_study_plans_with_titles(db: Session, user_id: int):
     """
     Retorna todos os calendários de estudo do usuário com o título do edital associado.
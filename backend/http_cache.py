@@ -0,0 +1,65 @@
+"""
+HTTP conditional caching helpers (ETag / Last-Modified / 304).
+
+Endpoints compute an ETag from row versions with a cheap query *before*
+loading and serializing the body. When the client's If-None-Match (or
+If-Modified-Since) still matches, `not_modified` answers 304 with no body:
+
+    etag = http_cache.make_etag("theory", theory_id, version)
+    if http_cache.is_fresh(request, etag):
+        return http_cache.not_modified(etag)
+    ...
+    http_cache.set_headers(response, etag)
+
+Responses are per user (authenticated), so they are `private` and revalidated
+on every use (`no-cache`).
+"""
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import Request, Response
+from typing import Any, Optional
+import hashlib
+
+CACHE_CONTROL = "private, no-cache"
+
+def make_etag(*parts: Any) -> str:
+    """
+    Strong ETag from the given version parts (ids, version numbers, timestamps, counts).
+    """
+    digest = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:20]
+    return f'"{digest}"'
+
+def _http_date(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc) # Timestamps are stored in UTC
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+def is_fresh(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """
+    True when the client's cached copy is still valid. If-None-Match takes precedence over If-Modified-Since.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+def set_headers(response: Response, etag: str, last_modified: Optional[datetime] = None) -> None:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    if last_modified is not None:
+        response.headers["Last-Modified"] = _http_date(last_modified)
+
+def not_modified(etag: str, last_modified: Optional[datetime] = None) -> Response:
+    response = Response(status_code=304)
+    set_headers(response, etag, last_modified)
+    return response
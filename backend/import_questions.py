@@ -0,0 +1,58 @@
+"""
+Imports a question bank from a JSONL or CSV file (see backend/question_import.py).
+
+    python backend/import_questions.py questoes.jsonl
+    python backend/import_questions.py questoes.csv --chunk-size 10000 --errors erros.json
+
+Each API process keeps an in-memory answer key, loaded on startup. With the API
+running, either restart it after the import or use --queue, which hands the file
+to the API's job runner (the file must stay in place until the job ends):
+
+    python backend/import_questions.py questoes.jsonl --queue
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend import jobs, models, question_import
+from backend.database import SessionLocal, engine
+from backend.migrations import apply_pending_columns
+
+def print_progress(fraction: float, message: str) -> None:
+    print(f"{fraction:6.1%}  {message}", flush=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=question_import.FORMATS, help="Taken from the file extension when omitted")
+    parser.add_argument("--chunk-size", type=int, default=question_import.CHUNK_SIZE)
+    parser.add_argument("--errors", help="Writes the row errors and possible duplicates to this JSON file instead of printing them")
+    parser.add_argument("--queue", action="store_true", help="Runs the import as a job of the running API")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    apply_pending_columns(engine)
+    path = os.path.abspath(args.path)
+    if args.queue:
+        jobs.register("question_import", question_import.import_questions)
+        job = jobs.submit("question_import", {"path": path, "format": args.format, "chunk_size": args.chunk_size})
+        print(f"Job {job.id} queued; follow it at /api/jobs/{job.id}")
+        sys.exit(0)
+
+    db = SessionLocal()
+    try:
+        summary = question_import.import_questions(db, path, args.format, args.chunk_size, progress=print_progress)
+    finally:
+        db.close()
+    errors, possible_duplicates = summary.pop("erros"), summary.pop("possiveis_duplicatas")
+    print(json.dumps({**summary, "possiveis_duplicatas": len(possible_duplicates)}, ensure_ascii=False))
+    if args.errors:
+        with open(args.errors, "w", encoding="utf-8") as f:
+            json.dump({"erros": errors, "possiveis_duplicatas": possible_duplicates}, f, ensure_ascii=False, indent=2)
+    else:
+        for error in errors:
+            print(f"linha {error['linha']}: {'; '.join(error['erros'])}")
+        for duplicate in possible_duplicates:
+            print(f"linha {duplicate['linha']}: parecida com as questões {duplicate['questoes']}")
@@ -0,0 +1,419 @@
+"""
+Background jobs for long-running work (PDF import, bulk import, recalibration).
+
+Jobs are rows of the `jobs` table, so their progress can be polled from any
+worker process and they survive a restart. `submit` stores a pending job and
+returns at once; a dispatcher thread claims pending jobs (a conditional
+UPDATE pending -> running, so a job runs once) and runs them on JOB_WORKERS
+threads. At most JOB_QUEUE_LIMIT jobs may be pending; beyond that `submit`
+raises JobQueueFull. A job submitted with a `unique_key` (e.g. a backfill) is
+refused with JobAlreadyQueued while another one with the same key is pending or
+running: the key is unique in the table and cleared when the job ends.
+
+Handlers are registered per kind and called as `fn(db, **params, progress=progress)`;
+`progress(fraction, message)` stores the progress (throttled) and raises
+JobCancelled once a cancellation was requested, so handlers stop at their
+next checkpoint. It writes through its own session: call it outside an open
+write transaction. Files listed in params["files"] (uploads) are deleted when
+the job ends.
+
+A running job is leased by the process that claimed it (worker_id,
+lease_expires_at), which renews the lease every HEARTBEAT_INTERVAL_SECONDS.
+Jobs whose lease expired, because their process died or stopped, go back to
+pending (up to MAX_ATTEMPTS runs in total), so handlers must be safe to run
+again; every dispatcher checks for them periodically, so several processes can
+run one. A runner that lost the lease of a job stops it at its next progress
+checkpoint and does not record its result. `stop` interrupts the running jobs at
+their next progress checkpoint, hands them back to pending and waits up to
+JOB_STOP_TIMEOUT_SECONDS for them; a job still running after that keeps its
+lease until it expires. JOB_RUNNER_ENABLED=false makes a process only submit.
+
+`register_periodic` adds maintenance tasks (e.g. pruning logs) that the
+dispatcher runs as `fn(db)` every given interval, in every process that runs jobs.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from typing import Any, Callable, Dict, List, Optional, Set
+import threading
+import logging
+import socket
+import uuid
+import time
+import os
+
+from backend import metrics, models
+from backend.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "20")) # Pending jobs allowed to wait for a worker
+JOB_RUNNER_ENABLED = os.getenv("JOB_RUNNER_ENABLED", "true").lower() in ("1", "true", "yes")
+JOBS_DIR = os.getenv("JOBS_DIR", "./job_files") # Uploaded files waiting for their job
+MAX_ATTEMPTS = 3
+POLL_INTERVAL_SECONDS = 2.0 # Dispatcher check for jobs submitted by other processes
+PROGRESS_INTERVAL_SECONDS = 0.5 # Minimum time between two progress writes of a job
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60")) # Running jobs not renewed for this long are requeued
+HEARTBEAT_INTERVAL_SECONDS = LEASE_SECONDS / 4
+JOB_STOP_TIMEOUT_SECONDS = float(os.getenv("JOB_STOP_TIMEOUT_SECONDS", "10")) # Wait for running jobs on stop
+
+PENDING, RUNNING, SUCCEEDED, FAILED, CANCELLED = "pending", "running", "succeeded", "failed", "cancelled"
+TERMINAL_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+class JobCancelled(Exception):
+    """Raised by the progress callback when the job was cancelled."""
+
+class JobInterrupted(JobCancelled):
+    """Raised by the progress callback when the runner is stopping; the job goes back to pending."""
+
+class JobQueueFull(Exception):
+    """Raised by submit when JOB_QUEUE_LIMIT jobs are already pending."""
+
+class JobAlreadyQueued(Exception):
+    """Raised by submit when a job with the same unique_key is pending or running."""
+
+_handlers: Dict[str, Callable[..., Any]] = {}
+_periodic: List[Dict[str, Any]] = [] # {"fn", "interval", "last_run"} of the periodic tasks
+_executor: Optional[ThreadPoolExecutor] = None
+_dispatcher: Optional[threading.Thread] = None
+_wakeup = threading.Event()
+_stopping = threading.Event()
+_active: Set[str] = set()
+_active_lock = threading.Lock()
+_worker_id: Optional[str] = None # Set by start(), after any fork
+
+def register(kind: str, fn: Callable[..., Any]) -> None:
+    """
+    Registers the handler of a job kind.
+    """
+    _handlers[kind] = fn
+
+def register_periodic(fn: Callable[[Session], Any], interval_seconds: float) -> None:
+    """
+    Registers a maintenance task run by the dispatcher as fn(db) every interval_seconds,
+    the first time right after start. Must be safe to run concurrently in several processes.
+    """
+    _periodic.append({"fn": fn, "interval": interval_seconds, "last_run": float("-inf")})
+
+def upload_path(filename: str) -> str:
+    """
+    New path in JOBS_DIR for an uploaded file (kept until its job ends).
+    """
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    extension = os.path.splitext(filename or "")[1].lower()
+    return os.path.join(JOBS_DIR, f"{uuid.uuid4().hex}{extension}")
+
+def _now() -> datetime:
+    return datetime.utcnow()
+
+def _lease_expiry() -> datetime:
+    return _now() + timedelta(seconds=LEASE_SECONDS)
+
+def _lease_expired():
+    return or_(models.Job.lease_expires_at.is_(None), models.Job.lease_expires_at < _now())
+
+def _remove_files(params: Dict[str, Any]) -> None:
+    for path in params.get("files") or []:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove job file {path}: {e}")
+
+def submit(kind: str, params: Dict[str, Any], user_id: Optional[int] = None, unique_key: Optional[str] = None) -> models.Job:
+    """
+    Stores a pending job and wakes the dispatcher. Returns the (detached) job.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+    db = SessionLocal()
+    try:
+        if db.query(models.Job).filter(models.Job.status == PENDING).count() >= JOB_QUEUE_LIMIT:
+            metrics.incr("jobs.rejected")
+            raise JobQueueFull()
+        now = _now()
+        job = models.Job(id=uuid.uuid4().hex, kind=kind, status=PENDING, params=params, progress=0.0,
+                         cancel_requested=False, attempts=0, user_id=user_id, unique_key=unique_key,
+                         created_at=now, updated_at=now)
+        db.add(job)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            raise JobAlreadyQueued()
+        db.refresh(job)
+        db.expunge(job)
+    finally:
+        db.close()
+    metrics.incr(f"jobs.{kind}.submitted")
+    logger.info(f"Job {job.id} ({kind}) submitted.")
+    _wakeup.set()
+    return job
+
+def get_job(db: Session, job_id: str) -> Optional[models.Job]:
+    return db.query(models.Job).filter(models.Job.id == job_id).first()
+
+def cancel(db: Session, job: models.Job) -> models.Job:
+    """
+    Cancels a pending job at once; a running one stops at its next progress checkpoint.
+    """
+    if job.status == PENDING:
+        cancelled = db.execute(
+            update(models.Job)
+            .where(models.Job.id == job.id, models.Job.status == PENDING)
+            .values(status=CANCELLED, cancel_requested=True, unique_key=None, finished_at=_now(), updated_at=_now())
+        ).rowcount
+        db.commit()
+        if cancelled:
+            _remove_files(job.params or {})
+            metrics.incr(f"jobs.{job.kind}.cancelled")
+    if job.status == RUNNING:
+        db.execute(
+            update(models.Job).where(models.Job.id == job.id).values(cancel_requested=True, updated_at=_now())
+        )
+        db.commit()
+    db.refresh(job)
+    return job
+
+class _Progress:
+    """
+    The progress callback given to handlers.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.last_write = 0.0
+
+    def __call__(self, fraction: float, message: Optional[str] = None) -> None:
+        if _stopping.is_set():
+            raise JobInterrupted()
+        now = time.monotonic()
+        if now - self.last_write < PROGRESS_INTERVAL_SECONDS:
+            return
+        self.last_write = now
+        db = SessionLocal()
+        try:
+            owned = db.execute(
+                update(models.Job).where(models.Job.id == self.job_id, models.Job.worker_id == _worker_id)
+                .values(progress=max(0.0, min(float(fraction), 1.0)), message=message, updated_at=_now())
+            ).rowcount
+            db.commit()
+            cancel_requested = db.query(models.Job.cancel_requested).filter(models.Job.id == self.job_id).scalar()
+        finally:
+            db.close()
+        if not owned:
+            # The lease expired and the job was requeued; its new run owns it now
+            logger.warning(f"Job {self.job_id} lost its lease; stopping this run.")
+            raise JobCancelled()
+        if cancel_requested:
+            raise JobCancelled()
+
+def _finish(job_id: str, **values) -> None:
+    db = SessionLocal()
+    try:
+        owned = db.execute(
+            update(models.Job).where(models.Job.id == job_id, models.Job.worker_id == _worker_id)
+            .values(finished_at=_now(), updated_at=_now(), lease_expires_at=None, unique_key=None, **values)
+        ).rowcount
+        db.commit()
+    finally:
+        db.close()
+    if not owned:
+        logger.warning(f"Job {job_id} lost its lease; result of this run discarded.")
+
+def _requeue(job_id: str) -> None:
+    # Hands a job interrupted by stop() back to pending; the interrupted run is not counted as an attempt
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(models.Job).where(models.Job.id == job_id, models.Job.worker_id == _worker_id, models.Job.status == RUNNING)
+            .values(status=PENDING, attempts=models.Job.attempts - 1, worker_id=None, lease_expires_at=None, updated_at=_now())
+        )
+        db.commit()
+    finally:
+        db.close()
+
+def _run(job_id: str) -> None:
+    db = SessionLocal()
+    try:
+        claimed = db.execute(
+            update(models.Job)
+            .where(models.Job.id == job_id, models.Job.status == PENDING)
+            .values(status=RUNNING, attempts=models.Job.attempts + 1, worker_id=_worker_id,
+                    lease_expires_at=_lease_expiry(), started_at=_now(), updated_at=_now())
+        ).rowcount
+        db.commit()
+        if not claimed:
+            return
+        job = get_job(db, job_id)
+        kind, params = job.kind, dict(job.params or {})
+        logger.info(f"Job {job_id} ({kind}) started, attempt {job.attempts}.")
+        start = time.perf_counter()
+        try:
+            handler_params = {k: v for k, v in params.items() if k != "files"}
+            result = _handlers[kind](db, progress=_Progress(job_id), **handler_params)
+        except JobInterrupted:
+            db.rollback()
+            _requeue(job_id)
+            logger.info(f"Job {job_id} ({kind}) interrupted by shutdown; back to pending.")
+            return # Its files are kept for the next run
+        except JobCancelled:
+            db.rollback()
+            _finish(job_id, status=CANCELLED, message="Cancelada")
+            metrics.incr(f"jobs.{kind}.cancelled")
+            logger.info(f"Job {job_id} ({kind}) cancelled.")
+        except Exception as e:
+            db.rollback()
+            _finish(job_id, status=FAILED, error=str(e) or type(e).__name__)
+            metrics.incr(f"jobs.{kind}.failed")
+            logger.error(f"Job {job_id} ({kind}) failed: {e}", exc_info=True)
+        else:
+            _finish(job_id, status=SUCCEEDED, progress=1.0, message="Concluída", result=result)
+            metrics.incr(f"jobs.{kind}.succeeded")
+            logger.info(f"Job {job_id} ({kind}) succeeded.")
+        metrics.observe(f"jobs.{kind}", time.perf_counter() - start)
+        _remove_files(params)
+    finally:
+        db.close()
+        with _active_lock:
+            _active.discard(job_id)
+        _wakeup.set() # A worker is free
+
+def _dispatch_pending() -> None:
+    with _active_lock:
+        free = JOB_WORKERS - len(_active)
+        if free <= 0:
+            return
+        db = SessionLocal()
+        try:
+            rows = (db.query(models.Job.id)
+                    .filter(models.Job.status == PENDING)
+                    .order_by(models.Job.created_at)
+                    .limit(free + len(_active)).all())
+        finally:
+            db.close()
+        for (job_id,) in rows:
+            if free <= 0:
+                break
+            if job_id in _active:
+                continue
+            _active.add(job_id)
+            _executor.submit(_run, job_id)
+            free -= 1
+
+def _renew_leases() -> None:
+    with _active_lock:
+        active = list(_active)
+    if not active:
+        return
+    db = SessionLocal()
+    try:
+        # updated_at is kept: a heartbeat is not a change of the job
+        db.execute(
+            update(models.Job)
+            .where(models.Job.id.in_(active), models.Job.worker_id == _worker_id, models.Job.status == RUNNING)
+            .values(lease_expires_at=_lease_expiry(), updated_at=models.Job.updated_at)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+def _run_periodic() -> None:
+    for task in _periodic:
+        if time.monotonic() - task["last_run"] < task["interval"]:
+            continue
+        task["last_run"] = time.monotonic()
+        db = SessionLocal()
+        try:
+            task["fn"](db)
+        except Exception as e:
+            logger.error(f"Periodic task {task['fn'].__name__} failed: {e}", exc_info=True)
+        finally:
+            db.close()
+
+def _dispatch_loop() -> None:
+    last_heartbeat = time.monotonic()
+    while not _stopping.is_set():
+        try:
+            if time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL_SECONDS:
+                last_heartbeat = time.monotonic()
+                _renew_leases()
+                resume()
+            _dispatch_pending()
+            _run_periodic()
+        except Exception as e:
+            logger.error(f"Job dispatcher error: {e}", exc_info=True)
+        _wakeup.wait(POLL_INTERVAL_SECONDS)
+        _wakeup.clear()
+
+def resume() -> None:
+    """
+    Requeues the running jobs whose lease expired; those that already had MAX_ATTEMPTS
+    runs fail instead. Each job is taken with a conditional UPDATE, so concurrent
+    dispatchers recover it once.
+    """
+    db = SessionLocal()
+    recovered = 0
+    try:
+        expired = db.query(models.Job).filter(models.Job.status == RUNNING, _lease_expired()).all()
+        for job in expired:
+            values = {"status": PENDING}
+            if job.cancel_requested:
+                values = {"status": CANCELLED, "finished_at": _now(), "unique_key": None}
+            elif job.attempts >= MAX_ATTEMPTS:
+                values = {"status": FAILED, "finished_at": _now(), "unique_key": None,
+                          "error": f"Interrompida {job.attempts} vezes por reinício ou falha do servidor."}
+            taken = db.execute(
+                update(models.Job)
+                .where(models.Job.id == job.id, models.Job.status == RUNNING, _lease_expired())
+                .values(worker_id=None, lease_expires_at=None, updated_at=_now(), **values)
+            ).rowcount
+            db.commit()
+            if taken:
+                recovered += 1
+                if values["status"] in TERMINAL_STATUSES:
+                    _remove_files(job.params or {})
+    finally:
+        db.close()
+    if recovered:
+        logger.info(f"{recovered} interrupted job(s) recovered.")
+        _wakeup.set()
+
+def start() -> None:
+    global _executor, _dispatcher, _worker_id
+    if not JOB_RUNNER_ENABLED or _dispatcher is not None:
+        return
+    _worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    resume()
+    _stopping.clear()
+    _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+    _dispatcher = threading.Thread(target=_dispatch_loop, name="job-dispatcher", daemon=True)
+    _dispatcher.start()
+
+def stop() -> None:
+    """
+    Stops dispatching. Running jobs stop at their next progress checkpoint and go back to
+    pending, so they resume on the next start or in another process; they are waited for
+    up to JOB_STOP_TIMEOUT_SECONDS. A job still running after that keeps its lease: it is
+    only recovered elsewhere once the lease expires (heartbeats stopped with the dispatcher).
+    """
+    global _executor, _dispatcher
+    if _dispatcher is None:
+        return
+    _stopping.set()
+    _wakeup.set()
+    _dispatcher.join(timeout=5)
+    _executor.shutdown(wait=False, cancel_futures=True) # Jobs not started yet stay pending
+    waiter = threading.Thread(target=_executor.shutdown, name="job-stop", daemon=True)
+    waiter.start()
+    waiter.join(timeout=JOB_STOP_TIMEOUT_SECONDS)
+    if waiter.is_alive():
+        logger.warning(f"Jobs still running after {JOB_STOP_TIMEOUT_SECONDS}s: {sorted(_active)}; their leases will expire.")
+    else:
+        with _active_lock:
+            _active.clear() # Only jobs cancelled before their run started are left
+    _executor, _dispatcher = None, None
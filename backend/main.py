@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Body
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Body, Request, Response
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any, Optional
@@ -6,6 +6,9 @@ from datetime import timedelta
 from fastapi import Path
 from typing import List, Dict, Any
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi import Query
 from urllib.parse import unquote
 # CORREÇÃO AQUI: Usando o nome correto da pasta 'routers'
@@ -17,6 +20,9 @@ import logging
 import json
 import sys
 import os
+import anyio.to_thread
+import asyncio
+import orjson
 
 # Adds the 'backend' directory to sys.path
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -26,8 +32,14 @@ if current_dir not in sys.path:
 import pdf_processor # Import the pdf_processor module
 
 # Relative imports
-from backend import crud, models, schemas, auth
-from backend.database import SessionLocal, engine, get_db
+from backend import crud, models, schemas, auth, migrations, answer_stats, metrics, password_hashing, http_cache, pdf_parser, jobs, uploads, question_import, question_export, topic_tree, question_sync
+from backend.answer_key import answer_key
+from backend.near_duplicates import near_duplicate_index
+from backend.similar_questions import similar_question_index
+from backend.question_facets import question_facets
+from backend.responses import JSONResponse
+from backend.write_queue import WRITE_QUEUE_ENABLED, write_queue, run_write
+from backend.database import SessionLocal, ReadSessionLocal, engine, get_db, get_read_db
 
 # Configure the logger to display INFO or DEBUG messages
 logging.basicConfig(level=logging.INFO)
@@ -35,8 +47,205 @@ logger = logging.getLogger(__name__)
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
+migrations.apply_pending_columns(engine)
 
-app = FastAPI()
+app = FastAPI(default_response_class=JSONResponse) # orjson instead of the stdlib encoder
+
+GZIP_MINIMUM_SIZE = 1000 # Bytes; smaller responses are sent uncompressed
+
+# Endpoints and dependencies are plain `def`: they use the synchronous SQLAlchemy
+# session, so FastAPI runs them in a threadpool instead of on the event loop.
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+
+MAX_BULK_IDS = 500 # Maximum number of question IDs accepted by bulk endpoints
+
+JOB_EVENTS_POLL_SECONDS = 0.5 # How often the SSE stream of a job checks for changes
+JOB_EVENTS_HEARTBEAT_SECONDS = 15 # Comment line sent when nothing changed, so proxies keep the stream open
+
+# Background job handlers, run by the job runner (backend/jobs.py)
+jobs.register("pdf_import", pdf_processor.process_pdf_and_add_questions)
+jobs.register("recalibrate", crud.recalibrate_question_statistics)
+jobs.register("question_import", question_import.import_questions)
+jobs.register("near_duplicate_report", crud.near_duplicate_report)
+jobs.register("user_study_stats", crud.rebuild_user_study_stats)
+jobs.register("question_topics", crud.backfill_question_topics)
+# Periodic maintenance, run by the job dispatcher
+jobs.register_periodic(question_sync.prune_changes, question_sync.CHANGES_PRUNE_INTERVAL_SECONDS)
+
+def parse_ids_param(ids: str) -> List[int]:
+    """
+    Parses a comma-separated list of IDs ("1,2,3") keeping the original order.
+    """
+    try:
+        parsed = [int(i) for i in ids.split(",") if i.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Parâmetro 'ids' inválido. Use IDs numéricos separados por vírgula.")
+    parsed = list(dict.fromkeys(parsed))
+    if len(parsed) > MAX_BULK_IDS:
+        raise HTTPException(status_code=400, detail=f"Máximo de {MAX_BULK_IDS} IDs por requisição.")
+    return parsed
+
+def parse_fields_param(fields: Optional[str]) -> Optional[List[str]]:
+    """
+    Parses a sparse fieldset ("id,materia,assunto") for question lists; None returns every field.
+    """
+    if not fields:
+        return None
+    parsed = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    invalid = [f for f in parsed if f not in schemas.Question.model_fields]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Campo(s) inválido(s) em 'fields': {', '.join(invalid)}")
+    return parsed or None
+
+def submit_job(kind: str, params: Dict[str, Any], user_id: int) -> schemas.Job:
+    """
+    Queues a background job; responds 503 when too many jobs are already waiting.
+    """
+    try:
+        job = jobs.submit(kind, params, user_id=user_id)
+    except jobs.JobQueueFull:
+        logger.warning(f"Job queue full; {kind} job refused.")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Muitas tarefas na fila. Tente novamente em alguns instantes.",
+            headers={"Retry-After": "30"},
+        )
+    return schemas.Job.model_validate(job)
+
+def get_job_or_404(db: Session, job_id: str, current_user: schemas.User) -> models.Job:
+    """
+    Loads a job visible to the user (their own jobs; admins see every job).
+    """
+    job = jobs.get_job(db, job_id)
+    if not job or (job.user_id != current_user.id and current_user.role != "admin"):
+        raise HTTPException(status_code=404, detail="Tarefa não encontrada.")
+    return job
+
+def save_upload(upload: UploadFile, max_bytes: int, check_head) -> str:
+    """
+    Streams an uploaded file to the jobs directory (size limit and signature checked on the way); returns its path.
+    """
+    path = jobs.upload_path(upload.filename)
+    uploads.save_upload(upload, path, max_bytes, check_head)
+    return path
+
+@app.on_event("startup")
+def limit_threadpool():
+    """
+    Bounds the threadpool that runs the synchronous endpoints and dependencies.
+    """
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    logger.info(f"Threadpool limited to {THREADPOOL_SIZE} threads.")
+
+@app.on_event("startup")
+def load_answer_key():
+    """
+    Loads the answer key used to score notebook answers.
+    """
+    db = SessionLocal()
+    try:
+        answer_key.load(db)
+    finally:
+        db.close()
+
+@app.on_event("startup")
+def load_near_duplicate_index():
+    """
+    Loads the MinHash index used to flag near-duplicate questions.
+    """
+    db = SessionLocal()
+    try:
+        near_duplicate_index.load(db)
+    finally:
+        db.close()
+
+@app.on_event("startup")
+def load_question_facets():
+    """
+    Loads the facet index used to pick recommended questions.
+    """
+    db = SessionLocal()
+    try:
+        question_facets.load(db)
+    finally:
+        db.close()
+
+@app.on_event("startup")
+def load_similar_question_index():
+    """
+    Builds the TF-IDF index behind "more questions like this one".
+    """
+    db = SessionLocal()
+    try:
+        similar_question_index.load(db)
+    finally:
+        db.close()
+
+@app.on_event("startup")
+def start_write_queue():
+    if WRITE_QUEUE_ENABLED:
+        write_queue.start()
+
+@app.on_event("startup")
+def start_job_runner():
+    """
+    Resumes the jobs interrupted by the last shutdown and starts running pending jobs.
+    """
+    jobs.start()
+
+# Jobs that fill data derived from rows saved before it existed, with the check that tells they are needed
+BACKFILL_JOBS = [
+    ("user_study_stats", crud.user_study_stats_outdated),
+    ("question_topics", crud.question_topics_outdated),
+]
+
+@app.on_event("startup")
+def queue_backfill_jobs():
+    """
+    Queues the backfill jobs whose data is missing (the users' study statistics and review
+    schedules, the questions' topic). The job kind is the job's unique_key, so workers
+    starting together queue each backfill once.
+    """
+    db = SessionLocal()
+    try:
+        for kind, outdated in BACKFILL_JOBS:
+            if outdated(db):
+                try:
+                    jobs.submit(kind, {}, unique_key=kind)
+                    logger.info(f"Queued {kind} backfill")
+                except jobs.JobAlreadyQueued:
+                    pass
+    except jobs.JobQueueFull:
+        logger.warning("Job queue full; backfill jobs not queued.")
+    finally:
+        db.close()
+
+@app.on_event("shutdown")
+def stop_job_runner():
+    jobs.stop()
+
+@app.on_event("shutdown")
+def stop_write_queue():
+    write_queue.stop()
+
+@app.on_event("shutdown")
+def flush_answer_distribution():
+    """
+    Writes the answer distribution counters still pending in memory.
+    """
+    db = SessionLocal()
+    try:
+        answer_stats.flush(db)
+    finally:
+        db.close()
+
+@app.on_event("shutdown")
+def stop_password_hashing_pool():
+    password_hashing.shutdown()
+
+@app.on_event("shutdown")
+def stop_pdf_extraction_pool():
+    pdf_parser.shutdown()
 
 # CORS configuration
 origins = [
@@ -45,6 +254,12 @@ origins = [
     "https://metas-da-ap-k465.vercel.app"  # O endereço do seu frontend no Vercel
 ]
 
+# Rejects oversized uploads before their body is read; added first so CORS headers still apply
+app.add_middleware(uploads.UploadSizeLimit, limits={
+    "/api/upload-pdf/": (2, uploads.MAX_UPLOAD_BYTES), # Prova and gabarito
+    "/api/admin/questions/import": (1, uploads.MAX_IMPORT_BYTES),
+})
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Temporarily allow all origins for debugging
@@ -53,6 +268,8 @@ app.add_middleware(
     allow_headers=["*"], # Allow all headers
 )
 
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=6)
+
 app.include_router(simulados.router)
 app.include_router(edital_verticalizado.router)
 app.include_router(calendario.router, prefix="/api/calendario")
@@ -60,7 +277,7 @@ app.include_router(calendario.router, prefix="/api/calendario")
 # --- Authentication Endpoints ---
 
 @app.post("/api/token", response_model=schemas.Token)
-async def login_for_access_token(
+def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
 ):
     """
@@ -92,7 +309,7 @@ async def login_for_access_token(
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/api/users/me/", response_model=schemas.User)
-async def read_users_me(current_user: schemas.User = Depends(auth.get_current_user)):
+def read_users_me(current_user: schemas.User = Depends(auth.get_current_user)):
     """
     Endpoint to get information about the logged-in user.
     """
@@ -100,7 +317,7 @@ async def read_users_me(current_user: schemas.User = Depends(auth.get_current_us
     return current_user
 
 @app.post("/api/register/", response_model=schemas.User)
-async def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     """
     Endpoint for new user registration.
     """
@@ -124,7 +341,7 @@ async def register_user(user: schemas.UserCreate, db: Session = Depends(get_db))
 # --- User Management Endpoints (Admin Only) ---
 
 @app.get("/api/users/pending/", response_model=List[schemas.User])
-async def get_pending_users(current_user: schemas.User = Depends(auth.get_current_admin_user), db: Session = Depends(get_db)):
+def get_pending_users(current_user: schemas.User = Depends(auth.get_current_admin_user), db: Session = Depends(get_db)):
     """
     Returns a list of users pending approval. Admin only.
     """
@@ -133,41 +350,52 @@ async def get_pending_users(current_user: schemas.User = Depends(auth.get_curren
     return users
 
 @app.patch("/api/users/{user_id}/approve", response_model=schemas.User)
-async def approve_user(user_id: int, current_user: schemas.User = Depends(auth.get_current_admin_user), db: Session = Depends(get_db)):
+def approve_user(user_id: int, current_user: schemas.User = Depends(auth.get_current_admin_user), db: Session = Depends(get_db)):
     """
     Approves a user, activating their account. Admin only.
     """
     logger.info(f"Admin {current_user.username} approving user ID: {user_id}")
     user = crud.update_user_status(db, user_id, is_active=True)
+    auth.invalidate_principal(user_id)
     if not user:
         logger.warning(f"Attempt to approve non-existent user ID: {user_id}")
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     return user
 
 @app.patch("/api/users/{user_id}/reject", response_model=schemas.User)
-async def reject_user(user_id: int, current_user: schemas.User = Depends(auth.get_current_admin_user), db: Session = Depends(get_db)):
+def reject_user(user_id: int, current_user: schemas.User = Depends(auth.get_current_admin_user), db: Session = Depends(get_db)):
     """
     Rejects a user, deactivating their account. Admin only.
     """
     logger.info(f"Admin {current_user.username} rejecting user ID: {user_id}")
     user = crud.update_user_status(db, user_id, is_active=False)
+    auth.invalidate_principal(user_id)
     if not user:
         logger.warning(f"Attempt to reject non-existent user ID: {user_id}")
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     return user
 
+@app.get("/api/admin/metrics", response_model=Dict[str, Any])
+def get_metrics(current_user: schemas.User = Depends(auth.get_current_admin_user)):
+    """
+    Returns the in-process metrics (password hashing pool, etc.) of this worker. Admin only.
+    """
+    return metrics.snapshot()
+
 # --- Question Endpoints ---
 
 @app.get("/api/questions/buscar", response_model=List[schemas.Question])
-async def search_questions_route(
+def search_questions_route(
     query: Optional[str] = Query(None),
-    db: Session = Depends(get_db),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. id,materia,assunto"),
+    db: Session = Depends(get_read_db),
     current_user: schemas.User = Depends(auth.get_current_user)
 ):
-    return crud.search_questions(db, query=query)
+    field_list = parse_fields_param(fields)
+    return JSONResponse(crud.question_payloads(crud.search_questions(db, query=query), fields=field_list))
 
 @app.get("/api/questions/count-filtered/", response_model=Dict[str, Any])
-async def count_filtered_questions(
+def count_filtered_questions(
     skip: int = 0,
     limit: int = 100,
     search: Optional[str] = None,
@@ -182,8 +410,9 @@ async def count_filtered_questions(
     regiao: Optional[str] = None,
     exclude_anuladas: Optional[bool] = False,
     exclude_desatualizadas: Optional[bool] = False,
+    topic_id: Optional[int] = Query(None, description="Assunto of the topic tree, with all its sub-assuntos"),
     current_user: schemas.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Counts the number of questions based on filters and returns their IDs.
@@ -195,8 +424,8 @@ async def count_filtered_questions(
     if search:
         try:
             question_id = int(search)
-            question = crud.get_question(db, question_id=question_id)
-            return {"count": 1 if question else 0, "ids": [question_id] if question else []}
+            exists = crud.get_question_version(db, question_id) is not None
+            return {"count": 1 if exists else 0, "ids": [question_id] if exists else []}
         except ValueError:
             found_questions = crud.search_questions_by_enunciado(db, search)
             ids = [q.id for q in found_questions]
@@ -215,14 +444,42 @@ async def count_filtered_questions(
         dificuldade=[dificuldade] if dificuldade else None,
         regiao=[regiao] if regiao else None,
         exclude_anuladas=exclude_anuladas,
-        exclude_desatualizadas=exclude_desatualizadas
+        exclude_desatualizadas=exclude_desatualizadas,
+        topic_id=topic_id
     )
 
     return result
 
 
+@app.get("/api/questions/statistics", response_model=List[schemas.QuestionStatistics])
+def get_bulk_question_stats(
+    ids: str = Query(..., description="Comma-separated question IDs"),
+    db: Session = Depends(get_read_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    """
+    Gets performance statistics and answer distribution for several questions at once.
+    """
+    question_ids = parse_ids_param(ids)
+    logger.info(f"User {current_user.username} fetching statistics for {len(question_ids)} questions.")
+    return crud.get_question_statistics_bulk(db, question_ids)
+
+@app.get("/api/questions/context", response_model=List[schemas.QuestionContext])
+def get_questions_context(
+    ids: str = Query(..., description="Comma-separated question IDs"),
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    """
+    Returns, in one request, the statistics, split statistics, note, favorite status
+    and comment count of several questions (e.g. the current and the next page of a notebook).
+    """
+    question_ids = parse_ids_param(ids)
+    logger.info(f"User {current_user.username} fetching context for {len(question_ids)} questions.")
+    return crud.get_questions_context(db, current_user.id, question_ids)
+
 @app.post("/api/questions/", response_model=schemas.Question, status_code=status.HTTP_201_CREATED)
-async def create_question(
+def create_question(
     question: schemas.QuestionCreate,
     current_user: schemas.User = Depends(auth.get_current_admin_user),
     db: Session = Depends(get_db)
@@ -231,12 +488,38 @@ async def create_question(
     db_question = crud.create_question(db=db, question=question)
     return db_question
 
+@app.post("/api/questions/possible-duplicates", response_model=List[schemas.PossibleDuplicate])
+def check_possible_duplicates(
+    question: schemas.DuplicateCheck,
+    current_user: schemas.User = Depends(auth.get_current_admin_user),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Lists existing questions nearly identical to the given statement and alternatives,
+    so the admin can check before creating (or editing) a question. Admin only.
+    """
+    return crud.find_possible_duplicates(db, question, exclude_id=question.exclude_id)
+
+@app.post("/api/admin/questions/near-duplicates/report", response_model=schemas.Job, status_code=status.HTTP_202_ACCEPTED)
+def report_near_duplicates(current_user: schemas.User = Depends(auth.get_current_admin_user)):
+    """
+    Queues the report of near-duplicate groups over the whole bank; the groups are in the job result. Admin only.
+    """
+    logger.info(f"Admin {current_user.username} queueing near-duplicate report")
+    return submit_job("near_duplicate_report", {}, current_user.id)
+
 @app.get("/api/questions/fields/{field_name}", response_model=List[str])
-async def get_unique_fields(
+def get_unique_fields(
     field_name: str,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
     current_user: schemas.User = Depends(auth.get_current_user)
 ):
+    etag = http_cache.make_etag("fields", field_name, crud.get_questions_fingerprint(db))
+    if http_cache.is_fresh(request, etag):
+        return http_cache.not_modified(etag)
+    http_cache.set_headers(response, etag)
     try:
         print(f"Requested field: {field_name}")
         valores = crud.get_unique_question_fields(db, field_name)
@@ -246,7 +529,7 @@ async def get_unique_fields(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/questions/", response_model=List[schemas.Question])
-async def read_questions(
+def read_questions(
     skip: int = 0,
     limit: int = 100,
     materia: Optional[str] = None,
@@ -258,10 +541,13 @@ async def read_questions(
     escolaridade: Optional[str] = None,
     dificuldade: Optional[str] = None,
     regiao: Optional[str] = None,
+    topic_id: Optional[int] = Query(None, description="Assunto of the topic tree, with all its sub-assuntos"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. id,materia,assunto"),
     current_user: schemas.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     logger.info(f"User {current_user.username} fetching questions with filters: Materia={materia}, Assunto={assunto}, Banca={banca}")
+    field_list = parse_fields_param(fields)
     
     # CORREÇÃO AQUI: Passa 'assuntos' como uma lista, mesmo que contenha apenas um item ou seja None
     assuntos_list = [assunto] if assunto else None 
@@ -271,28 +557,98 @@ async def read_questions(
         materia=materia, 
         assuntos=assuntos_list, # <-- CORRIGIDO: Agora passa 'assuntos' como uma lista
         banca=banca, orgao=orgao, cargo=cargo,
-        ano=ano, escolaridade=escolaridade, dificuldade=dificuldade, regiao=regiao
+        ano=ano, escolaridade=escolaridade, dificuldade=dificuldade, regiao=regiao,
+        topic_id=topic_id
     )
-    return questions
+    return JSONResponse(crud.question_payloads(questions, fields=field_list))
+
+@app.get("/api/admin/questions/export")
+def export_questions(
+    format: str = Query("ndjson", description="ndjson or csv"),
+    compress: Optional[str] = Query(None, description="gzip to download a compressed file"),
+    include_stats: bool = Query(False, description="Appends the QuestionStatistics counters"),
+    materia: Optional[str] = None,
+    assunto: Optional[List[str]] = Query(None),
+    banca: Optional[List[str]] = Query(None),
+    orgao: Optional[List[str]] = Query(None),
+    cargo: Optional[List[str]] = Query(None),
+    ano: Optional[List[int]] = Query(None),
+    escolaridade: Optional[List[str]] = Query(None),
+    dificuldade: Optional[List[str]] = Query(None),
+    regiao: Optional[List[str]] = Query(None),
+    exclude_anuladas: bool = False,
+    exclude_desatualizadas: bool = False,
+    topic_id: Optional[int] = None,
+    current_user: schemas.User = Depends(auth.get_current_admin_user)
+):
+    """
+    Streams the question bank as NDJSON or CSV, with the filters of /api/questions/
+    (repeat a parameter for several values). Memory use does not grow with the number
+    of questions. Admin only.
+    """
+    if format not in question_export.FORMATS:
+        raise HTTPException(status_code=400, detail="Formato inválido. Use 'ndjson' ou 'csv'.")
+    if compress not in (None, "gzip"):
+        raise HTTPException(status_code=400, detail="Compressão inválida. Use 'gzip'.")
+    filters = {"materia": materia, "assuntos": assunto, "banca": banca, "orgao": orgao, "cargo": cargo, "ano": ano,
+               "escolaridade": escolaridade, "dificuldade": dificuldade, "regiao": regiao,
+               "exclude_anuladas": exclude_anuladas, "exclude_desatualizadas": exclude_desatualizadas, "topic_id": topic_id}
+    logger.info(f"Admin {current_user.username} exporting questions as {format} (stats={include_stats}, compress={compress}): {filters}")
+
+    def body():
+        # Own session: the request's dependencies may be closed while the body is still streaming
+        db = ReadSessionLocal()
+        try:
+            yield from question_export.export_chunks(db, format, filters, include_stats, gzip=compress == "gzip")
+        finally:
+            db.close()
+
+    filename = f"questoes.{format}" + (".gz" if compress else "")
+    media_type = "application/gzip" if compress else question_export.MEDIA_TYPES[format]
+    return StreamingResponse(body(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
 @app.get("/api/questions/{question_id}", response_model=schemas.Question)
-async def read_question(
+def read_question(
     question_id: int,
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(auth.get_current_user)
 ):
     """
     Gets a question by ID.
+    Answers 304 when the client's ETag still matches the question version.
     """
     logger.info(f"User {current_user.username} fetching question ID: {question_id}")
+    version = crud.get_question_version(db, question_id)
+    etag = http_cache.make_etag("question", question_id, version)
+    if version is not None and http_cache.is_fresh(request, etag):
+        return http_cache.not_modified(etag)
     db_question = crud.get_question(db, question_id=question_id)
     if db_question is None:
         logger.warning(f"Question ID {question_id} not found.")
         raise HTTPException(status_code=404, detail="Questão não encontrada")
+    http_cache.set_headers(response, etag)
     return db_question
 
+@app.get("/api/questions/{question_id}/similar", response_model=List[schemas.SimilarQuestion])
+def get_similar_questions(
+    question_id: int,
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_read_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    """
+    Lists the questions most similar in content (statement and assunto) to the given one.
+    """
+    similar = crud.get_similar_questions(db, question_id, limit)
+    if similar is None:
+        raise HTTPException(status_code=404, detail="Questão não encontrada")
+    return JSONResponse(similar)
+
 @app.put("/api/questions/{question_id}", response_model=schemas.Question)
-async def update_question(
+def update_question(
     question_id: int,
     question: schemas.QuestionCreate,
     current_user: schemas.User = Depends(auth.get_current_admin_user),
@@ -306,7 +662,7 @@ async def update_question(
     return db_question
 
 @app.patch("/api/questions/{question_id}/status", response_model=schemas.Question)
-async def update_question_status_route(
+def update_question_status_route(
     question_id: int,
     status_update: schemas.QuestionStatusUpdate,
     current_user: schemas.User = Depends(auth.get_current_admin_user),
@@ -323,7 +679,7 @@ async def update_question_status_route(
     return db_question
 
 @app.delete("/api/questions/{question_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_question(
+def delete_question(
     question_id: int,
     current_user: schemas.User = Depends(auth.get_current_admin_user),
     db: Session = Depends(get_db)
@@ -339,8 +695,28 @@ async def delete_question(
 # --- Question Statistics Endpoints (Individual) ---
 
 # NEW ENDPOINT: GET to fetch question statistics
+@app.get("/api/questions/{question_id}/comentario-professor", response_model=schemas.QuestionTeacherComment)
+def read_question_teacher_comment(
+    question_id: int,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    """
+    Gets only the teacher comment of a question, for clients that list questions with ?fields=.
+    """
+    row = crud.get_question_teacher_comment(db, question_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Questão não encontrada")
+    etag = http_cache.make_etag("comentario-professor", question_id, row.version)
+    if http_cache.is_fresh(request, etag):
+        return http_cache.not_modified(etag)
+    http_cache.set_headers(response, etag)
+    return {"question_id": question_id, "comentarioProfessor": row.comentarioProfessor}
+
 @app.get("/api/questions/{question_id}/statistics", response_model=schemas.QuestionStatistics)
-async def get_question_stats_route(
+def get_question_stats_route(
     question_id: int, 
     db: Session = Depends(get_db), 
     current_user: schemas.User = Depends(auth.get_current_user)
@@ -350,82 +726,39 @@ async def get_question_stats_route(
     """
     logger.info(f"User {current_user.username} fetching statistics for question ID: {question_id}")
     stats = crud.get_question_statistics(db, question_id=question_id)
-    if not stats:
-        # Returns zeroed statistics if no record yet
-        return schemas.QuestionStatistics(question_id=question_id, total_attempts=0, correct_attempts=0)
-    return stats
+    # Returns zeroed statistics if no record yet
+    return crud.question_statistics_payload(stats, question_id)
 
 @app.get("/api/questions/{question_id}/statistics/split", response_model=Dict[str, Any])
-async def get_split_statistics(
+def get_split_statistics(
     question_id: int,
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(auth.get_current_user)
 ):
-    total = crud.get_question_statistics(db, question_id)
-
-    user_attempts = 0
-    user_corrects = 0
-
-    user_progresses = db.query(models.NotebookProgress).filter(
-        models.NotebookProgress.user_id == current_user.id
-    ).all()
-
-    for progress in user_progresses:
-        respostas = json.loads(progress.respostas) if isinstance(progress.respostas, str) else progress.respostas
-        user_answer = respostas.get(str(question_id))
-        if user_answer is not None:
-            user_attempts += 1
-            question = crud.get_question(db, question_id)
-            if question:
-                gabarito = question.gabarito.upper()
-                tipo = question.tipo
-                if tipo == "multipla":
-                    g_map = {'A': 0, 'B': 1, 'C': 2, 'D': 3, 'E': 4}
-                    if user_answer == g_map.get(gabarito):
-                        user_corrects += 1
-                elif tipo == "certo_errado":
-                    correto = 1 if gabarito.lower() == "certo" else 0
-                    if user_answer == correto:
-                        user_corrects += 1
-
-    others_attempts = total.total_attempts - user_attempts
-    others_corrects = total.correct_attempts - user_corrects
-
-    return {
-        "total": {
-            "tentativas": total.total_attempts,
-            "acertos": total.correct_attempts
-        },
-        "usuario": {
-            "tentativas": user_attempts,
-            "acertos": user_corrects
-        },
-        "outros": {
-            "tentativas": others_attempts,
-            "acertos": others_corrects
-        }
-    }
+    return crud.get_split_statistics_bulk(db, current_user.id, [question_id])[question_id]
 
 @app.patch("/api/questions/{question_id}/statistics", response_model=schemas.QuestionStatistics)
-async def update_question_statistics_route(
+def update_question_statistics_route(
     question_id: int,
     is_correct: bool = Body(..., embed=True), 
+    resposta: Optional[int] = Body(None, embed=True), # Chosen alternative (0-4, or 1/0 for Certo/Errado)
     current_user: schemas.User = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     """
-    Updates the statistics of a question (total attempts, correct answers).
+    Updates the statistics of a question (total attempts, correct answers and,
+    when 'resposta' is sent, the answer distribution).
     Accessible by users and administrators.
     """
     logger.info(f"User {current_user.username} updating statistics for question ID: {question_id}, Correct: {is_correct}")
-    stats = crud.update_question_statistics(db, question_id, is_correct)
+    stats = run_write(db, crud.update_question_statistics, question_id, is_correct, answer=resposta)
     if not stats:
         logger.warning(f"Question ID {question_id} not found to update statistics.")
         raise HTTPException(status_code=404, detail="Questão não encontrada para atualizar estatísticas")
-    return stats
+    return crud.question_statistics_payload(stats, question_id)
 
 @app.get("/api/users/me/stats", response_model=schemas.UserStats)
-async def get_my_stats(current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+def get_my_stats(current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
     """
     Returns general study statistics for the logged-in user.
     """
@@ -436,7 +769,7 @@ async def get_my_stats(current_user: schemas.User = Depends(auth.get_current_use
 # --- Notebook Endpoints ---
 
 @app.post("/api/notebooks/", response_model=schemas.Notebook, status_code=status.HTTP_201_CREATED)
-async def create_notebook(
+def create_notebook(
     notebook: schemas.NotebookCreate,
     current_user: schemas.User = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
@@ -449,7 +782,7 @@ async def create_notebook(
     return db_notebook
 
 @app.get("/api/notebooks/", response_model=List[schemas.Notebook])
-async def read_user_notebooks(
+def read_user_notebooks(
     current_user: schemas.User = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -461,7 +794,7 @@ async def read_user_notebooks(
     return notebooks
 
 @app.get("/api/notebooks/{notebook_id}/resolve_data", response_model=schemas.NotebookResolveData)
-async def get_notebook_resolve_data(
+def get_notebook_resolve_data(
     notebook_id: int,
     current_user: schemas.User = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
@@ -479,15 +812,16 @@ async def get_notebook_resolve_data(
     if db_notebook_data.progress_data:
         progress_schema = schemas.NotebookProgress.model_validate(db_notebook_data.progress_data)
 
-    return schemas.NotebookResolveData(
-        nome=db_notebook_data.nome,
-        questoes=db_notebook_data.questions_data,
-        progresso=progress_schema
-    )
+    # The questions are already JSON-ready payloads; skip re-validating them through response_model
+    return JSONResponse({
+        "nome": db_notebook_data.nome,
+        "questoes": db_notebook_data.questions_data,
+        "progresso": progress_schema.model_dump(mode="json") if progress_schema else None
+    })
 
 # NEW ENDPOINT: GET to fetch the progress of a specific notebook
 @app.get("/api/notebooks/{notebook_id}/progress", response_model=schemas.NotebookProgress)
-async def get_notebook_progress_route(
+def get_notebook_progress_route(
     notebook_id: int,
     current_user: schemas.User = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
@@ -508,7 +842,7 @@ async def get_notebook_progress_route(
     return db_progress
 
 @app.patch("/api/notebooks/{notebook_id}/progress", response_model=schemas.NotebookProgress)
-async def update_progress(
+def update_progress(
     notebook_id: int,
     progress_data: schemas.NotebookProgressUpdate,
     current_user: schemas.User = Depends(auth.get_current_user),
@@ -518,11 +852,11 @@ async def update_progress(
     Updates the progress of a notebook for the logged-in user.
     """
     logger.info(f"User {current_user.username} updating progress for notebook ID: {notebook_id}")
-    db_progress = crud.create_or_update_notebook_progress(db, notebook_id, current_user.id, progress_data)
+    db_progress = run_write(db, crud.create_or_update_notebook_progress, notebook_id, current_user.id, progress_data)
     return db_progress
 
 @app.patch("/api/notebooks/{notebook_id}/resposta")
-async def register_question_response(
+def register_question_response(
     notebook_id: int,
     response_data: Dict[str, Any],
     db: Session = Depends(get_db),
@@ -533,6 +867,7 @@ async def register_question_response(
     """
     question_id = response_data.get("questaoId")
     is_correct = response_data.get("acertou")
+    answer = response_data.get("resposta")
 
     if question_id is None or is_correct is None:
         raise HTTPException(status_code=400, detail="Incomplete response data (questaoId and acertou are required).")
@@ -542,14 +877,14 @@ async def register_question_response(
         raise HTTPException(status_code=403, detail="Acesso negado ou caderno não encontrado.")
     
     try:
-        crud.update_question_statistics(db, question_id=question_id, is_correct=is_correct)
+        run_write(db, crud.update_question_statistics, question_id=question_id, is_correct=is_correct, answer=answer)
         return {"message": "Resposta registrada e estatísticas atualizadas com sucesso."}
     except Exception as e:
         logger.error(f"Error registering response and updating statistics for question ID {question_id}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Erro interno ao processar a resposta: {e}")
 
 @app.put("/api/notebooks/{notebook_id}", response_model=schemas.Notebook)
-async def update_notebook(
+def update_notebook(
     notebook_id: int,
     notebook_update: schemas.NotebookUpdate,
     current_user: schemas.User = Depends(auth.get_current_user),
@@ -566,7 +901,7 @@ async def update_notebook(
     return db_notebook
 
 @app.delete("/api/notebooks/{notebook_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_notebook(
+def delete_notebook(
     notebook_id: int,
     current_user: schemas.User = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
@@ -584,7 +919,7 @@ async def delete_notebook(
 # --- Comment Endpoints ---
 
 @app.post("/api/questions/{question_id}/comments", response_model=schemas.Comment, status_code=status.HTTP_201_CREATED)
-async def create_comment_for_question(
+def create_comment_for_question(
     question_id: int,
     comment: schemas.CommentCreate,
     current_user: schemas.User = Depends(auth.get_current_user),
@@ -614,7 +949,7 @@ async def create_comment_for_question(
     )
 
 @app.get("/api/questions/{question_id}/comments", response_model=List[Dict[str, Any]])
-async def get_question_comments(
+def get_question_comments(
     question_id: int,
     orderBy: str = "createdAt", 
     order: str = "desc",
@@ -625,10 +960,10 @@ async def get_question_comments(
     Returns all comments for a specific question, with the current user's vote status.
     """
     logger.info(f"User {current_user.username} fetching comments for question ID: {question_id}")
-    return crud.get_comments_with_vote_status(db, question_id, current_user.id)
+    return JSONResponse(crud.get_comments_with_vote_status(db, question_id, current_user.id))
 
 @app.put("/api/questions/comments/{comment_id}", response_model=schemas.Comment)
-async def update_comment_route(
+def update_comment_route(
     comment_id: int,
     comment_update: schemas.CommentCreate,
     current_user: schemas.User = Depends(auth.get_current_user),
@@ -645,7 +980,7 @@ async def update_comment_route(
     return db_comment
 
 @app.delete("/api/questions/comments/{comment_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_comment_route(
+def delete_comment_route(
     comment_id: int,
     current_user: schemas.User = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
@@ -661,7 +996,7 @@ async def delete_comment_route(
     return {"message": "Comentário deletado com sucesso"}
 
 @app.patch("/api/questions/comments/{comment_id}/vote", response_model=schemas.Comment)
-async def vote_on_comment(
+def vote_on_comment(
     comment_id: int,
     type: str = Query(..., description="Vote type: upvote, downvote, or remove"),
     current_user: schemas.User = Depends(auth.get_current_user),
@@ -675,7 +1010,7 @@ async def vote_on_comment(
     if type not in ["upvote", "downvote", "remove"]:
         raise HTTPException(status_code=400, detail="Tipo de voto inválido. Use 'upvote', 'downvote' ou 'remove'.")
 
-    db_comment = crud.vote_comment(db, comment_id, current_user.id, type)
+    db_comment = run_write(db, crud.vote_comment, comment_id, current_user.id, type)
 
     if not db_comment:
         logger.warning(f"Comment ID {comment_id} not found for voting.")
@@ -729,7 +1064,7 @@ def read_comment_detail(
 # --- Theory Endpoints ---
 
 @app.post("/api/theories/", response_model=schemas.Theory, status_code=status.HTTP_201_CREATED)
-async def create_or_update_theory(
+def create_or_update_theory(
     theory: schemas.TheoryCreate,
     current_user: schemas.User = Depends(auth.get_current_admin_user),
     db: Session = Depends(get_db)
@@ -742,24 +1077,32 @@ async def create_or_update_theory(
     return db_theory
 
 @app.get("/api/theories/", response_model=List[schemas.TheoryMeta])
-async def get_all_theory_metadata(
+def get_all_theory_metadata(
+    request: Request,
+    response: Response,
     current_user: schemas.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Returns metadata (subject and topic) for all theories.
     Accessible by users and administrators.
     """
     logger.info(f"User {current_user.username} fetching theory metadata.")
+    etag = http_cache.make_etag("theories", crud.get_theories_fingerprint(db))
+    if http_cache.is_fresh(request, etag):
+        return http_cache.not_modified(etag)
+    http_cache.set_headers(response, etag)
     theories_meta = crud.get_all_theory_metadata(db)
     return theories_meta
 
 @app.get("/api/theories", response_model=schemas.Theory)
-async def get_theory_content(
+def get_theory_content(
+    request: Request,
+    response: Response,
     materia: str = Query(...),
     assunto: str = Query(...),
     current_user: schemas.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     materia = unquote(materia)
     assunto = unquote(assunto)
@@ -768,14 +1111,19 @@ async def get_theory_content(
     Accessible by users and administrators.
     """
     logger.info(f"User {current_user.username} fetching theory for Subject: {materia}, Topic: {assunto}")
+    current = crud.get_theory_version(db, materia, assunto)
+    etag = http_cache.make_etag("theory", *current) if current else None
+    if current and http_cache.is_fresh(request, etag, current.updated_at):
+        return http_cache.not_modified(etag, current.updated_at)
     db_theory = crud.get_theory(db, materia, assunto)
     if not db_theory:
         logger.warning(f"Theory not found for Subject: {materia}, Topic: {assunto}")
         raise HTTPException(status_code=404, detail="Teoria não encontrada")
+    http_cache.set_headers(response, etag, current.updated_at)
     return db_theory
 
 @app.delete("/api/theories/{materia}/{assunto}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_theory_route(
+def delete_theory_route(
     materia: str,
     assunto: str,
     current_user: schemas.User = Depends(auth.get_current_admin_user),
@@ -791,37 +1139,214 @@ async def delete_theory_route(
         raise HTTPException(status_code=404, detail="Teoria não encontrada")
     return {"message": "Teoria deletada com sucesso"}
 
-# --- PDF Upload Endpoints (Placeholder) ---
+# --- PDF Upload Endpoints ---
 
-@app.post("/api/upload-pdf/")
+@app.post("/api/upload-pdf/", response_model=schemas.Job, status_code=status.HTTP_202_ACCEPTED)
 async def upload_pdf(
     file: UploadFile = File(...),
-    current_user: schemas.User = Depends(auth.get_current_admin_user),
-    db: Session = Depends(get_db)
+    gabarito: Optional[UploadFile] = File(None, description="Answer key PDF, when it is not at the end of the prova"),
+    materia: Optional[str] = Form(None),
+    assunto: Optional[str] = Form(None),
+    banca: Optional[str] = Form(None),
+    orgao: Optional[str] = Form(None),
+    cargo: Optional[str] = Form(None),
+    ano: Optional[int] = Form(None),
+    escolaridade: Optional[str] = Form(None),
+    current_user: schemas.User = Depends(auth.get_current_admin_user)
 ):
     """
-    Endpoint for uploading and processing PDF files for question extraction.
-    Admin only.
+    Endpoint for uploading PDF files for question extraction.
+    The files are streamed to disk (up to MAX_UPLOAD_MB each, PDF signature checked first)
+    and imported by a "pdf_import" background job; the response is
+    the job, to be followed at /api/jobs/{id} (or its /events stream).
+    The optional form fields are applied to every extracted question; banca and year
+    otherwise come from the cover page. Admin only.
     """
     logger.info(f"Admin {current_user.username} starting PDF upload: {file.filename}")
-    if not file.filename.endswith(".pdf"):
+    if not file.filename.endswith(".pdf") or (gabarito is not None and not gabarito.filename.endswith(".pdf")):
         logger.warning(f"Attempt to upload non-PDF file: {file.filename}")
         raise HTTPException(status_code=400, detail="Apenas arquivos PDF são permitidos.")
 
+    metadata = {"materia": materia, "assunto": assunto, "banca": banca, "orgao": orgao,
+                "cargo": cargo, "ano": ano, "escolaridade": escolaridade}
+    files: List[str] = []
     try:
-        pdf_content = await file.read()
-        num_questions_added = pdf_processor.process_pdf_and_add_questions(db, pdf_content)
-        
-        logger.info(f"PDF '{file.filename}' processed successfully. {num_questions_added} questions added.")
-        return {"message": f"PDF processado com sucesso! {num_questions_added} questões adicionadas."}
+        for upload in (file, gabarito):
+            if upload is not None:
+                files.append(await run_in_threadpool(save_upload, upload, uploads.MAX_UPLOAD_BYTES, pdf_parser.looks_like_pdf))
+        for path in files:
+            await run_in_threadpool(pdf_parser.page_count, path) # Rejects corrupted files before queueing
+        job = submit_job("pdf_import", {
+            "pdf_path": files[0],
+            "gabarito_path": files[1] if len(files) > 1 else None,
+            "metadata": metadata,
+            "files": files,
+        }, current_user.id)
     except Exception as e:
-        logger.error(f"Error processing PDF '{file.filename}': {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Erro ao processar o PDF: {str(e)}")
+        for path in files:
+            os.unlink(path)
+        if isinstance(e, (pdf_parser.InvalidPDF, uploads.InvalidUpload)):
+            raise HTTPException(status_code=400, detail="Arquivo PDF inválido ou corrompido.")
+        if isinstance(e, uploads.UploadTooLarge):
+            raise HTTPException(status_code=413, detail=uploads.too_large_detail(uploads.MAX_UPLOAD_BYTES))
+        raise
+    logger.info(f"PDF '{file.filename}' queued as job {job.id}.")
+    return job
+
+# --- Bulk Question Import ---
+
+@app.post("/api/admin/questions/import", response_model=schemas.Job, status_code=status.HTTP_202_ACCEPTED)
+async def import_questions(
+    file: UploadFile = File(..., description="JSONL or CSV file with the QuestionCreate fields"),
+    format: Optional[str] = Form(None, description="jsonl or csv; taken from the file extension when omitted"),
+    current_user: schemas.User = Depends(auth.get_current_admin_user)
+):
+    """
+    Imports a question bank as a "question_import" background job: rows are validated
+    and inserted in chunks, duplicates (by content) are skipped and invalid rows are
+    listed in the job result with their line number. Admin only.
+    """
+    format = format or question_import.detect_format(file.filename)
+    if format not in question_import.FORMATS:
+        raise HTTPException(status_code=400, detail="Formato não suportado. Envie um arquivo .jsonl ou .csv.")
+    logger.info(f"Admin {current_user.username} importing questions from {file.filename} ({format})")
+    try:
+        path = await run_in_threadpool(save_upload, file, uploads.MAX_IMPORT_BYTES, question_import.looks_like_text)
+    except uploads.InvalidUpload:
+        raise HTTPException(status_code=400, detail="O arquivo deve ser texto UTF-8.")
+    except uploads.UploadTooLarge:
+        raise HTTPException(status_code=413, detail=uploads.too_large_detail(uploads.MAX_IMPORT_BYTES))
+    try:
+        return submit_job("question_import", {"path": path, "format": format, "files": [path]}, current_user.id)
+    except HTTPException:
+        os.unlink(path)
+        raise
+
+# --- Background Job Endpoints ---
+
+@app.get("/api/jobs/{job_id}", response_model=schemas.Job)
+def get_job_status(
+    job_id: str,
+    current_user: schemas.User = Depends(auth.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Returns the status and progress of a background job (the result once it succeeded).
+    """
+    return get_job_or_404(db, job_id, current_user)
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(
+    job_id: str,
+    request: Request,
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    """
+    Server-Sent Events stream of a job: one "job" event whenever it changes, ending
+    when the job finishes.
+    """
+    def load() -> Dict[str, Any]:
+        db = SessionLocal()
+        try:
+            return schemas.Job.model_validate(get_job_or_404(db, job_id, current_user)).model_dump(mode="json")
+        finally:
+            db.close()
+
+    first = await run_in_threadpool(load) # 404 before the stream starts
+
+    async def events():
+        job, last_sent = first, None
+        idle = 0.0
+        while True:
+            if job != last_sent:
+                yield b"event: job\ndata: " + orjson.dumps(job) + b"\n\n"
+                last_sent, idle = job, 0.0
+                if job["status"] in jobs.TERMINAL_STATUSES:
+                    return
+            elif idle >= JOB_EVENTS_HEARTBEAT_SECONDS:
+                yield b": heartbeat\n\n"
+                idle = 0.0
+            await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+            idle += JOB_EVENTS_POLL_SECONDS
+            if await request.is_disconnected():
+                return
+            job = await run_in_threadpool(load)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/api/jobs/{job_id}/cancel", response_model=schemas.Job)
+def cancel_job(
+    job_id: str,
+    current_user: schemas.User = Depends(auth.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Cancels a job: a pending one at once, a running one at its next progress checkpoint.
+    """
+    job = get_job_or_404(db, job_id, current_user)
+    if job.status in jobs.TERMINAL_STATUSES:
+        raise HTTPException(status_code=409, detail="A tarefa já foi concluída.")
+    logger.info(f"User {current_user.username} cancelling job {job_id}")
+    return jobs.cancel(db, job)
+
+@app.post("/api/admin/jobs/recalibrate", response_model=schemas.Job, status_code=status.HTTP_202_ACCEPTED)
+def recalibrate_statistics(current_user: schemas.User = Depends(auth.get_current_admin_user)):
+    """
+    Queues the recalculation of the questions' correct_attempts from the answer
+    distribution and the current answer key (e.g. after gabaritos were fixed). Admin only.
+    """
+    logger.info(f"Admin {current_user.username} queueing statistics recalibration")
+    return submit_job("recalibrate", {}, current_user.id)
+
+@app.post("/api/admin/jobs/user-study-stats", response_model=schemas.Job, status_code=status.HTTP_202_ACCEPTED)
+def rebuild_user_study_stats(current_user: schemas.User = Depends(auth.get_current_admin_user)):
+    """
+    Queues the recalculation of the users' per-question and per-assunto statistics from
+    the saved notebook progress (e.g. for answers saved before they existed). Admin only.
+    """
+    logger.info(f"Admin {current_user.username} queueing user study statistics rebuild")
+    return submit_job("user_study_stats", {}, current_user.id)
+
+@app.post("/api/admin/jobs/question-topics", response_model=schemas.Job, status_code=status.HTTP_202_ACCEPTED)
+def backfill_question_topics(current_user: schemas.User = Depends(auth.get_current_admin_user)):
+    """
+    Queues the linking of the questions without a topic to the node of their assunto. Admin only.
+    """
+    logger.info(f"Admin {current_user.username} queueing question topics backfill")
+    return submit_job("question_topics", {}, current_user.id)
+
+# --- Topic Tree Endpoints ---
+
+@app.get("/api/topics", response_model=List[schemas.TopicNode])
+def read_topics(
+    materia: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    """
+    Returns the assunto tree (of one materia) as a flat list, parents before children;
+    pass a node's id as topic_id to filter questions by it and all its sub-assuntos.
+    """
+    return JSONResponse(crud.get_topics(db, materia))
+
+@app.post("/api/admin/topics/import", response_model=schemas.TopicImportSummary)
+def import_topic_outline(
+    conteudo: Dict[str, List[str]],
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(auth.get_current_admin_user)
+):
+    """
+    Adds numbered outlines ({materia: ["1 Assunto", "1.1 Subassunto", ...]}, the format of an
+    edital's conteudo) to the assunto tree, moving existing assuntos under their outline parent.
+    Admin only.
+    """
+    logger.info(f"Admin {current_user.username} importing topic outline for {list(conteudo)}")
+    return topic_tree.import_outline(db, conteudo)
 
 # --- Favorite Questions Endpoints (NEW) ---
 
 @app.post("/api/favorites/", response_model=schemas.FavoriteQuestion, status_code=status.HTTP_201_CREATED)
-async def add_favorite_question(
+def add_favorite_question(
     favorite_data: schemas.FavoriteQuestionCreate,
     current_user: schemas.User = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
@@ -856,7 +1381,7 @@ async def add_favorite_question(
     return db_favorite
 
 @app.delete("/api/favorites/{question_id}/{notebook_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def remove_favorite_question(
+def remove_favorite_question(
     question_id: int,
     notebook_id: int,
     current_user: schemas.User = Depends(auth.get_current_user),
@@ -872,7 +1397,7 @@ async def remove_favorite_question(
     return {"message": "Questão removida dos favoritos com sucesso."}
 
 @app.get("/api/favorites/", response_model=List[schemas.FavoriteQuestion])
-async def get_favorite_questions(
+def get_favorite_questions(
     current_user: schemas.User = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -881,14 +1406,50 @@ async def get_favorite_questions(
     """
     logger.info(f"User {current_user.username} fetching favorite questions.")
     favorites = crud.get_all_favorite_questions_for_user(db, current_user.id)
-    return favorites
+    return JSONResponse(favorites)
+
+@app.get("/api/users/me/next-questions", response_model=List[schemas.NextQuestion])
+def get_next_questions(
+    edital_id: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=50),
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    """
+    Returns the user's queue of recommended questions: wrong answers to review, unseen
+    questions of their weakest assuntos and of assuntos not practised yet (within the
+    edital's materias when edital_id is given).
+    """
+    queue = crud.get_next_questions(db, current_user.id, edital_id, limit)
+    if queue is None:
+        raise HTTPException(status_code=404, detail="Edital não encontrado")
+    return JSONResponse(queue)
 
 @app.get("/api/users/me/wrong-questions", response_model=List[schemas.FavoriteQuestion])
 def get_user_wrong_questions(
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(auth.get_current_user)
 ):
-    return crud.get_user_wrong_questions(db, current_user.id)
+    """
+    Returns the questions whose latest answer by the user is wrong, most recent first
+    (all of them unless limit is given).
+    """
+    return JSONResponse(crud.get_user_wrong_questions(db, current_user.id, skip, limit))
+
+@app.get("/api/review/due", response_model=List[schemas.ReviewQuestion])
+def get_due_reviews(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    """
+    Returns the user's wrong questions that are due for spaced-repetition review, most
+    overdue first, paginated with skip/limit.
+    """
+    return JSONResponse(crud.get_due_reviews(db, current_user.id, skip, limit))
 
 # --- Notes Endpoints (QuestionNote) ---
 
@@ -987,20 +1548,33 @@ def create_syllabus(
 
 @app.get("/api/edital-verticalizado/", response_model=List[schemas.VerticalizedSyllabus])
 def list_user_syllabi(
+    request: Request,
+    response: Response,
     current_user: schemas.User = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
+    etag = http_cache.make_etag("syllabi", current_user.id, crud.get_user_syllabi_fingerprint(db, current_user.id))
+    if http_cache.is_fresh(request, etag):
+        return http_cache.not_modified(etag)
+    http_cache.set_headers(response, etag)
     return crud.get_user_syllabi(db, current_user.id)
 
 @app.get("/api/edital-verticalizado/{syllabus_id}", response_model=schemas.VerticalizedSyllabus)
 def get_syllabus(
     syllabus_id: int,
+    request: Request,
+    response: Response,
     current_user: schemas.User = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
+    version = crud.get_syllabus_version(db, syllabus_id, current_user.id)
+    etag = http_cache.make_etag("syllabus", syllabus_id, version)
+    if version is not None and http_cache.is_fresh(request, etag):
+        return http_cache.not_modified(etag)
     syllabus = crud.get_syllabus_by_id(db, syllabus_id, current_user.id)
     if not syllabus:
         raise HTTPException(status_code=404, detail="Edital não encontrado")
+    http_cache.set_headers(response, etag)
     return syllabus
 
 @app.patch("/api/edital-verticalizado/{syllabus_id}", response_model=schemas.VerticalizedSyllabus)
@@ -1077,38 +1651,10 @@ def get_sugestoes_de_estudo_com_pesos(
     """
     Gera um plano de estudos com sugestões de horas por matéria baseado no edital e na banca.
     """
-    edital = crud.get_verticalized_syllabus(db, edital_id=edital_id)
-    if not edital:
+    sugestoes = crud.get_sugestoes_de_estudo(db, edital_id, banca, horas_semana)
+    if sugestoes is None:
         raise HTTPException(status_code=404, detail="Edital não encontrado")
 
-    materias = edital.conteudo.keys()
-    materias_data = {m: {"topicos": len(edital.conteudo[m]), "questoes_banca": 0} for m in materias}
-
-    # Contar questões da banca
-    for materia in materias_data.keys():
-        count = db.query(models.Question).filter(
-            models.Question.materia == materia,
-            models.Question.banca == banca
-        ).count()
-        materias_data[materia]["questoes_banca"] = count
-
-    # Calcular pesos e horas sugeridas
-    total_peso = sum(v["topicos"] + v["questoes_banca"] for v in materias_data.values())
-    sugestoes = []
-    for materia, dados in materias_data.items():
-        peso = dados["topicos"] + dados["questoes_banca"]
-        horas_sugeridas = round((peso / total_peso) * horas_semana, 2) if total_peso > 0 else 0
-        sugestoes.append({
-            "materia": materia,
-            "topicos": dados["topicos"],
-            "questoes_banca": dados["questoes_banca"],
-            "peso": peso,
-            "horas_sugeridas": horas_sugeridas
-        })
-
-    # Ordenar matérias por peso (mais prioridade primeiro)
-    sugestoes.sort(key=lambda x: x["peso"], reverse=True)
-
     return {"sugestoes": sugestoes}
 
 
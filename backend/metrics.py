@@ -0,0 +1,68 @@
+"""
+In-process metrics: counters, gauges and timings, exposed by /api/admin/metrics.
+
+Values are per worker process and reset on restart.
+"""
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict
+import threading
+import time
+
+TIMING_SAMPLES = 1024 # Most recent samples kept per timing for the percentiles
+
+_lock = threading.Lock()
+_counters: Dict[str, int] = {}
+_gauges: Dict[str, float] = {}
+_timings: Dict[str, Dict[str, Any]] = {}
+
+def incr(name: str, n: int = 1) -> None:
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+def set_gauge(name: str, value: float) -> None:
+    with _lock:
+        _gauges[name] = value
+
+def observe(name: str, seconds: float) -> None:
+    """
+    Records one duration sample for `name`.
+    """
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = _timings[name] = {"count": 0, "total": 0.0, "max": 0.0, "samples": deque(maxlen=TIMING_SAMPLES)}
+        timing["count"] += 1
+        timing["total"] += seconds
+        timing["max"] = max(timing["max"], seconds)
+        timing["samples"].append(seconds)
+
+@contextmanager
+def timer(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+def _percentile(samples: Deque[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def snapshot() -> Dict[str, Any]:
+    """
+    Returns every metric; timings are in milliseconds.
+    """
+    with _lock:
+        timings = {}
+        for name, timing in _timings.items():
+            samples = timing["samples"]
+            timings[name] = {
+                "count": timing["count"],
+                "avg_ms": round(timing["total"] / timing["count"] * 1000, 3),
+                "p50_ms": round(_percentile(samples, 50) * 1000, 3),
+                "p95_ms": round(_percentile(samples, 95) * 1000, 3),
+                "p99_ms": round(_percentile(samples, 99) * 1000, 3),
+                "max_ms": round(timing["max"] * 1000, 3),
+            }
+        return {"counters": dict(_counters), "gauges": dict(_gauges), "timings": timings}
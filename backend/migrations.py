@@ -0,0 +1,73 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+import logging
+
+logger = logging.getLogger(__name__)
+
+# `Base.metadata.create_all` only creates missing tables; it never alters an
+# existing one. Columns added to models after the database was created are
+# listed here as (table, column, DDL) and added on startup when missing.
+PENDING_COLUMNS = [
+    ("question_statistics", "count_a", "INTEGER NOT NULL DEFAULT 0"),
+    ("question_statistics", "count_b", "INTEGER NOT NULL DEFAULT 0"),
+    ("question_statistics", "count_c", "INTEGER NOT NULL DEFAULT 0"),
+    ("question_statistics", "count_d", "INTEGER NOT NULL DEFAULT 0"),
+    ("question_statistics", "count_e", "INTEGER NOT NULL DEFAULT 0"),
+    ("question_statistics", "count_certo", "INTEGER NOT NULL DEFAULT 0"),
+    ("question_statistics", "count_errado", "INTEGER NOT NULL DEFAULT 0"),
+    ("questions", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("theories", "updated_at", "DATETIME"),
+    ("theories", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("verticalized_syllabi", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("questions", "content_hash", "VARCHAR(64)"),
+    ("questions", "minhash", "BLOB"),
+    ("user_question_state", "notebook_id", "INTEGER REFERENCES notebooks (id)"),
+    ("user_question_state", "repeticoes", "INTEGER NOT NULL DEFAULT 0"),
+    ("user_question_state", "intervalo_dias", "FLOAT NOT NULL DEFAULT 0"),
+    ("user_question_state", "facilidade", "FLOAT NOT NULL DEFAULT 2.5"),
+    ("user_question_state", "revisar_em", "DATETIME"),
+    ("questions", "topic_id", "INTEGER REFERENCES topics (id)"),
+    ("jobs", "worker_id", "VARCHAR"),
+    ("jobs", "lease_expires_at", "DATETIME"),
+    ("jobs", "unique_key", "VARCHAR"),
+]
+
+# Indexes on columns from PENDING_COLUMNS, as (index name, table, column or tuple of columns)
+PENDING_INDEXES = [
+    ("ix_questions_content_hash", "questions", "content_hash"),
+    ("ix_user_question_state_revisar_em", "user_question_state", ("user_id", "revisar_em")),
+    ("ix_questions_topic_id", "questions", "topic_id"),
+]
+
+# Same, for unique indexes
+PENDING_UNIQUE_INDEXES = [
+    ("ix_jobs_unique_key", "jobs", "unique_key"),
+]
+
+def apply_pending_columns(engine: Engine) -> int:
+    """
+    Adds the columns from PENDING_COLUMNS (and the indexes from PENDING_INDEXES and
+    PENDING_UNIQUE_INDEXES) that are missing in the database. Returns the number of
+    columns added.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = 0
+    with engine.begin() as conn:
+        for table, column, ddl in PENDING_COLUMNS:
+            if table not in existing_tables:
+                continue
+            existing_columns = {c["name"] for c in inspector.get_columns(table)}
+            if column in existing_columns:
+                continue
+            logger.info(f"Adding column {table}.{column}")
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN "{column}" {ddl}'))
+            added += 1
+        indexes = [(entry, "INDEX") for entry in PENDING_INDEXES] + [(entry, "UNIQUE INDEX") for entry in PENDING_UNIQUE_INDEXES]
+        for (name, table, columns), kind in indexes:
+            if table in existing_tables and name not in {i["name"] for i in inspector.get_indexes(table)}:
+                logger.info(f"Creating index {name}")
+                columns = (columns,) if isinstance(columns, str) else columns
+                column_list = ", ".join(f'"{column}"' for column in columns)
+                conn.execute(text(f'CREATE {kind} {name} ON {table} ({column_list})'))
+    return added
@@ -1,14 +1,22 @@
 # models.py
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred, object_session
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
-from sqlalchemy import UniqueConstraint
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Text, Float, JSON, Date
+from sqlalchemy import UniqueConstraint, Index, event
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Text, Float, JSON, Date, LargeBinary
 import json
 from datetime import datetime # Importação essencial para datetime.utcnow
 
 Base = declarative_base()
 
+def bump_version(mapper, connection, target):
+    """
+    Listener before_update: incrementa a coluna version (version = version + 1 no próprio UPDATE)
+    quando a linha mudou de fato. Não é trava otimista: edições concorrentes não levantam erro.
+    """
+    if object_session(target).is_modified(target, include_collections=False):
+        target.version = type(target).version + 1
+
 class User(Base):
     __tablename__ = "users"
 
@@ -34,16 +42,20 @@ class User(Base):
 class Question(Base):
     """
     Modelo de Questão de Prova.
+    Os textos longos (HTML) são adiados: consultas de listagem carregam só os metadados.
+    Os grupos "texto" e "comentario" (comentário do professor) são carregados numa única
+    consulta quando a questão precisa ser renderizada (crud.prefetch_renders); listagens
+    com ?fields= e o endpoint do comentário do professor leem só o que pedem.
     """
     __tablename__ = "questions"
 
     id = Column(Integer, primary_key=True, index=True)
-    enunciado = Column(Text, nullable=False)
-    item_a = Column(Text)
-    item_b = Column(Text)
-    item_c = Column(Text)
-    item_d = Column(Text)
-    item_e = Column(Text)
+    enunciado = deferred(Column(Text, nullable=False), group="texto")
+    item_a = deferred(Column(Text), group="texto")
+    item_b = deferred(Column(Text), group="texto")
+    item_c = deferred(Column(Text), group="texto")
+    item_d = deferred(Column(Text), group="texto")
+    item_e = deferred(Column(Text), group="texto")
     materia = Column(String, index=True, nullable=False)
     assunto = Column(String, index=True, nullable=False)
     banca = Column(String, index=True, nullable=False)
@@ -54,11 +66,19 @@ class Question(Base):
     dificuldade = Column(String, index=True)
     regiao = Column(String, index=True)
     gabarito = Column(String, nullable=False) # 'A', 'B', 'C', 'D', 'E' ou 'Certo', 'Errado'
-    informacoes = Column(Text)
-    comentarioProfessor = Column(Text)
+    informacoes = deferred(Column(Text), group="texto")
+    comentarioProfessor = deferred(Column(Text), group="comentario")
     tipo = Column(String, nullable=False, default="multipla") # "multipla" ou "certo_errado"
     is_anulada = Column(Boolean, default=False)
     is_desatualizada = Column(Boolean, default=False)
+    # Incrementada a cada UPDATE pelo ORM (bump_version); usada como chave de cache da questão renderizada
+    version = Column(Integer, nullable=False, default=1)
+    # SHA-256 do enunciado e das alternativas normalizados (crud.question_content_hash); detecta duplicatas na importação
+    content_hash = deferred(Column(String(64), index=True))
+    # Assinatura MinHash do mesmo texto (backend/near_duplicates.py); detecta questões quase iguais
+    minhash = deferred(Column(LargeBinary))
+    # Nó do assunto na árvore de assuntos (backend/topic_tree.py); filtra um assunto com todos os subassuntos
+    topic_id = Column(Integer, ForeignKey("topics.id"), index=True)
 
     # Relacionamentos
     comments = relationship("Comment", back_populates="question")
@@ -69,6 +89,52 @@ class Question(Base):
     def __repr__(self):
         return f"<Question(id={self.id}, materia='{self.materia}', assunto='{self.assunto}')>"
 
+event.listen(Question, "before_update", bump_version)
+
+class QuestionChange(Base):
+    """
+    Registro das edições e exclusões de questões, gravado na mesma transação da escrita.
+    Os outros processos leem as linhas novas (backend/question_sync.py) para atualizar
+    os índices em memória (gabarito, facetas, duplicatas, semelhantes).
+    """
+    __tablename__ = "question_changes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    question_id = Column(Integer, nullable=False) # Sem FK: a questão pode ter sido excluída
+    changed_at = Column(DateTime, default=datetime.utcnow)
+
+class Topic(Base):
+    """
+    Nó da árvore de assuntos de uma matéria (backend/topic_tree.py). Cada assunto usado
+    pelas questões é um nó; a hierarquia vem dos esquemas numerados importados
+    ("1.2 Controle Difuso" fica sob "1 Controle de Constitucionalidade").
+    """
+    __tablename__ = "topics"
+
+    id = Column(Integer, primary_key=True, index=True)
+    materia = Column(String, nullable=False)
+    nome = Column(String, nullable=False)
+    chave = Column(String, nullable=False) # Nome normalizado (question_text.normalize), único na matéria
+    parent_id = Column(Integer, ForeignKey("topics.id"), nullable=True, index=True)
+    posicao = Column(Integer, nullable=False, default=0) # Ordem entre os irmãos
+
+    __table_args__ = (UniqueConstraint("materia", "chave", name="uq_topics_materia_chave"),)
+
+    def __repr__(self):
+        return f"<Topic(id={self.id}, materia='{self.materia}', nome='{self.nome}', parent_id={self.parent_id})>"
+
+class TopicClosure(Base):
+    """
+    Tabela de fechamento da árvore de assuntos: uma linha para cada par (ancestral,
+    descendente), incluindo o próprio nó com profundidade 0. As questões de um assunto e
+    de todos os seus subassuntos saem de um único join indexado por ancestor_id.
+    """
+    __tablename__ = "topic_closure"
+
+    ancestor_id = Column(Integer, ForeignKey("topics.id"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("topics.id"), primary_key=True, index=True)
+    depth = Column(Integer, nullable=False)
+
 class QuestionStatistics(Base):
     """
     Modelo para armazenar estatísticas de desempenho de uma questão.
@@ -79,6 +145,14 @@ class QuestionStatistics(Base):
     question_id = Column(Integer, ForeignKey("questions.id"), unique=True, nullable=False)
     total_attempts = Column(Integer, default=0)
     correct_attempts = Column(Integer, default=0)
+    # Distribuição das respostas por alternativa (uma linha por questão)
+    count_a = Column(Integer, default=0, nullable=False)
+    count_b = Column(Integer, default=0, nullable=False)
+    count_c = Column(Integer, default=0, nullable=False)
+    count_d = Column(Integer, default=0, nullable=False)
+    count_e = Column(Integer, default=0, nullable=False)
+    count_certo = Column(Integer, default=0, nullable=False)
+    count_errado = Column(Integer, default=0, nullable=False)
 
     # Relacionamento
     question = relationship("Question", back_populates="question_stats")
@@ -96,10 +170,14 @@ class Theory(Base):
     materia = Column(String, index=True, nullable=False)
     assunto = Column(String, index=True, nullable=False)
     content = Column(Text, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1) # Incrementada a cada alteração (ETag; bump_version)
 
     def __repr__(self):
         return f"<Theory(id={self.id}, materia='{self.materia}', assunto='{self.assunto}')>"
 
+event.listen(Theory, "before_update", bump_version)
+
 class Notebook(Base):
     """
     Modelo de Caderno de Questões criado por um usuário.
@@ -145,6 +223,58 @@ class NotebookProgress(Base):
     def __repr__(self):
         return f"<NotebookProgress(id={self.id}, notebook_id={self.notebook_id}, user_id={self.user_id}, index={self.index})>"
 
+class UserQuestionState(Base):
+    """
+    Histórico resumido das respostas de um usuário a uma questão, atualizado a cada
+    resposta salva no progresso de um caderno (crud.record_user_answers). Evita reler
+    o JSON de todos os progressos para saber o que o usuário já viu, errou ou deve revisar.
+    """
+    __tablename__ = "user_question_state"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    question_id = Column(Integer, ForeignKey("questions.id"), nullable=False)
+    tentativas = Column(Integer, nullable=False, default=0)
+    acertos = Column(Integer, nullable=False, default=0)
+    ultimo_acerto = Column(Boolean, nullable=False, default=False) # Resultado da resposta mais recente
+    respondida_em = Column(DateTime, default=datetime.utcnow) # Data da resposta mais recente
+    notebook_id = Column(Integer, ForeignKey("notebooks.id"), nullable=True) # Caderno da resposta mais recente
+
+    # Agenda de revisão espaçada (review_schedule, SM-2); só questões já erradas têm revisar_em
+    repeticoes = Column(Integer, nullable=False, default=0) # Acertos seguidos desde o último erro
+    intervalo_dias = Column(Float, nullable=False, default=0)
+    facilidade = Column(Float, nullable=False, default=2.5)
+    revisar_em = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "question_id", name="uq_user_question_state"),
+        Index("ix_user_question_state_erradas", "user_id", "ultimo_acerto", "respondida_em"),
+        Index("ix_user_question_state_revisar_em", "user_id", "revisar_em"),
+    )
+
+    def __repr__(self):
+        return f"<UserQuestionState(user_id={self.user_id}, question_id={self.question_id}, tentativas={self.tentativas})>"
+
+class UserTopicStats(Base):
+    """
+    Desempenho agregado de um usuário por assunto (matéria + assunto), mantido junto
+    com UserQuestionState. Base das recomendações de estudo.
+    """
+    __tablename__ = "user_topic_stats"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    materia = Column(String, nullable=False)
+    assunto = Column(String, nullable=False)
+    tentativas = Column(Integer, nullable=False, default=0)
+    acertos = Column(Integer, nullable=False, default=0)
+    atualizado_em = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (UniqueConstraint("user_id", "materia", "assunto", name="uq_user_topic_stats"),)
+
+    def __repr__(self):
+        return f"<UserTopicStats(user_id={self.user_id}, assunto='{self.assunto}', tentativas={self.tentativas})>"
+
 class Comment(Base):
     __tablename__ = "comments"
 
@@ -268,9 +398,12 @@ class VerticalizedSyllabus(Base):
     conteudo = Column(JSON, nullable=False) # Tabela de conteúdos
     marcacoes = Column(JSON, nullable=True) # Marcação por checkbox
     criado_em = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1) # Incrementada a cada alteração (ETag; bump_version)
 
     owner = relationship("User", back_populates="syllabi")  # Adicione esta linha
 
+event.listen(VerticalizedSyllabus, "before_update", bump_version)
+
 class StudyCalendar(Base):
     __tablename__ = "study_calendar"
 
@@ -288,4 +421,38 @@ class StudyCalendar(Base):
     edital = relationship("VerticalizedSyllabus", backref="study_calendars")
 
     def __repr__(self):
-        return f"<StudyPlan(id={self.id}, nome='{self.nome}', user_id={self.user_id})>"
\ No newline at end of file
+        return f"<StudyPlan(id={self.id}, nome='{self.nome}', user_id={self.user_id})>"
+
+class Job(Base):
+    """
+    Tarefa em segundo plano (importação de PDF, importação em lote, recalibração).
+    Fica salva para que o cliente acompanhe o progresso e para que as tarefas
+    interrompidas por um reinício do servidor sejam retomadas (backend/jobs.py).
+    Uma tarefa em execução pertence ao processo que a pegou (worker_id) enquanto
+    ele renovar lease_expires_at.
+    """
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True) # uuid4 em hexadecimal
+    kind = Column(String, nullable=False, index=True)
+    status = Column(String, nullable=False, default="pending", index=True) # pending, running, succeeded, failed, cancelled
+    params = Column(JSON, nullable=False, default=dict)
+    progress = Column(Float, nullable=False, default=0.0) # 0 a 1
+    message = Column(String, nullable=True)
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    worker_id = Column(String, nullable=True) # Processo que executa a tarefa
+    lease_expires_at = Column(DateTime, nullable=True) # Sem renovação até aqui, a tarefa volta para a fila
+    unique_key = Column(String, nullable=True, unique=True, index=True) # Impede duas tarefas iguais na fila; limpa ao terminar
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    user = relationship("User")
+
+    def __repr__(self):
+        return f"<Job(id={self.id}, kind='{self.kind}', status='{self.status}')>"
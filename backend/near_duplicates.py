@@ -0,0 +1,285 @@
+"""
+Process-wide MinHash/LSH index for near-duplicate questions.
+
+Each question gets a MinHash signature of NUM_PERM values over the word
+3-grams of its normalized statement and alternatives (question_text). Two
+signatures agree on a position with probability equal to the Jaccard
+similarity of the 3-gram sets, so the fraction of equal positions estimates
+it. For lookups the signature is cut into BANDS bands of ROWS values: questions
+sharing any band are candidates (pairs at 0.8 similarity share one with
+probability > 0.999), and candidates at or above SIMILARITY_THRESHOLD are
+returned.
+
+The signature is stored with the question (`questions.minhash`, computed by
+the crud write functions) and the index is loaded on startup, like the answer
+key. It keeps, indexed by question ID, one key per band and the low 16 bits of
+each signature value (enough to estimate the similarity). Band lookups use a
+sorted snapshot of the keys plus the questions changed since it was built; the
+snapshot is rebuilt once the changes pile up. About 320 bytes per question.
+Questions written by other processes are picked up through question_sync.
+"""
+from sqlalchemy import bindparam, select
+from sqlalchemy.orm import Session
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import threading
+import logging
+import zlib
+
+import numpy as np
+
+from backend import models, question_text
+from backend.question_sync import question_rows, question_sync
+
+logger = logging.getLogger(__name__)
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3 # Words per shingle
+SIMILARITY_THRESHOLD = 0.8 # Estimated Jaccard similarity reported as a possible duplicate
+MAX_BUCKET = 200 # Larger buckets (boilerplate shared by many questions) are skipped by the report
+LOAD_BATCH_SIZE = 5000
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_rng = np.random.default_rng(20240601) # Fixed: signatures are stored in the database
+_PERM_A = _rng.integers(1, (1 << 61) - 1, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, (1 << 61) - 1, size=NUM_PERM, dtype=np.uint64)
+_BAND_MULTIPLIERS = _rng.integers(1, 1 << 62, size=ROWS, dtype=np.uint64) | np.uint64(1)
+
+def signature(question: Any) -> Optional[np.ndarray]:
+    """
+    MinHash signature (NUM_PERM uint32) of a question (dict, model or schema); None without text.
+    """
+    words = question_text.words(question)
+    if not words:
+        return None
+    size = min(SHINGLE_SIZE, len(words))
+    shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    with np.errstate(over="ignore"):
+        permuted = (hashes[:, None] * _PERM_A + _PERM_B) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=0).astype(np.uint32)
+
+def signature_bytes(question: Any) -> bytes:
+    """
+    The signature as stored in questions.minhash (empty for questions without text).
+    """
+    return to_bytes(signature(question))
+
+def to_bytes(sig: Optional[np.ndarray]) -> bytes:
+    return sig.tobytes() if sig is not None else b""
+
+def from_bytes(blob: Optional[bytes]) -> Optional[np.ndarray]:
+    return np.frombuffer(blob, dtype=np.uint32) if blob and len(blob) == NUM_PERM * 4 else None
+
+def _band_keys(signatures: np.ndarray) -> np.ndarray:
+    # (n, NUM_PERM) uint32 -> (n, BANDS) uint32; equal bands give equal keys
+    bands = signatures.reshape(len(signatures), BANDS, ROWS).astype(np.uint64)
+    with np.errstate(over="ignore"):
+        mixed = (bands * _BAND_MULTIPLIERS).sum(axis=2, dtype=np.uint64)
+    return ((mixed >> np.uint64(32)) ^ (mixed & _MAX_HASH)).astype(np.uint32)
+
+class NearDuplicateIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = np.zeros((0, BANDS), dtype=np.uint32)
+        self._sigs = np.zeros((0, NUM_PERM), dtype=np.uint16)
+        self._present = np.zeros(0, dtype=bool)
+        self._snapshot_keys = np.zeros((BANDS, 0), dtype=np.uint32) # Sorted band keys...
+        self._snapshot_ids = np.zeros((BANDS, 0), dtype=np.int32) # ...and their question IDs
+        self._changed: List[Dict[int, Set[int]]] = [{} for _ in range(BANDS)] # Per band: key -> IDs, since the snapshot
+        self._changed_count = 0
+        self.loaded = False
+
+    def load(self, db: Session) -> int:
+        """
+        Builds the index from the stored signatures, first computing the missing ones.
+        Returns the number of questions indexed.
+        """
+        self._backfill(db)
+        question_sync.start(db)
+        ids, sigs = [], []
+        query = db.query(models.Question.id, models.Question.minhash).filter(models.Question.minhash.isnot(None))
+        for q_id, blob in query.order_by(models.Question.id).yield_per(LOAD_BATCH_SIZE):
+            if len(blob) == NUM_PERM * 4:
+                ids.append(q_id)
+                sigs.append(blob)
+        size = (ids[-1] + 1) if ids else 0
+        signatures = np.frombuffer(b"".join(sigs), dtype=np.uint32).reshape(len(ids), NUM_PERM)
+        id_array = np.asarray(ids, dtype=np.int64)
+        with self._lock:
+            self._keys = np.zeros((size, BANDS), dtype=np.uint32)
+            self._sigs = np.zeros((size, NUM_PERM), dtype=np.uint16)
+            self._present = np.zeros(size, dtype=bool)
+            self._keys[id_array] = _band_keys(signatures)
+            self._sigs[id_array] = signatures.astype(np.uint16)
+            self._present[id_array] = True
+            self._rebuild_snapshot()
+            self.loaded = True
+        logger.info(f"Near-duplicate index loaded with {len(ids)} questions.")
+        return len(ids)
+
+    def _backfill(self, db: Session) -> None:
+        table = models.Question.__table__
+        statement = table.update().where(table.c.id == bindparam("b_id")).values(minhash=bindparam("b_minhash"))
+        last_id, filled = 0, 0
+        while True:
+            rows = db.execute(
+                select(table.c.id, *(table.c[f] for f in question_text.QUESTION_TEXT_FIELDS))
+                .where(table.c.minhash.is_(None), table.c.id > last_id).order_by(table.c.id).limit(LOAD_BATCH_SIZE)
+            ).mappings().all()
+            if not rows:
+                break
+            # Core UPDATE: derived data, so the question version (render cache key) stays the same
+            db.execute(statement, [{"b_id": row["id"], "b_minhash": signature_bytes(dict(row))} for row in rows])
+            db.commit()
+            last_id, filled = rows[-1]["id"], filled + len(rows)
+        if filled:
+            logger.info(f"MinHash signatures computed for {filled} questions.")
+
+    def ensure_loaded(self, db: Session) -> None:
+        if not self.loaded:
+            self.load(db)
+        question_sync.sync(db)
+
+    def refresh(self, db: Session, question_ids: List[int]) -> None:
+        """
+        Reloads the given questions from the database (question_sync listener).
+        """
+        if not self.loaded:
+            return
+        rows = question_rows(db, question_ids, models.Question.minhash)
+        self.set_many((q_id, from_bytes(blob)) for q_id, blob in rows)
+        for q_id in set(question_ids).difference(row[0] for row in rows):
+            self.remove(q_id)
+
+    def _grow(self, size: int) -> None:
+        # Must be called with the lock held; arrays are replaced, never resized in place
+        size = max(size, int(len(self._present) * 1.5) + 1)
+        keys = np.zeros((size, BANDS), dtype=np.uint32)
+        sigs = np.zeros((size, NUM_PERM), dtype=np.uint16)
+        present = np.zeros(size, dtype=bool)
+        keys[:len(self._keys)], sigs[:len(self._sigs)], present[:len(self._present)] = self._keys, self._sigs, self._present
+        self._keys, self._sigs, self._present = keys, sigs, present
+
+    def _rebuild_snapshot(self) -> None:
+        # Must be called with the lock held
+        ids = np.flatnonzero(self._present)
+        keys = self._keys[ids].T # (BANDS, n)
+        order = np.argsort(keys, axis=1, kind="stable")
+        self._snapshot_keys = np.take_along_axis(keys, order, axis=1)
+        self._snapshot_ids = ids.astype(np.int32)[order]
+        self._changed = [{} for _ in range(BANDS)]
+        self._changed_count = 0
+
+    def set_many(self, rows: Iterable[Tuple[int, Optional[np.ndarray]]]) -> None:
+        """
+        Indexes (id, signature) pairs after questions are created or updated; a None
+        signature (no text) removes the question.
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        with self._lock:
+            max_id = max(q_id for q_id, _ in rows)
+            if max_id >= len(self._present):
+                self._grow(max_id + 1)
+            for q_id, sig in rows:
+                if sig is None:
+                    self._present[q_id] = False
+                    continue
+                keys = _band_keys(sig[None, :])[0]
+                self._keys[q_id] = keys
+                self._sigs[q_id] = sig.astype(np.uint16)
+                self._present[q_id] = True
+                for band, key in enumerate(keys.tolist()):
+                    self._changed[band].setdefault(key, set()).add(q_id)
+                self._changed_count += 1
+            if self._changed_count > max(1000, self._snapshot_ids.shape[1] // 10):
+                self._rebuild_snapshot()
+
+    def set(self, question_id: int, sig: Optional[np.ndarray]) -> None:
+        self.set_many([(question_id, sig)])
+
+    def remove(self, question_id: int) -> None:
+        with self._lock:
+            if question_id < len(self._present):
+                self._present[question_id] = False
+
+    def find(self, sig: np.ndarray, exclude_id: Optional[int] = None, threshold: float = SIMILARITY_THRESHOLD,
+             limit: int = 10) -> List[Tuple[int, float]]:
+        """
+        [(question ID, estimated similarity)] of the indexed questions at or above
+        `threshold`, most similar first.
+        """
+        keys = _band_keys(sig[None, :])[0]
+        candidates: Set[int] = set()
+        with self._lock:
+            for band, key in enumerate(keys.tolist()):
+                row = self._snapshot_keys[band]
+                start, stop = np.searchsorted(row, key, "left"), np.searchsorted(row, key, "right")
+                candidates.update(self._snapshot_ids[band, start:stop].tolist())
+                candidates.update(self._changed[band].get(key, ()))
+            sigs, present = self._sigs, self._present
+        candidates.discard(exclude_id)
+        ids = np.fromiter((q for q in candidates if q < len(present) and present[q]), dtype=np.int64)
+        if not len(ids):
+            return []
+        # Candidates from a stale snapshot entry are checked against the current signature
+        similarity = (sigs[ids] == sig.astype(np.uint16)).mean(axis=1)
+        keep = similarity >= threshold
+        ranked = sorted(zip(ids[keep].tolist(), similarity[keep].tolist()), key=lambda pair: -pair[1])
+        return [(q_id, round(sim, 3)) for q_id, sim in ranked[:limit]]
+
+    def clusters(self, threshold: float = SIMILARITY_THRESHOLD) -> List[Dict[str, Any]]:
+        """
+        Groups of indexed questions linked by pairs at or above `threshold`, largest first:
+        [{"ids": [...], "similaridade_minima": s}] (the lowest similarity among the pairs).
+        """
+        with self._lock:
+            keys, sigs, present = self._keys, self._sigs, self._present
+        ids = np.flatnonzero(present)
+        pairs = set()
+        for band in range(BANDS):
+            band_keys = keys[ids, band]
+            order = np.argsort(band_keys, kind="stable")
+            sorted_keys = band_keys[order]
+            # Runs of equal keys are the buckets
+            boundaries = np.flatnonzero(np.diff(sorted_keys)) + 1
+            starts = np.concatenate(([0], boundaries))
+            stops = np.concatenate((boundaries, [len(sorted_keys)]))
+            for start, stop in zip(starts[stops - starts > 1], stops[stops - starts > 1]):
+                if stop - start > MAX_BUCKET:
+                    continue
+                members = ids[order[start:stop]]
+                first, second = np.triu_indices(len(members), k=1)
+                pairs.update(zip(members[first].tolist(), members[second].tolist()))
+        if not pairs:
+            return []
+        pair_array = np.array(sorted(pairs), dtype=np.int64)
+        similarity = np.concatenate([
+            (sigs[chunk[:, 0]] == sigs[chunk[:, 1]]).mean(axis=1)
+            for chunk in np.array_split(pair_array, max(1, len(pair_array) // 100000))
+        ])
+        keep = similarity >= threshold
+
+        parent: Dict[int, int] = {}
+        def root(q_id: int) -> int:
+            while parent.setdefault(q_id, q_id) != q_id:
+                parent[q_id] = parent[parent[q_id]]
+                q_id = parent[q_id]
+            return q_id
+        for a, b in pair_array[keep].tolist():
+            parent[root(a)] = root(b)
+        groups: Dict[int, Dict[str, Any]] = {}
+        for (a, b), sim in zip(pair_array[keep].tolist(), similarity[keep].tolist()):
+            group = groups.setdefault(root(a), {"ids": set(), "similaridade_minima": 1.0})
+            group["ids"].update((a, b))
+            group["similaridade_minima"] = min(group["similaridade_minima"], round(sim, 3))
+        result = [{"ids": sorted(g["ids"]), "similaridade_minima": g["similaridade_minima"]} for g in groups.values()]
+        result.sort(key=lambda g: (-len(g["ids"]), g["ids"][0]))
+        return result
+
+near_duplicate_index = NearDuplicateIndex()
+question_sync.register(near_duplicate_index.refresh)
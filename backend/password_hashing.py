@@ -0,0 +1,112 @@
+"""
+bcrypt hashing and verification in a dedicated, size-limited process pool.
+
+bcrypt takes a few hundred milliseconds of CPU per call and holds the GIL, so
+login/registration bursts would otherwise starve every other request. Calls are
+sent to HASH_POOL_WORKERS processes; at most HASH_QUEUE_LIMIT more may wait for
+a worker, and anything beyond that is rejected with HashPoolSaturated. A call
+keeps its slot until the worker is done with it, even after the caller gave up
+waiting, so timed-out calls still count against the limit. The slots stay well
+below the endpoint threadpool (THREADPOOL_SIZE in main.py), since each waiting
+call blocks one of its threads.
+
+This module only imports passlib so that the worker processes stay small.
+"""
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from passlib.context import CryptContext
+from typing import Optional
+import threading
+import time
+import os
+
+from backend import metrics
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", "2"))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "8")) # Calls allowed to wait for a free worker
+HASH_TIMEOUT_SECONDS = 30
+
+class HashPoolUnavailable(Exception):
+    """Raised when a call cannot be served by the pool (timeout or dead worker)."""
+
+class HashPoolSaturated(HashPoolUnavailable):
+    """Raised when every worker is busy and the wait queue is full."""
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_POOL_WORKERS + HASH_QUEUE_LIMIT)
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+def _hash_worker(password: str):
+    start = time.perf_counter()
+    return pwd_context.hash(password), time.perf_counter() - start
+
+def _verify_worker(plain_password: str, hashed_password: str):
+    start = time.perf_counter()
+    return pwd_context.verify(plain_password, hashed_password), time.perf_counter() - start
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=HASH_POOL_WORKERS)
+        return _executor
+
+def _track_in_flight(delta: int) -> None:
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += delta
+        metrics.set_gauge("password_hash.in_flight", _in_flight)
+        metrics.set_gauge("password_hash.queue_depth", max(0, _in_flight - HASH_POOL_WORKERS))
+
+def _release(future: Optional[Future] = None) -> None:
+    _track_in_flight(-1)
+    _slots.release()
+
+def _reset_executor() -> None:
+    # A worker died; start a fresh pool on the next call
+    global _executor
+    with _executor_lock:
+        _executor = None
+
+def _run(operation: str, fn, *args):
+    if not _slots.acquire(blocking=False):
+        metrics.incr("password_hash.rejected")
+        raise HashPoolSaturated()
+    _track_in_flight(1)
+    start = time.perf_counter()
+    try:
+        future = _get_executor().submit(fn, *args)
+    except BrokenProcessPool as e:
+        _release()
+        _reset_executor()
+        raise HashPoolUnavailable() from e
+    # The slot is freed when the worker finishes, not when this call stops waiting
+    future.add_done_callback(_release)
+    try:
+        result, compute_seconds = future.result(timeout=HASH_TIMEOUT_SECONDS)
+    except FutureTimeoutError as e:
+        metrics.incr("password_hash.timeout")
+        raise HashPoolUnavailable() from e
+    except BrokenProcessPool as e:
+        _reset_executor()
+        raise HashPoolUnavailable() from e
+    metrics.observe(f"password_hash.{operation}.compute", compute_seconds)
+    metrics.observe(f"password_hash.{operation}.total", time.perf_counter() - start)
+    return result
+
+def hash_password(password: str) -> str:
+    return _run("hash", _hash_worker, password)
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return _run("verify", _verify_worker, plain_password, hashed_password)
+
+def shutdown() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
@@ -1 +1,311 @@
-colocar o código
\ No newline at end of file
+"""
+Extraction of questions from prova PDFs.
+
+The pipeline (driven by pdf_processor, which times each stage):
+  1. extract_pages: the text of every page, read with PyMuPDF in a process pool
+     (PAGES_PER_TASK pages per task; short files are read inline). Workers read
+     the file from disk (MuPDF seeks into it; the pypdf fallback gets a read-only
+     memory map), so no process holds the whole upload in memory. Text blocks
+     are ordered by column, so two-column layouts keep their reading order, and
+     running headers/footers are dropped.
+  2. split_answer_key / parse_answer_key: the gabarito sheet (the pages from a
+     "GABARITO" heading on, or a separate file) becomes {number: answer}.
+  3. segment_questions: the remaining text is split into numbered questions and
+     their alternatives (A)-(E); questions without alternatives are certo/errado items.
+
+This module only imports PyMuPDF (pypdf as a fallback) so that the worker processes stay small.
+"""
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+import threading
+import html
+import mmap
+import re
+import os
+
+try:
+    import fitz # PyMuPDF
+except ImportError: # pragma: no cover - pypdf is slower but pure Python
+    fitz = None
+    from pypdf import PdfReader
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+PAGES_PER_TASK = 8
+PDF_MAGIC = b"%PDF-"
+PDF_HEADER_WINDOW = 1024 # The signature may follow some junk bytes, within the first 1 KB
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+class InvalidPDF(ValueError):
+    """Raised when the file cannot be opened as a PDF."""
+
+def looks_like_pdf(head: bytes) -> bool:
+    """
+    Whether the first bytes of a file carry the PDF signature.
+    """
+    return PDF_MAGIC in head[:PDF_HEADER_WINDOW]
+
+# --- Stage 1: page text ---
+
+_PAGE_NUMBER = re.compile(r"^\s*(p[áa]g(ina)?\.?\s*)?\d{1,4}(\s*(de|/)\s*\d{1,4})?\s*$", re.IGNORECASE)
+# At the top of a page a bare number is more likely an item number, so only labelled ones count
+_PAGE_LABEL = re.compile(r"^\s*(p[áa]g(ina)?\.?\s*\d{1,4}|\d{1,4}\s*(de|/)\s*\d{1,4})\s*$", re.IGNORECASE)
+
+def _column(block: tuple, width: float) -> int:
+    x0, x1 = block[0], block[2]
+    if x1 - x0 > width * 0.6:
+        return 0 # Full-width block (titles, texts shared by several questions)
+    return 0 if (x0 + x1) / 2 < width / 2 else 1
+
+def _page_text(page) -> str:
+    width = page.rect.width
+    blocks = [b for b in page.get_text("blocks") if b[6] == 0 and b[4].strip()]
+    blocks.sort(key=lambda b: (_column(b, width), round(b[1], 1), b[0]))
+    return "\n".join(b[4].strip() for b in blocks)
+
+@contextmanager
+def _pypdf_reader(path: str):
+    # PdfReader(path) would read the whole file into a BytesIO
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        yield PdfReader(mapped)
+
+def _extract_range(path: str, start: int, stop: int) -> List[str]:
+    """
+    Worker: text of pages [start, stop).
+    """
+    if fitz is None:
+        with _pypdf_reader(path) as reader:
+            return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+    with fitz.open(path) as doc:
+        return [_page_text(doc[i]) for i in range(start, stop)]
+
+def page_count(path: str) -> int:
+    try:
+        if fitz is None:
+            with _pypdf_reader(path) as reader:
+                return len(reader.pages)
+        with fitz.open(path, filetype="pdf") as doc:
+            return doc.page_count
+    except Exception as e:
+        raise InvalidPDF(str(e)) from e
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+        return _executor
+
+def _is_item_marker(line: str) -> bool:
+    # Question and alternative starts, which may repeat at page ends (e.g. "(E) Nenhuma das anteriores")
+    return bool(_ALTERNATIVE.match(line)) or any(style.match(line) for style in _QUESTION_STYLES)
+
+def _strip_running_lines(pages: List[str]) -> List[str]:
+    """
+    Drops page numbers and the header/footer lines repeated on most pages. A repeated
+    line is only dropped in a header or footer position (first or last two lines of a
+    page), and question or alternative markers are never running lines.
+    """
+    split = []
+    for lines in (page.splitlines() for page in pages):
+        if lines and _PAGE_LABEL.match(lines[0]):
+            lines = lines[1:]
+        if lines and _PAGE_NUMBER.match(lines[-1]):
+            lines = lines[:-1]
+        split.append(lines)
+    repeated = set()
+    if len(split) >= 4:
+        counts = Counter(line.strip() for lines in split for line in set(lines[:2] + lines[-2:])
+                         if line.strip() and not _is_item_marker(line))
+        repeated = {line for line, n in counts.items() if n >= len(split) / 2}
+    cleaned = []
+    for lines in split:
+        footer = len(lines) - 2
+        cleaned.append("\n".join(line for index, line in enumerate(lines)
+                                  if 2 <= index < footer or line.strip() not in repeated))
+    return cleaned
+
+def extract_pages(path: str) -> List[str]:
+    """
+    Text of every page of the PDF at `path`, in order.
+    """
+    global _executor
+    total = page_count(path)
+    starts = list(range(0, total, PAGES_PER_TASK))
+    stops = [min(start + PAGES_PER_TASK, total) for start in starts]
+    if PDF_WORKERS <= 1 or len(starts) <= 1:
+        chunks = [_extract_range(path, start, stop) for start, stop in zip(starts, stops)]
+    else:
+        try:
+            chunks = list(_get_executor().map(_extract_range, repeat(path), starts, stops))
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool on the next call
+            with _executor_lock:
+                _executor = None
+            raise
+    return _strip_running_lines([text for chunk in chunks for text in chunk])
+
+def shutdown() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+# --- Stage 2: gabarito ---
+
+_GABARITO_HEADING = re.compile(r"^[ \t]*GABARITO\b[^\n]{0,40}$", re.IGNORECASE | re.MULTILINE)
+_ANSWER = r"(CERTO|ERRADO|ANULADA|NULA|[A-E]|X|\*)"
+_ANSWER_PAIR = re.compile(r"(?<![\dA-Za-z])(\d{1,3})\s*[-–.:)]?\s*" + _ANSWER + r"(?![A-Za-zÀ-ú])", re.IGNORECASE)
+_ANSWER_TOKEN = re.compile(r"^" + _ANSWER + r"$", re.IGNORECASE)
+ANULADA = "Anulada"
+
+def _normalize_answer(value: str) -> str:
+    value = value.upper()
+    if value in ("X", "*", "ANULADA", "NULA"):
+        return ANULADA
+    if value in ("CERTO", "ERRADO"):
+        return value.capitalize()
+    return value
+
+def split_answer_key(pages: List[str]) -> Tuple[str, str]:
+    """
+    Splits the document into (questions text, gabarito text) at the first "GABARITO"
+    heading followed by answers. Returns an empty gabarito when there is none.
+    """
+    for index, page in enumerate(pages):
+        for heading in _GABARITO_HEADING.finditer(page):
+            tail = "\n".join([page[heading.end():]] + pages[index + 1:])
+            if parse_answer_key(tail):
+                return "\n".join(pages[:index] + [page[:heading.start()]]), tail
+    return "\n".join(pages), ""
+
+def parse_answer_key(text: str) -> Dict[int, str]:
+    """
+    {question number: answer} from a gabarito sheet, as "1 - A", "01 C", "1. Certo"
+    pairs or as a table with a row of numbers above a row of answers.
+    Answers are letters, "Certo"/"Errado" or ANULADA.
+    """
+    answers = {int(number): _normalize_answer(answer) for number, answer in _ANSWER_PAIR.findall(text)}
+    lines = [line.split() for line in text.splitlines() if line.strip()]
+    for numbers, values in zip(lines, lines[1:]):
+        if len(numbers) == len(values) and all(n.isdigit() for n in numbers) and all(_ANSWER_TOKEN.match(v) for v in values):
+            answers.update((int(n), _normalize_answer(v)) for n, v in zip(numbers, values))
+    return answers
+
+def resolve_answer(answer: str, tipo: str) -> Optional[str]:
+    """
+    Gabarito value for a question of the given type; None when they do not match.
+    C/E on certo/errado items mean Certo/Errado.
+    """
+    if answer == ANULADA:
+        return ANULADA
+    if tipo == "certo_errado":
+        return {"C": "Certo", "E": "Errado", "Certo": "Certo", "Errado": "Errado"}.get(answer)
+    return answer if answer in ("A", "B", "C", "D", "E") else None
+
+# --- Stage 3: questions ---
+
+# Question markers, from the most to the least specific; the first style with
+# sequential matches in the document is used
+_QUESTION_STYLES = [
+    re.compile(r"^\s*QUEST[ÃA]O\s*(\d{1,3})\b[\s.:\-–)]*", re.IGNORECASE),
+    re.compile(r"^\s*(\d{1,3})\s*[.)\-–]\s+"),
+    re.compile(r"^\s*(\d{1,3})(?:\s+(?=[A-ZÀ-Ú\"“(])|\s*$)"), # CEBRASPE items: "12 Texto do item", number alone in its block
+]
+_ALTERNATIVE = re.compile(r"^\s*(?:\(([A-Ea-e])\)|([A-Ea-e])\s*\)|([A-E])\s*[.\-–]\s)\s*")
+_HYPHENATED_BREAK = re.compile(r"(\w)-\n(\w)")
+_BANCAS = ["CEBRASPE", "CESPE", "FGV", "FCC", "VUNESP", "CESGRANRIO", "IBFC", "IDECAN", "QUADRIX", "AOCP", "IADES", "CONSULPLAN", "FUNDATEC", "IBADE"]
+_BANCA = re.compile(r"\b(" + "|".join(_BANCAS) + r")\b", re.IGNORECASE)
+_YEAR = re.compile(r"\b(19[89]\d|20\d{2})\b")
+
+def _to_html(lines: List[str]) -> str:
+    text = _HYPHENATED_BREAK.sub(r"\1\2", "\n".join(lines))
+    text = re.sub(r"\s+", " ", text).strip()
+    return f"<p>{html.escape(text, quote=False)}</p>"
+
+def _question_starts(lines: List[str]) -> List[Tuple[int, int, int]]:
+    """
+    (line index, question number, marker length) of each question start. Only numbers
+    that continue the sequence are accepted (numbered lists inside a statement stay in
+    it); a 1 starts a new sequence and the longest one wins (cover instructions are
+    often numbered too).
+    """
+    for style in _QUESTION_STYLES:
+        runs: List[List[Tuple[int, int, int]]] = []
+        current: Optional[List[Tuple[int, int, int]]] = None
+        for index, line in enumerate(lines):
+            match = style.match(line)
+            if not match:
+                continue
+            number = int(match.group(1))
+            if current and number == current[-1][1] + 1:
+                current.append((index, number, match.end()))
+            elif current is None or number == 1:
+                current = [(index, number, match.end())]
+                runs.append(current)
+        longest = max(runs, key=len, default=[])
+        if len(longest) >= 2:
+            return longest
+    return []
+
+def _split_alternatives(lines: List[str]) -> Tuple[List[str], List[List[str]]]:
+    """
+    (statement lines, [lines of A, lines of B, ...]); alternatives must start at A and follow in order.
+    """
+    statement: List[str] = []
+    alternatives: List[List[str]] = []
+    for line in lines:
+        match = _ALTERNATIVE.match(line)
+        letter = match and next(group for group in match.groups() if group).upper()
+        if letter and ord(letter) - ord("A") == len(alternatives):
+            alternatives.append([line[match.end():]])
+        elif alternatives:
+            alternatives[-1].append(line)
+        else:
+            statement.append(line)
+    if len(alternatives) < 2:
+        return lines, [] # A lone "A)" line is part of the statement
+    return statement, alternatives
+
+def segment_questions(text: str) -> List[Dict[str, Any]]:
+    """
+    Splits the prova text into questions: dicts with numero, enunciado, item_a..item_e
+    (HTML paragraphs, like the questions created in the admin form) and tipo.
+    """
+    lines = text.splitlines()
+    starts = _question_starts(lines)
+    questions = []
+    for position, (index, number, marker_end) in enumerate(starts):
+        end = starts[position + 1][0] if position + 1 < len(starts) else len(lines)
+        body = [lines[index][marker_end:]] + lines[index + 1:end]
+        statement, alternatives = _split_alternatives(body)
+        if not any(line.strip() for line in statement):
+            continue
+        question = {
+            "numero": number,
+            "enunciado": _to_html(statement),
+            "tipo": "multipla" if alternatives else "certo_errado",
+        }
+        for letter, alternative in zip("abcde", alternatives):
+            question[f"item_{letter}"] = _to_html(alternative)
+        questions.append(question)
+    return questions
+
+def detect_metadata(first_page: str) -> Dict[str, Any]:
+    """
+    Banca and year named on the cover page, when present.
+    """
+    metadata: Dict[str, Any] = {}
+    banca = _BANCA.search(first_page)
+    if banca:
+        metadata["banca"] = banca.group(1).upper()
+    year = _YEAR.search(first_page)
+    if year:
+        metadata["ano"] = int(year.group(1))
+    return metadata
@@ -1,20 +1,90 @@
+from contextlib import contextmanager
 from sqlalchemy.orm import Session
+from typing import Any, Callable, Dict, Optional
 import logging
+import time
+
+from backend import crud, metrics, pdf_parser
 
 logger = logging.getLogger(__name__)
 
-def process_pdf_and_add_questions(db: Session, pdf_content: bytes) -> int:
+# Valores usados quando o formulário não informa e a capa da prova não indica
+DEFAULT_METADATA = {"materia": "Não classificada", "assunto": "Não classificado", "banca": "Não informada"}
+QUESTION_COLUMNS = ["enunciado", "item_a", "item_b", "item_c", "item_d", "item_e", "materia", "assunto", "banca",
+                    "orgao", "cargo", "ano", "escolaridade", "dificuldade", "regiao", "gabarito", "informacoes",
+                    "comentarioProfessor", "tipo", "is_anulada", "is_desatualizada"]
+
+@contextmanager
+def _stage(timings: Dict[str, float], name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timings[name] = round(elapsed, 3)
+        metrics.observe(f"pdf_import.{name}", elapsed)
+
+def process_pdf_and_add_questions(
+    db: Session,
+    pdf_path: str,
+    gabarito_path: Optional[str] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+    progress: Optional[Callable[[float, str], None]] = None
+) -> Dict[str, Any]:
     """
-    Função placeholder para processar o conteúdo de um PDF e adicionar questões ao banco de dados.
+    Extrai as questões de uma prova em PDF e as insere no banco em lote.
+    O gabarito pode estar no próprio PDF (a partir de um título "GABARITO") ou em um
+    arquivo separado; questões sem resposta no gabarito não são inseridas.
+    Retorna o resumo da importação com o tempo de cada etapa (também enviado a metrics).
+    Roda como a tarefa "pdf_import" (backend/jobs.py), que informa `progress` entre as etapas;
+    a inserção é um único commit, então uma importação interrompida antes dele pode ser repetida.
     """
-    logger.info("Processando PDF (simulação)...")
-    # Simulação: número de questões adicionadas
-    num_questoes_adicionadas = 0
+    report = progress or (lambda fraction, message: None)
+    timings: Dict[str, float] = {}
+    report(0.0, "Extraindo o texto do PDF")
+    with _stage(timings, "extract"):
+        # Os processos do pool leem o arquivo em disco, em vez de receberem uma cópia do conteúdo cada
+        pages = pdf_parser.extract_pages(pdf_path)
+        gabarito_pages = pdf_parser.extract_pages(gabarito_path) if gabarito_path else None
+
+    report(0.6, "Separando as questões")
 
-    # TODO: implementar processamento real de PDF
-    return num_questoes_adicionadas
+    with _stage(timings, "segment"):
+        text, gabarito_text = pdf_parser.split_answer_key(pages)
+        if gabarito_pages is not None:
+            gabarito_text = "\n".join(gabarito_pages)
+        answers = pdf_parser.parse_answer_key(gabarito_text)
+        parsed = pdf_parser.segment_questions(text)
 
+    report(0.7, f"{len(parsed)} questões encontradas; conferindo o gabarito")
+    with _stage(timings, "match"):
+        fields = {**DEFAULT_METADATA, **pdf_parser.detect_metadata(pages[0] if pages else "")}
+        fields.update((key, value) for key, value in (metadata or {}).items() if value not in (None, ""))
+        rows = []
+        sem_gabarito = []
+        for question in parsed:
+            answer = answers.get(question["numero"])
+            gabarito = pdf_parser.resolve_answer(answer, question["tipo"]) if answer else None
+            if gabarito is None:
+                sem_gabarito.append(question["numero"])
+                continue
+            row = {column: None for column in QUESTION_COLUMNS} # Mesmas chaves em todas as linhas do INSERT em lote
+            row.update(fields)
+            row.update((key, value) for key, value in question.items() if key != "numero")
+            row.update(gabarito=gabarito, is_anulada=gabarito == pdf_parser.ANULADA, is_desatualizada=False)
+            rows.append(row)
 
-    
-    
+    report(0.8, f"Inserindo {len(rows)} questões")
+    with _stage(timings, "insert"):
+        ids = crud.create_questions_bulk(db, rows) if rows else []
 
+    metrics.incr("pdf_import.questions", len(ids))
+    logger.info(f"PDF de {len(pages)} páginas: {len(parsed)} questões encontradas, {len(ids)} inseridas, "
+                f"{len(sem_gabarito)} sem gabarito. Tempos: {timings}")
+    return {
+        "paginas": len(pages),
+        "questoes_encontradas": len(parsed),
+        "questoes_adicionadas": len(ids),
+        "sem_gabarito": sem_gabarito,
+        "tempos": timings,
+    }
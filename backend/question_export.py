@@ -0,0 +1,90 @@
+"""
+Streaming export of the question bank (backups, analytics, partner sync).
+
+Rows are read with `yield_per`, so the driver cursor is consumed in batches
+of EXPORT_BATCH_SIZE rows and only plain row tuples are built (no ORM
+objects, no identity map). They are encoded as NDJSON or CSV into chunks of
+about CHUNK_BYTES and optionally gzip-compressed on the fly: memory stays
+flat whatever the size of the table.
+
+The columns are the QuestionCreate fields plus id, so an NDJSON export can be
+imported again (backend/question_import.py); the statistics columns are
+appended when requested.
+"""
+from sqlalchemy.orm import Session
+from typing import Any, Dict, Iterable, Iterator, List
+import csv
+import io
+import zlib
+
+import orjson
+
+from backend import crud, models, schemas
+
+EXPORT_BATCH_SIZE = 1000 # Rows fetched from the cursor at a time
+CHUNK_BYTES = 64 * 1024 # Size of the pieces sent to the client
+FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+QUESTION_COLUMNS = ["id"] + list(schemas.QuestionCreate.model_fields)
+STATISTICS_COLUMNS = ["total_attempts", "correct_attempts", "count_a", "count_b", "count_c", "count_d",
+                      "count_e", "count_certo", "count_errado"]
+
+def columns(include_stats: bool = False) -> List[str]:
+    return QUESTION_COLUMNS + (STATISTICS_COLUMNS if include_stats else [])
+
+def iter_rows(db: Session, filters: Dict[str, Any], include_stats: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    The filtered questions (crud.filter_questions), ordered by id, as dicts with `columns()`.
+    """
+    selected = [getattr(models.Question, name) for name in QUESTION_COLUMNS]
+    if include_stats:
+        selected += [getattr(models.QuestionStatistics, name) for name in STATISTICS_COLUMNS]
+    query = db.query(*selected)
+    if include_stats:
+        query = query.outerjoin(models.QuestionStatistics, models.QuestionStatistics.question_id == models.Question.id)
+    query = crud.filter_questions(query, **filters).order_by(models.Question.id)
+    names = columns(include_stats)
+    for row in query.yield_per(EXPORT_BATCH_SIZE):
+        yield dict(zip(names, row))
+
+def ndjson_chunks(rows: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    buffer = bytearray()
+    for row in rows:
+        buffer += orjson.dumps(row)
+        buffer += b"\n"
+        if len(buffer) >= CHUNK_BYTES:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+def csv_chunks(rows: Iterable[Dict[str, Any]], fieldnames: List[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames, lineterminator="\n")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31) # wbits=31: gzip header and trailer
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def export_chunks(db: Session, format: str, filters: Dict[str, Any], include_stats: bool = False,
+                  gzip: bool = False) -> Iterator[bytes]:
+    """
+    The encoded export, chunk by chunk.
+    """
+    rows = iter_rows(db, filters, include_stats)
+    chunks = ndjson_chunks(rows) if format == "ndjson" else csv_chunks(rows, columns(include_stats))
+    return gzip_chunks(chunks) if gzip else chunks
@@ -0,0 +1,189 @@
+"""
+Process-wide facet index of the question bank, for candidate generation.
+
+Keeps, indexed by question ID, the code of the question's topic (its
+(materia, assunto) pair; 0 for deleted questions) and whether it can be
+recommended (not annulled nor outdated). Selecting the questions of a set of
+topics is then one lookup-table gather over the array and a `flatnonzero`, a
+few milliseconds for 500k questions, with no query to `questions`.
+
+The index is loaded on startup and patched by the question write functions
+in crud, like the answer key; writes of other processes arrive through
+question_sync, and `ensure_known` reads the questions it does not know yet.
+"""
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import threading
+import logging
+
+import numpy as np
+
+from backend import models
+from backend.question_sync import question_rows, question_sync
+
+logger = logging.getLogger(__name__)
+
+SEM_TOPICO = 0
+
+Topic = Tuple[str, str] # (materia, assunto)
+FacetRow = Tuple[int, str, str, Optional[bool], Optional[bool]] # (id, materia, assunto, is_anulada, is_desatualizada)
+FACET_COLUMNS = (models.Question.materia, models.Question.assunto, models.Question.is_anulada, models.Question.is_desatualizada)
+
+class QuestionFacets:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topic = np.zeros(0, dtype=np.int32)
+        self._active = np.zeros(0, dtype=bool)
+        self._topics: List[Optional[Topic]] = [None] # Code -> (materia, assunto); code 0 is SEM_TOPICO
+        self._codes: Dict[Topic, int] = {}
+        self.loaded = False
+
+    def load(self, db: Session) -> int:
+        """
+        Builds the arrays from every question in the database. Returns the number of questions.
+        """
+        question_sync.start(db)
+        rows = db.query(models.Question.id, *FACET_COLUMNS).all()
+        size = max((row[0] for row in rows), default=0) + 1
+        with self._lock:
+            self._topic = np.zeros(size, dtype=np.int32)
+            self._active = np.zeros(size, dtype=bool)
+            self._topics, self._codes = [None], {}
+            self._set_rows(rows)
+            self.loaded = True
+        logger.info(f"Question facets loaded with {len(rows)} questions and {len(self._codes)} topics.")
+        return len(rows)
+
+    def ensure_loaded(self, db: Session) -> None:
+        if not self.loaded:
+            self.load(db)
+        question_sync.sync(db)
+
+    def refresh(self, db: Session, question_ids: List[int]) -> None:
+        """
+        Reloads the given questions from the database (question_sync listener).
+        """
+        if not self.loaded:
+            return
+        rows = question_rows(db, question_ids, *FACET_COLUMNS)
+        self.set_many(rows)
+        for q_id in set(question_ids).difference(row[0] for row in rows):
+            self.remove(q_id)
+
+    def ensure_known(self, db: Session, question_ids: Iterable[int]) -> None:
+        """
+        Reads from the database the questions without a topic in the index (e.g. created by
+        another process since the last sync) and patches them in; deleted ones stay SEM_TOPICO.
+        """
+        ids = np.fromiter((int(q) for q in question_ids), dtype=np.int64)
+        missing = np.unique(ids[self.topics_of(ids) == SEM_TOPICO]).tolist()
+        if missing:
+            self.set_many(question_rows(db, missing, *FACET_COLUMNS))
+
+    def _grow(self, size: int) -> None:
+        # Must be called with the lock held; arrays are replaced, never resized in place
+        size = max(size, int(len(self._topic) * 1.5) + 1)
+        topic = np.zeros(size, dtype=np.int32)
+        active = np.zeros(size, dtype=bool)
+        topic[:len(self._topic)], active[:len(self._active)] = self._topic, self._active
+        self._topic, self._active = topic, active
+
+    def _code(self, topic: Topic) -> int:
+        # Must be called with the lock held
+        code = self._codes.get(topic)
+        if code is None:
+            code = self._codes[topic] = len(self._topics)
+            self._topics.append(topic)
+        return code
+
+    def _set_rows(self, rows: Sequence[FacetRow]) -> None:
+        # Must be called with the lock held
+        for q_id, materia, assunto, is_anulada, is_desatualizada in rows:
+            self._topic[q_id] = self._code((materia, assunto))
+            self._active[q_id] = not is_anulada and not is_desatualizada
+
+    def set_many(self, rows: Iterable[FacetRow]) -> None:
+        """
+        Patches the index after questions are created or updated.
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        with self._lock:
+            max_id = max(row[0] for row in rows)
+            if max_id >= len(self._topic):
+                self._grow(max_id + 1)
+            self._set_rows(rows)
+
+    def set(self, question_id: int, materia: str, assunto: str, is_anulada: Optional[bool] = False,
+            is_desatualizada: Optional[bool] = False) -> None:
+        self.set_many([(question_id, materia, assunto, is_anulada, is_desatualizada)])
+
+    def remove(self, question_id: int) -> None:
+        with self._lock:
+            if question_id < len(self._topic):
+                self._topic[question_id] = SEM_TOPICO
+                self._active[question_id] = False
+
+    def topic(self, code: int) -> Optional[Topic]:
+        return self._topics[code] if 0 <= code < len(self._topics) else None
+
+    def topic_code(self, materia: str, assunto: str) -> Optional[int]:
+        return self._codes.get((materia, assunto))
+
+    def topics_of(self, question_ids: Iterable[int]) -> np.ndarray:
+        """
+        Topic codes of the given questions (SEM_TOPICO for unknown or deleted ones).
+        """
+        topic = self._topic
+        ids = np.fromiter((int(q) for q in question_ids), dtype=np.int64)
+        known = (ids >= 0) & (ids < len(topic))
+        return np.where(known, topic[np.where(known, ids, 0)], SEM_TOPICO)
+
+    def is_active(self, question_ids: Iterable[int]) -> np.ndarray:
+        active = self._active
+        ids = np.fromiter((int(q) for q in question_ids), dtype=np.int64)
+        known = (ids >= 0) & (ids < len(active))
+        return np.where(known, active[np.where(known, ids, 0)], False)
+
+    def topics_in(self, materias: Optional[Iterable[str]] = None) -> List[int]:
+        """
+        Codes of the topics of the given materias (every topic when None) that still have questions.
+        """
+        materias = set(materias) if materias is not None else None
+        with self._lock:
+            topics, topic, active = list(self._topics), self._topic, self._active
+        in_use = np.bincount(topic[active], minlength=len(topics)) > 0
+        return [code for code in np.flatnonzero(in_use).tolist()
+                if SEM_TOPICO < code < len(topics) and (materias is None or topics[code][0] in materias)]
+
+    def sample(self, codes: Sequence[int], per_topic: int, exclude: np.ndarray,
+               rng: np.random.Generator) -> Dict[int, List[int]]:
+        """
+        Up to `per_topic` random recommendable questions of each topic in `codes`,
+        leaving out the IDs in `exclude`.
+        """
+        if not codes:
+            return {}
+        with self._lock:
+            topic, active, size = self._topic, self._active, len(self._topics)
+        # The extra False slot takes the topics created after the arrays were read
+        selected = np.zeros(size + 1, dtype=bool)
+        selected[[code for code in codes if code < size]] = True
+        mask = np.take(selected, topic, mode="clip") & active
+        exclude = exclude[(exclude >= 0) & (exclude < len(mask))]
+        mask[exclude] = False
+        ids = np.flatnonzero(mask)
+        id_topics = topic[ids]
+        order = np.argsort(id_topics, kind="stable")
+        ids, id_topics = ids[order], id_topics[order]
+        result = {}
+        for code in codes:
+            start, stop = np.searchsorted(id_topics, code, "left"), np.searchsorted(id_topics, code, "right")
+            if stop > start:
+                chosen = rng.choice(stop - start, size=min(per_topic, stop - start), replace=False)
+                result[code] = ids[start + chosen].tolist()
+        return result
+
+question_facets = QuestionFacets()
+question_sync.register(question_facets.refresh)
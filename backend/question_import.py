@@ -0,0 +1,148 @@
+"""
+Bulk import of questions from JSONL or CSV files.
+
+The file is streamed row by row; rows are validated with schemas.QuestionCreate
+in chunks of CHUNK_SIZE and each chunk is inserted in one transaction with
+crud.create_questions_bulk (multi-row INSERTs). Questions whose content hash
+(crud.question_content_hash) is already in the database, or earlier in the
+file, are skipped; questions nearly identical to one already in the database
+(near_duplicates) are inserted and listed for review. Invalid rows are reported
+with their line and do not stop the import.
+
+JSONL: one JSON object per line with the QuestionCreate fields.
+CSV: a header row with the field names; empty cells are null.
+
+Runs as the "question_import" background job (POST /api/admin/questions/import)
+or from the command line (backend/import_questions.py).
+"""
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import csv
+import io
+import json
+import logging
+import os
+import time
+
+from backend import crud, metrics, near_duplicates, schemas
+from backend.near_duplicates import near_duplicate_index
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 5000 # Rows validated and inserted per transaction
+MAX_REPORTED_ERRORS = 1000 # Row errors kept in the summary; the count covers all of them
+FORMATS = ("jsonl", "csv")
+ANULADA = "Anulada"
+
+def detect_format(filename: str) -> Optional[str]:
+    extension = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    return {"jsonl": "jsonl", "ndjson": "jsonl", "csv": "csv"}.get(extension)
+
+def looks_like_text(head: bytes) -> bool:
+    """
+    Whether the first bytes of a file are UTF-8 text (a multibyte character may be cut at the end).
+    """
+    if b"\x00" in head:
+        return False
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        return e.start >= len(head) - 3
+    return True
+
+def _iter_rows(text: io.TextIOBase, format: str) -> Iterator[Tuple[int, Any]]:
+    """
+    (line number, parsed row or the error message) of each non-empty row.
+    """
+    if format == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, {key: (value if value != "" else None) for key, value in row.items() if key}
+        return
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, f"JSON inválido: {e}"
+            continue
+        yield number, row if isinstance(row, dict) else "Cada linha deve ser um objeto JSON."
+
+def _validate(row: Any) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    if isinstance(row, str):
+        return None, [row]
+    try:
+        question = schemas.QuestionCreate.model_validate(row).model_dump()
+    except ValidationError as e:
+        return None, [f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()]
+    if question["gabarito"] != ANULADA and crud.indice_correto(question["gabarito"], question["tipo"]) is None:
+        return None, [f"gabarito: '{question['gabarito']}' não corresponde ao tipo '{question['tipo']}'"]
+    if question["gabarito"] == ANULADA:
+        question["is_anulada"] = True
+    return question, []
+
+def import_questions(
+    db: Session,
+    path: str,
+    format: Optional[str] = None,
+    chunk_size: int = CHUNK_SIZE,
+    progress: Optional[Callable[[float, str], None]] = None
+) -> Dict[str, Any]:
+    """
+    Imports the questions of a JSONL/CSV file. Returns the summary: linhas, adicionadas,
+    duplicadas, com_erro, erros ([{"linha", "erros"}]), possiveis_duplicatas
+    ([{"linha", "questoes"}]; both lists have at most MAX_REPORTED_ERRORS items) and tempo.
+    Each chunk is committed on its own, so an interrupted import can be run again:
+    the chunks already inserted are skipped as duplicates.
+    """
+    format = format or detect_format(path)
+    if format not in FORMATS:
+        raise ValueError(f"Unsupported import format: {format}")
+    start = time.perf_counter()
+    crud.backfill_question_hashes(db)
+    near_duplicate_index.ensure_loaded(db)
+    seen = crud.get_question_hashes(db)
+    summary: Dict[str, Any] = {"linhas": 0, "adicionadas": 0, "duplicadas": 0, "com_erro": 0, "erros": [],
+                               "possiveis_duplicatas": []}
+    size = os.path.getsize(path) or 1
+
+    with open(path, "rb") as raw:
+        text = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+        rows = _iter_rows(text, format)
+        while True:
+            chunk: List[Dict[str, Any]] = []
+            for number, row in rows:
+                summary["linhas"] += 1
+                question, errors = _validate(row)
+                if errors:
+                    summary["com_erro"] += 1
+                    if len(summary["erros"]) < MAX_REPORTED_ERRORS:
+                        summary["erros"].append({"linha": number, "erros": errors})
+                    continue
+                question["content_hash"] = crud.question_content_hash(question)
+                if question["content_hash"] in seen:
+                    summary["duplicadas"] += 1
+                    continue
+                seen.add(question["content_hash"])
+                signature = near_duplicates.signature(question)
+                question["minhash"] = near_duplicates.to_bytes(signature)
+                similar = near_duplicate_index.find(signature, limit=3) if signature is not None else []
+                if similar and len(summary["possiveis_duplicatas"]) < MAX_REPORTED_ERRORS:
+                    summary["possiveis_duplicatas"].append({"linha": number, "questoes": [q_id for q_id, _ in similar]})
+                chunk.append(question)
+                if len(chunk) >= chunk_size:
+                    break
+            if not chunk:
+                break
+            summary["adicionadas"] += len(crud.create_questions_bulk(db, chunk))
+            if progress:
+                progress(raw.tell() / size, f"{summary['linhas']} linhas lidas, {summary['adicionadas']} questões adicionadas")
+
+    summary["tempo"] = round(time.perf_counter() - start, 3)
+    metrics.incr("question_import.questions", summary["adicionadas"])
+    metrics.observe("question_import", summary["tempo"])
+    logger.info(f"Question import from {path}: {summary['linhas']} rows, {summary['adicionadas']} added, "
+                f"{summary['duplicadas']} duplicates, {summary['com_erro']} with errors in {summary['tempo']}s")
+    return summary
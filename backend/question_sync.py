@@ -0,0 +1,154 @@
+"""
+Keeps the per-process question indexes (answer key, facets, near-duplicate and
+similar-question indexes) in step with the writes of other processes: other
+API workers, jobs claimed by another worker's runner, the command-line import.
+
+Two high-water marks are enough to see those writes without scanning
+`questions`: new questions have IDs above the highest one seen, and edits and
+deletions append a row to `question_changes` (crud logs them in the same
+transaction as the write). `sync`, called by the indexes' `ensure_loaded` at
+most every SYNC_INTERVAL_SECONDS, reads the rows past both marks (two primary
+key range scans) and hands the IDs to every registered index, which reloads
+them from the database. IDs skipped by a mark (a transaction that had not
+committed yet, on databases that allocate IDs before commit) are read again
+for GAP_RETRY_SECONDS.
+
+New questions written by this process are already in its indexes; crud reports
+them with `applied` so they are not loaded twice.
+
+`prune_changes` (run periodically by the job dispatcher) deletes the
+`question_changes` rows older than CHANGES_RETENTION_SECONDS. Gaps are only
+retried for GAP_RETRY_SECONDS and every process that serves requests syncs
+within seconds, so by then the rows are below every mark; a process idle for
+longer than the retention may miss those edits until it restarts.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, or_, select
+from sqlalchemy.orm import Session
+from typing import Callable, Dict, Iterable, List, Sequence, Set
+import threading
+import logging
+import os
+import time
+
+from backend import models
+
+logger = logging.getLogger(__name__)
+
+SYNC_INTERVAL_SECONDS = float(os.getenv("QUESTION_SYNC_INTERVAL_SECONDS", "1"))
+GAP_RETRY_SECONDS = 300
+MAX_GAPS = 10000
+CHANGES_RETENTION_SECONDS = max(GAP_RETRY_SECONDS, int(os.getenv("QUESTION_CHANGES_RETENTION_SECONDS", "86400")))
+CHANGES_PRUNE_INTERVAL_SECONDS = 3600
+QUERY_CHUNK_SIZE = 500 # IDs per IN (...) when an index reloads questions
+
+Listener = Callable[[Session, List[int]], None]
+
+class _Watermark:
+    # Highest ID seen in a column, with the IDs below it that were not seen yet
+    def __init__(self, column):
+        self.column = column
+        self.mark = 0
+        self.gaps: Dict[int, float] = {} # ID -> when it was first skipped
+
+    def reset(self, db: Session) -> None:
+        self.mark = db.scalar(select(func.max(self.column))) or 0
+        self.gaps = {}
+
+    def new_rows(self, db: Session, *columns) -> list:
+        now = time.monotonic()
+        self.gaps = {g: t for g, t in self.gaps.items() if now - t < GAP_RETRY_SECONDS}
+        condition = self.column > self.mark
+        if self.gaps:
+            condition = or_(condition, self.column.in_(list(self.gaps)))
+        rows = db.execute(select(self.column, *columns).where(condition).order_by(self.column)).all()
+        found = {row[0] for row in rows}
+        top = max(found | {self.mark})
+        for missing in range(self.mark + 1, top):
+            if missing not in found and len(self.gaps) < MAX_GAPS:
+                self.gaps.setdefault(missing, now)
+        for row_id in found:
+            self.gaps.pop(row_id, None)
+        self.mark = top
+        return rows
+
+class QuestionSync:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._questions = _Watermark(models.Question.id)
+        self._changes = _Watermark(models.QuestionChange.id)
+        self._listeners: List[Listener] = []
+        self._applied: Set[int] = set()
+        self._checked_at = 0.0
+        self.started = False
+
+    def register(self, listener: Listener) -> None:
+        """
+        Adds an index callback, called with (db, question IDs) for the questions created,
+        edited or deleted by other processes.
+        """
+        self._listeners.append(listener)
+
+    def start(self, db: Session) -> None:
+        """
+        Sets both marks at the current state of the database. Called by the indexes before
+        they load, so every later write is seen.
+        """
+        with self._lock:
+            if not self.started:
+                self._questions.reset(db)
+                self._changes.reset(db)
+                self._checked_at = time.monotonic()
+                self.started = True
+
+    def applied(self, question_ids: Iterable[int]) -> None:
+        """
+        Reports new questions already put in this process's indexes by the write that created them.
+        """
+        with self._lock:
+            if self.started:
+                self._applied.update(q_id for q_id in question_ids if q_id > self._questions.mark)
+
+    def sync(self, db: Session, force: bool = False) -> None:
+        """
+        Passes the questions written by other processes since the last call to the indexes.
+        """
+        if not self.started or (not force and time.monotonic() - self._checked_at < SYNC_INTERVAL_SECONDS):
+            return
+        with self._lock:
+            self._checked_at = time.monotonic()
+            new_ids = [row[0] for row in self._questions.new_rows(db)]
+            changed = {row[1] for row in self._changes.new_rows(db, models.QuestionChange.question_id)}
+            ids = sorted(changed.union(q_id for q_id in new_ids if q_id not in self._applied))
+            self._applied.difference_update(new_ids)
+        if not ids:
+            return
+        logger.info(f"Question indexes catching up with {len(ids)} questions written by other processes.")
+        for listener in self._listeners:
+            try:
+                listener(db, ids)
+            except Exception:
+                logger.exception(f"Question index refresh failed for {len(ids)} questions")
+
+def question_rows(db: Session, question_ids: Sequence[int], *columns) -> list:
+    """
+    (id, *columns) of the given questions that exist, in chunks of QUERY_CHUNK_SIZE IDs.
+    """
+    rows = []
+    for start in range(0, len(question_ids), QUERY_CHUNK_SIZE):
+        chunk = question_ids[start:start + QUERY_CHUNK_SIZE]
+        rows.extend(db.execute(select(models.Question.id, *columns).where(models.Question.id.in_(chunk))).all())
+    return rows
+
+def prune_changes(db: Session) -> int:
+    """
+    Deletes the question_changes rows older than CHANGES_RETENTION_SECONDS; returns how many.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=CHANGES_RETENTION_SECONDS)
+    deleted = db.execute(delete(models.QuestionChange).where(models.QuestionChange.changed_at < cutoff)).rowcount
+    db.commit()
+    if deleted:
+        logger.info(f"{deleted} question change rows pruned.")
+    return deleted
+
+question_sync = QuestionSync()
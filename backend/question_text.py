@@ -0,0 +1,35 @@
+"""
+Normalized text of a question, shared by the duplicate detectors.
+
+The statement and alternatives are compared without HTML, entities, case or
+whitespace differences, so a question typed in the admin form, extracted from
+a PDF or imported from a file looks the same.
+"""
+from typing import Any, List
+import html
+import re
+
+QUESTION_TEXT_FIELDS = ("enunciado", "item_a", "item_b", "item_c", "item_d", "item_e")
+
+_HTML_TAG = re.compile(r"<[^>]+>")
+_WORD = re.compile(r"\w+")
+
+def _getter(question: Any):
+    return question.get if isinstance(question, dict) else lambda field: getattr(question, field, None)
+
+def normalize(text: str) -> str:
+    text = html.unescape(_HTML_TAG.sub(" ", text or ""))
+    return " ".join(text.casefold().split())
+
+def normalized_fields(question: Any) -> List[str]:
+    """
+    The normalized QUESTION_TEXT_FIELDS of a question (dict, model or schema), "" when missing.
+    """
+    get = _getter(question)
+    return [normalize(get(field)) for field in QUESTION_TEXT_FIELDS]
+
+def words(question: Any) -> List[str]:
+    """
+    The words of the statement and alternatives, in order, without punctuation.
+    """
+    return _WORD.findall(" ".join(normalized_fields(question)))
@@ -0,0 +1,156 @@
+"""
+"Next best question" ranking.
+
+The queue mixes three kinds of candidates:
+
+- revisao: questions the user got wrong on the last try, oldest first;
+- assunto_fraco: unseen questions of the user's weakest assuntos, by smoothed
+  error rate (a prior of PRIOR_ACCURACY over PRIOR_ATTEMPTS attempts keeps an
+  assunto with one wrong answer from ranking above one with twenty);
+- nao_vista: unseen questions of assuntos the user never practised, within the
+  edital's materias (or the materias the user already studies).
+
+Everything comes from the per-user aggregates (UserTopicStats,
+UserQuestionState) and the in-memory facet index (question_facets); nothing
+reads NotebookProgress and nothing loads the user's whole history. The
+weakest assuntos are picked by the database (ORDER BY smoothed accuracy LIMIT
+over the user's rows); questions and new assuntos are drawn at random from the
+facet index, OVERSAMPLING times more than needed, and the ones the user
+already answered or practised are dropped with small IN queries on the unique
+indexes. Each candidate gets a priority and repeated picks from the same
+assunto decay by TOPIC_DECAY, so the queue stays varied.
+"""
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from backend import models
+from backend.question_facets import question_facets
+
+PRIOR_ACCURACY = 0.6
+PRIOR_ATTEMPTS = 5
+MIN_ATTEMPTS = 3 # Assuntos with fewer attempts are not judged weak yet
+WEAK_TOPICS = 5
+NEW_TOPICS = 5
+QUESTIONS_PER_TOPIC = 4
+OVERSAMPLING = 3 # Random picks per needed item, before dropping the ones the user already saw
+REVIEW_CANDIDATES = 200 # Oldest wrong answers read, before keeping the ones in the materias
+REVIEW_PRIORITY = 0.9
+NEW_TOPIC_PRIORITY = 0.5
+TOPIC_DECAY = 0.8
+
+def weakness(tentativas: int, acertos: int) -> float:
+    """
+    Smoothed error rate of an assunto, between 0 and 1.
+    """
+    return 1 - (acertos + PRIOR_ACCURACY * PRIOR_ATTEMPTS) / (tentativas + PRIOR_ATTEMPTS)
+
+def _reviews(db: Session, user_id: int, materias: Optional[set], limit: int) -> List[Tuple[int, int]]:
+    # (question ID, topic code) of the oldest wrong answers that can still be recommended
+    state = models.UserQuestionState
+    ids = db.scalars(
+        select(state.question_id)
+        .where(state.user_id == user_id, state.ultimo_acerto == False)
+        .order_by(state.respondida_em)
+        .limit(REVIEW_CANDIDATES if materias is not None else limit)
+    ).all()
+    reviews = []
+    for q_id, code, active in zip(ids, question_facets.topics_of(ids).tolist(), question_facets.is_active(ids).tolist()):
+        topic = question_facets.topic(code)
+        if active and topic and (materias is None or topic[0] in materias):
+            reviews.append((q_id, code))
+    return reviews[:limit]
+
+def _weak_topics(db: Session, user_id: int, materias: Optional[set]) -> List[Tuple[float, int]]:
+    # (weakness, topic code) of the weakest assuntos, weakest first
+    stats = models.UserTopicStats
+    accuracy = (stats.acertos + PRIOR_ACCURACY * PRIOR_ATTEMPTS) / (stats.tentativas + PRIOR_ATTEMPTS)
+    query = select(stats.materia, stats.assunto, stats.tentativas, stats.acertos).where(
+        stats.user_id == user_id, stats.tentativas >= MIN_ATTEMPTS
+    )
+    if materias is not None:
+        query = query.where(stats.materia.in_(materias))
+    weak = []
+    for materia, assunto, tentativas, acertos in db.execute(query.order_by(accuracy).limit(WEAK_TOPICS)):
+        code = question_facets.topic_code(materia, assunto)
+        if code is not None:
+            weak.append((weakness(tentativas, acertos), code))
+    return weak
+
+def _new_topics(db: Session, user_id: int, materias: Optional[set], rng: np.random.Generator) -> List[int]:
+    # Codes of random assuntos of the materias that the user never practised
+    stats = models.UserTopicStats
+    if materias is None:
+        materias = set(db.scalars(select(stats.materia).where(stats.user_id == user_id).distinct())) or None
+    codes = question_facets.topics_in(materias)
+    if len(codes) > NEW_TOPICS * OVERSAMPLING:
+        codes = rng.choice(codes, size=NEW_TOPICS * OVERSAMPLING, replace=False).tolist()
+    if not codes:
+        return []
+    topics = [question_facets.topic(code) for code in codes]
+    practised = set(db.execute(
+        select(stats.materia, stats.assunto)
+        .where(stats.user_id == user_id, stats.assunto.in_({assunto for _, assunto in topics}))
+    ).tuples())
+    return [code for code, topic in zip(codes, topics) if topic not in practised][:NEW_TOPICS]
+
+def _unseen(db: Session, user_id: int, picks: Dict[int, List[int]]) -> Dict[int, List[int]]:
+    # The picks without the questions the user already answered, at most QUESTIONS_PER_TOPIC per topic
+    state = models.UserQuestionState
+    ids = [q_id for q_ids in picks.values() for q_id in q_ids]
+    if not ids:
+        return {}
+    seen = set(db.scalars(select(state.question_id).where(state.user_id == user_id, state.question_id.in_(ids))))
+    return {code: [q_id for q_id in q_ids if q_id not in seen][:QUESTIONS_PER_TOPIC] for code, q_ids in picks.items()}
+
+def rank(
+    db: Session,
+    user_id: int,
+    materias: Optional[Iterable[str]] = None,
+    limit: int = 20,
+    seed: int = 0
+) -> List[Dict[str, Any]]:
+    """
+    The ranked queue: [{"question_id", "materia", "assunto", "motivo", "prioridade"}], at most
+    `limit` items. `materias` restricts the assuntos considered (e.g. to an edital); `seed`
+    makes the random picks repeatable.
+    """
+    rng = np.random.default_rng(seed)
+    materias = set(materias) if materias is not None else None
+    candidates: List[Tuple[float, int, int, str]] = [] # (priority, question ID, topic code, motivo)
+
+    reviews = _reviews(db, user_id, materias, limit)
+    for position, (q_id, code) in enumerate(reviews):
+        candidates.append((REVIEW_PRIORITY * (0.99 ** position), q_id, code, "revisao"))
+
+    weak = _weak_topics(db, user_id, materias)
+    weak_codes = {code for _, code in weak}
+    new_topics = [code for code in _new_topics(db, user_id, materias, rng) if code not in weak_codes]
+
+    exclude = np.asarray([q_id for q_id, _ in reviews], dtype=np.int64)
+    picks = question_facets.sample([code for _, code in weak] + new_topics, QUESTIONS_PER_TOPIC * OVERSAMPLING,
+                                   exclude, rng)
+    picks = _unseen(db, user_id, picks)
+    for score, code in weak:
+        candidates.extend((score, q_id, code, "assunto_fraco") for q_id in picks.get(code, []))
+    for code in new_topics:
+        candidates.extend((NEW_TOPIC_PRIORITY, q_id, code, "nao_vista") for q_id in picks.get(code, []))
+
+    # Repeated picks of the same assunto decay, whatever their source
+    candidates.sort(key=lambda c: -c[0])
+    seen_per_topic: Dict[int, int] = {}
+    ranked = []
+    for priority, q_id, code, motivo in candidates:
+        repeats = seen_per_topic.get(code, 0)
+        seen_per_topic[code] = repeats + 1
+        ranked.append((priority * TOPIC_DECAY ** repeats, q_id, code, motivo))
+    ranked.sort(key=lambda c: -c[0])
+
+    queue = []
+    for priority, q_id, code, motivo in ranked[:limit]:
+        materia, assunto = question_facets.topic(code) or (None, None)
+        queue.append({"question_id": q_id, "materia": materia, "assunto": assunto, "motivo": motivo,
+                      "prioridade": round(priority, 3)})
+    return queue
@@ -0,0 +1,15 @@
+from starlette.responses import JSONResponse as StarletteJSONResponse
+from typing import Any
+import orjson
+
+class JSONResponse(StarletteJSONResponse):
+    """
+    Default response class of the API: renders with orjson, keeping the stdlib encoder's
+    support for non-string dict keys (e.g. {question_id: ...}) and also serializing NumPy values.
+
+    Returning an instance from an endpoint skips the response_model re-validation; list
+    endpoints do so with payloads that already have the schema's shape (crud.question_payload).
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
@@ -0,0 +1,53 @@
+"""
+SM-2 spaced-repetition schedule of the questions a user got wrong.
+
+Each answer is graded from its result alone (the app has no "how hard was it"
+button): QUALITY_CORRECT for a hit, QUALITY_WRONG for a miss. A miss restarts
+the repetitions (the question is due again the next day); consecutive hits
+space the reviews by 1 day, 6 days and then the previous interval times the
+ease factor. The ease factor moves with the SM-2 formula, never below
+MIN_EASE, so questions the user keeps missing come back more often.
+
+Only questions the user missed at least once are scheduled; the state lives in
+UserQuestionState (repeticoes, intervalo_dias, facilidade, revisar_em) and is
+advanced by crud.record_user_answers on each answer, so the review queue is an
+index range scan on (user_id, revisar_em).
+"""
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+QUALITY_CORRECT = 5
+QUALITY_WRONG = 2
+FIRST_INTERVAL_DAYS = 1
+SECOND_INTERVAL_DAYS = 6
+
+def next_review(
+    repeticoes: int,
+    intervalo_dias: float,
+    facilidade: float,
+    correct: bool,
+    answered_at: datetime,
+    scheduled: bool = True
+) -> Tuple[int, float, float, Optional[datetime]]:
+    """
+    (repeticoes, intervalo_dias, facilidade, revisar_em) after an answer. `scheduled` tells
+    whether the question is already in the user's review schedule; hits on a question that
+    is not stay unscheduled (revisar_em None).
+    """
+    if not correct:
+        repeticoes, intervalo_dias = 0, FIRST_INTERVAL_DAYS
+    elif not scheduled:
+        return repeticoes, intervalo_dias, facilidade, None
+    else:
+        repeticoes += 1
+        if repeticoes == 1:
+            intervalo_dias = FIRST_INTERVAL_DAYS
+        elif repeticoes == 2:
+            intervalo_dias = SECOND_INTERVAL_DAYS
+        else:
+            intervalo_dias = round(intervalo_dias * facilidade, 1)
+    quality = QUALITY_CORRECT if correct else QUALITY_WRONG
+    facilidade = max(MIN_EASE, facilidade + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return repeticoes, intervalo_dias, round(facilidade, 2), answered_at + timedelta(days=intervalo_dias)
@@ -4,10 +4,14 @@ from typing import List, Optional
 from ..schemas import SimuladoConfigSchema, QuestaoFeedback
 from .. import crud, schemas, models 
 from ..auth import get_current_user 
-from ..database import get_db 
+from ..database import get_db, get_read_db
+from ..write_queue import run_write
 from datetime import datetime, timedelta
 import random
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -42,16 +46,16 @@ def gerar_simulado(payload: SimuladoConfigSchema, db: Session = Depends(get_db),
         todas_questoes.extend(questoes_selecionadas)
         questoes_ids_selecionadas.extend([q.id for q in questoes_selecionadas]) 
 
+    crud.prefetch_renders(todas_questoes)
     questoes_formatadas = []
     for q in todas_questoes:
-        alternativas_formatadas = crud.transformar_alternativas(q) 
-        correta_id_mapeada = crud.mapear_gabarito_para_indice(q.gabarito) 
+        render = crud.render_question(q)
 
         questoes_formatadas.append({
             "id": q.id,
-            "content": crud.strip_p_tags(q.enunciado),
-            "alternativas": alternativas_formatadas, 
-            "correct_alternative_id": correta_id_mapeada,  
+            "content": render["conteudo"],
+            "alternativas": render["alternativas"], 
+            "correct_alternative_id": render["correct_alternative_id"],  
             "materia": q.materia, 
             "assunto": q.assunto, 
             "tipo": crud.obter_tipo_por_materia(q.materia) 
@@ -78,8 +82,9 @@ def gerar_simulado(payload: SimuladoConfigSchema, db: Session = Depends(get_db),
         "questoes": questoes_formatadas
     }
     
-    print("DEBUG: Dados do simulado gerados (antes de enviar para o frontend):")
-    print(json.dumps(response_data, indent=2, ensure_ascii=False))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Dados do simulado gerados (antes de enviar para o frontend):")
+        logger.debug(json.dumps(response_data, indent=2, ensure_ascii=False))
 
     return response_data
 
@@ -107,13 +112,15 @@ def submit_simulado(
                              .filter(models.Question.id.in_(question_ids_in_submission))
                              .all()
     }
+    crud.prefetch_renders(list(questions_map.values()))
 
     for resposta in submission.answers:
         questao = questions_map.get(resposta.question_id)
         if not questao:
             continue 
 
-        correct_alternative_id_mapped = crud.mapear_gabarito_para_indice(questao.gabarito)
+        render = crud.render_question(questao)
+        correct_alternative_id_mapped = render["correct_alternative_id"]
 
         user_selected_alternative_id_mapped = None
         if resposta.selected_alternative_id is not None and resposta.selected_alternative_id != -1:
@@ -126,12 +133,10 @@ def submit_simulado(
         else:
             erros += 1
 
-        alternativas_formatted = crud.transformar_alternativas(questao)
-
         feedback.append(QuestaoFeedback(
             question_id=questao.id,
-            content=crud.strip_p_tags(questao.enunciado),
-            alternatives=alternativas_formatted,
+            content=render["conteudo"],
+            alternatives=render["alternativas"],
             selected_alternative_id=resposta.selected_alternative_id,
             correct_alternative_id=correct_alternative_id_mapped,
             is_correct=is_correct
@@ -139,8 +144,9 @@ def submit_simulado(
 
     percentual = (acertos / total) * 100 if total > 0 else 0.0
 
-    simulado_id_salvo = crud.salvar_simulado(
-        db=db,
+    simulado_id_salvo = run_write(
+        db,
+        crud.salvar_simulado,
         user_id=current_user.id,
         tempo_limite=tempo_limite_segundos, 
         tempo_utilizado=submission.time_taken_seconds,
@@ -278,7 +284,7 @@ def contar_questoes_filtradas(
   escolaridade: Optional[List[str]] = Query(None),
   dificuldade: Optional[List[str]] = Query(None),
   regiao: Optional[List[str]] = Query(None),
-  db: Session = Depends(get_db),
+  db: Session = Depends(get_read_db),
 ):
   total = crud.count_questions(
     db=db,
@@ -54,6 +54,31 @@ class UserStats(BaseModel):
     class Config:
         from_attributes = True
 
+class NextQuestion(BaseModel):
+    """Schema de um item da fila de questões recomendadas ao usuário."""
+    question_id: int
+    materia: Optional[str] = None
+    assunto: Optional[str] = None
+    motivo: str # "revisao", "assunto_fraco" ou "nao_vista"
+    prioridade: float
+
+# --- Schemas da Árvore de Assuntos ---
+
+class TopicNode(BaseModel):
+    """Schema de um nó da árvore de assuntos (GET /api/topics)."""
+    id: int
+    materia: str
+    nome: str
+    parent_id: Optional[int] = None
+    depth: int # 0 para os assuntos de primeiro nível
+    total_questoes: int # Questões do assunto e de todos os subassuntos
+
+class TopicImportSummary(BaseModel):
+    """Resumo da importação de um esquema numerado de assuntos."""
+    criados: int
+    movidos: int
+    ignorados: int # Movimentos que poriam um assunto dentro da própria subárvore
+
 # --- Schemas de Questão ---
 
 class Alternative(BaseModel):
@@ -98,6 +123,39 @@ class Question(QuestionBase):
     class Config:
         from_attributes = True
 
+class QuestionTeacherComment(BaseModel):
+    """Schema do comentário do professor de uma questão, carregado sob demanda."""
+    question_id: int
+    comentarioProfessor: Optional[str] = None
+
+class DuplicateCheck(BaseModel):
+    """Schema do texto de uma questão a ser conferido contra o banco antes de salvar."""
+    enunciado: str
+    item_a: Optional[str] = None
+    item_b: Optional[str] = None
+    item_c: Optional[str] = None
+    item_d: Optional[str] = None
+    item_e: Optional[str] = None
+    exclude_id: Optional[int] = None # A própria questão, ao editar
+
+class PossibleDuplicate(BaseModel):
+    """Schema de uma questão quase igual à conferida."""
+    question_id: int
+    similaridade: float # Similaridade estimada (Jaccard) entre 0 e 1
+    materia: str
+    assunto: str
+    banca: str
+    ano: Optional[int] = None
+
+class SimilarQuestion(BaseModel):
+    """Schema de uma questão parecida com outra (recomendação "mais questões como esta")."""
+    question_id: int
+    similaridade: float # Similaridade de cosseno TF-IDF entre 0 e 1
+    materia: str
+    assunto: str
+    banca: str
+    ano: Optional[int] = None
+
 class QuestionStatusUpdate(BaseModel):
     """Schema para atualização do status de uma questão (anulada/desatualizada)."""
     is_anulada: Optional[bool] = None
@@ -108,10 +166,22 @@ class QuestionStatistics(BaseModel):
     question_id: int
     total_attempts: int
     correct_attempts: int
+    answer_distribution: Dict[str, int] = Field(default_factory=dict) # {"A": n, ..., "Certo": n, "Errado": n}
     
     class Config:
         from_attributes = True
 
+class SplitStatisticsPart(BaseModel):
+    """Tentativas e acertos de uma parte das estatísticas divididas."""
+    tentativas: int
+    acertos: int
+
+class SplitStatistics(BaseModel):
+    """Estatísticas de uma questão divididas entre o usuário e os demais."""
+    total: SplitStatisticsPart
+    usuario: SplitStatisticsPart
+    outros: SplitStatisticsPart
+
 # --- Schemas de Caderno ---
 
 class NotebookBase(BaseModel):
@@ -252,6 +322,19 @@ class FavoriteQuestion(FavoriteQuestionBase): # NOVO SCHEMA
     class Config:
         from_attributes = True
 
+class ReviewQuestion(BaseModel):
+    """Schema de uma questão na fila de revisão espaçada do usuário (GET /api/review/due)."""
+    question_id: int
+    notebook_id: Optional[int] = None # None quando o caderno da última resposta foi excluído
+    notebook_name: Optional[str] = None
+    revisar_em: datetime
+    repeticoes: int # Acertos seguidos desde o último erro
+    intervalo_dias: float
+    facilidade: float
+    tentativas: int
+    acertos: int
+    question: Optional[Question] = None
+
 class QuestionNoteBase(BaseModel):
     question_id: int
     content: str
@@ -272,6 +355,16 @@ class QuestionNoteResponse(QuestionNoteBase):
     class Config:
         from_attributes = True
 
+class QuestionContext(BaseModel):
+    """Schema com todo o contexto de uma questão para o usuário (estatísticas, anotação, favorito e comentários)."""
+    question_id: int
+    statistics: QuestionStatistics
+    split: SplitStatistics
+    note: Optional[QuestionNoteResponse] = None
+    is_favorited: bool = False
+    favorite_notebook_ids: List[int] = Field(default_factory=list)
+    comment_count: int = 0
+
 class AssuntoItem(BaseModel):
     assunto: str
 
@@ -452,3 +545,24 @@ class StudyPlanOverview(BaseModel):
 
     class Config:
         from_attributes = True
+
+# --- Schemas de Tarefas em Segundo Plano ---
+
+class Job(BaseModel):
+    """Schema de uma tarefa em segundo plano (importação de PDF, recalibração), consultada por polling ou SSE."""
+    id: str
+    kind: str
+    status: str # pending, running, succeeded, failed, cancelled
+    progress: float # 0 a 1
+    message: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    cancel_requested: bool
+    attempts: int
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,338 @@
+"""
+Process-wide TF-IDF index for "more questions like this one".
+
+Each question is a sparse vector over the words of its statement plus its
+assunto (words and the whole assunto as one extra term): sublinear term
+frequency times inverse document frequency, keeping the MAX_TERMS_PER_QUESTION
+heaviest terms, L2-normalized. Similar questions are the ones with the highest
+cosine similarity.
+
+The vectors are stored as an inverted index in CSR form (NumPy arrays: term
+-> question IDs and weights), so scoring a question only touches the postings
+of its own terms. Terms present in more than MAX_DOCUMENT_FREQUENCY of the
+questions carry no information and are dropped.
+
+Tokenizing the whole bank takes a while, so the built index is saved to
+SIMILAR_QUESTIONS_INDEX_PATH with the fingerprint of the questions table
+(count, max ID, sum of versions). On startup it is loaded from there when the
+fingerprint still matches and rebuilt (and saved again) otherwise; it can be
+built ahead of a deploy with backend/build_similar_questions.py.
+
+Once loaded, the index is patched by the crud write functions, like the answer
+key. Questions written since the build are kept in small dicts and merged into
+the arrays once they pile up; the IDF weights stay those of the build (new
+words count as rare) until the next rebuild. Questions written by other
+processes are picked up through question_sync.
+"""
+from collections import Counter
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Optional, Tuple
+import heapq
+import math
+import os
+import re
+import threading
+import logging
+
+import numpy as np
+
+from backend import models, question_text
+from backend.question_sync import question_rows, question_sync
+
+logger = logging.getLogger(__name__)
+
+MIN_WORD_LENGTH = 3 # Shorter words (articles, prepositions) are skipped
+MAX_DOCUMENT_FREQUENCY = 0.5 # Fraction of the questions above which a term is dropped
+MIN_QUESTIONS_FOR_MAX_DF = 100 # Small banks keep every term
+MAX_TERMS_PER_QUESTION = 32
+ASSUNTO_TERM = "assunto:"
+LOAD_BATCH_SIZE = 5000
+SIMILAR_QUESTIONS_INDEX_PATH = os.getenv("SIMILAR_QUESTIONS_INDEX_PATH", "./similar_questions_index.npz")
+
+_TERM = re.compile(r"\w{%d,}" % MIN_WORD_LENGTH)
+_EMPTY_IDS = np.zeros(0, dtype=np.int32)
+_EMPTY_WEIGHTS = np.zeros(0, dtype=np.float32)
+
+def terms(enunciado: Optional[str], assunto: Optional[str]) -> List[str]:
+    """
+    The terms of a question, repeated as often as they occur.
+    """
+    assunto = question_text.normalize(assunto)
+    words = _TERM.findall(question_text.normalize(enunciado)) + _TERM.findall(assunto)
+    if assunto:
+        words.append(ASSUNTO_TERM + assunto)
+    return words
+
+def _fingerprint(db: Session) -> Tuple:
+    # Same as crud.get_questions_fingerprint: changes whenever a question is created, edited or deleted
+    return tuple(db.query(
+        func.count(models.Question.id), func.max(models.Question.id), func.sum(models.Question.version)
+    ).one())
+
+class SimilarQuestionIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._vocabulary: Dict[str, int] = {}
+        self._idf = _EMPTY_WEIGHTS
+        self._new_term_idf = 1.0
+        self._term_ptr = np.zeros(1, dtype=np.int64) # Postings of term t: [_term_ptr[t], _term_ptr[t + 1])
+        self._post_ids = _EMPTY_IDS
+        self._post_weights = _EMPTY_WEIGHTS
+        self._stale = np.zeros(0, dtype=bool) # Questions whose postings above are out of date
+        self._changed: Dict[int, Dict[int, float]] = {} # Question ID -> {term: weight}, since the arrays were built
+        self._changed_postings: Dict[int, Dict[int, float]] = {} # Term -> {question ID: weight}, same data
+        self._questions = 0 # Indexed by the last build
+        self.loaded = False
+
+    def load(self, db: Session, path: Optional[str] = SIMILAR_QUESTIONS_INDEX_PATH) -> int:
+        """
+        Loads the index saved at `path` if it matches the questions table, otherwise builds it
+        and saves it there (None: always builds, saves nothing). Returns the number of questions indexed.
+        """
+        question_sync.start(db)
+        if path and os.path.exists(path):
+            try:
+                total = self._load_file(path, _fingerprint(db))
+            except (OSError, KeyError, ValueError) as e:
+                logger.warning(f"Could not read the similar-questions index at {path}: {e}")
+                total = None
+            if total is not None:
+                logger.info(f"Similar-questions index loaded from {path} with {total} questions.")
+                return total
+        return self.rebuild(db, path)
+
+    def rebuild(self, db: Session, path: Optional[str] = SIMILAR_QUESTIONS_INDEX_PATH) -> int:
+        """
+        Builds the index from the stored questions and saves it to `path` (unless None).
+        Returns the number of questions indexed.
+        """
+        fingerprint = _fingerprint(db) # Taken before reading: a write during the build makes the file stale
+        total = self.build(db)
+        if path:
+            self.save(path, fingerprint)
+        return total
+
+    def build(self, db: Session) -> int:
+        """
+        Builds the index from the stored questions. Returns the number of questions indexed.
+        """
+        vocabulary: Dict[str, int] = {}
+        ids: List[int] = []
+        lengths: List[int] = []
+        flat_terms: List[int] = []
+        flat_counts: List[int] = []
+        query = db.query(models.Question.id, models.Question.enunciado, models.Question.assunto)
+        for q_id, enunciado, assunto in query.order_by(models.Question.id).yield_per(LOAD_BATCH_SIZE):
+            counts = Counter(terms(enunciado, assunto))
+            for term in counts:
+                if term not in vocabulary:
+                    vocabulary[term] = len(vocabulary)
+            flat_terms.extend(map(vocabulary.__getitem__, counts))
+            flat_counts.extend(counts.values())
+            lengths.append(len(counts))
+            ids.append(q_id)
+
+        # One (row, term, count) entry per distinct term of each question
+        rows = np.repeat(np.arange(len(ids)), lengths)
+        term_ids = np.asarray(flat_terms, dtype=np.int64)
+        counts = np.asarray(flat_counts, dtype=np.float64)
+        document_frequency = np.bincount(term_ids, minlength=len(vocabulary))
+        total = len(ids)
+        idf = (np.log((1 + total) / (1 + document_frequency)) + 1).astype(np.float32)
+        if total >= MIN_QUESTIONS_FOR_MAX_DF:
+            idf[document_frequency > MAX_DOCUMENT_FREQUENCY * total] = 0
+        weights = (1 + np.log(counts)) * idf[term_ids]
+        keep = weights > 0
+        rows, term_ids, weights = rows[keep], term_ids[keep], weights[keep]
+
+        # Heaviest terms of each question: rank within the row once sorted by (row, -weight)
+        order = np.lexsort((-weights, rows))
+        rows, term_ids, weights = rows[order], term_ids[order], weights[order]
+        rank = np.arange(len(rows)) - np.searchsorted(rows, rows, "left")
+        keep = rank < MAX_TERMS_PER_QUESTION
+        rows, term_ids, weights = rows[keep], term_ids[keep], weights[keep]
+        weights /= np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=total))[rows]
+        question_ids = np.asarray(ids, dtype=np.int32)[rows]
+
+        with self._lock:
+            self._vocabulary = vocabulary
+            self._idf = idf
+            self._new_term_idf = math.log(1 + total) + 1
+            self._changed, self._changed_postings = {}, {}
+            self._stale = np.zeros((ids[-1] + 1) if ids else 0, dtype=bool)
+            self._build_postings(question_ids, term_ids, weights)
+            self._questions = total
+            self.loaded = True
+        logger.info(f"Similar-questions index built with {total} questions and {len(vocabulary)} terms.")
+        return total
+
+    def save(self, path: str, fingerprint: Tuple) -> None:
+        """
+        Saves the built index (without the changes made since) to `path`, tagged with the fingerprint
+        of the questions table it was built from.
+        """
+        with self._lock:
+            size = len(self._term_ptr) - 1 # Terms added by later writes are not in the arrays
+            arrays = {
+                "fingerprint": np.asarray([-1 if v is None else v for v in fingerprint], dtype=np.int64),
+                "questions": np.int64(self._questions),
+                "vocabulary": np.frombuffer("\n".join(list(self._vocabulary)[:size]).encode("utf-8"), dtype=np.uint8),
+                "idf": self._idf[:size],
+                "new_term_idf": np.float64(self._new_term_idf),
+                "stale_size": np.int64(len(self._stale)),
+                "term_ptr": self._term_ptr,
+                "post_ids": self._post_ids,
+                "post_weights": self._post_weights,
+            }
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(temporary, path) # Other workers may be reading it
+
+    def _load_file(self, path: str, fingerprint: Tuple) -> Optional[int]:
+        with np.load(path) as saved:
+            if saved["fingerprint"].tolist() != [-1 if v is None else v for v in fingerprint]:
+                return None
+            terms = bytes(saved["vocabulary"]).decode("utf-8").split("\n") if saved["vocabulary"].size else []
+            with self._lock:
+                self._vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+                self._idf = saved["idf"]
+                self._new_term_idf = float(saved["new_term_idf"])
+                self._term_ptr, self._post_ids, self._post_weights = saved["term_ptr"], saved["post_ids"], saved["post_weights"]
+                self._stale = np.zeros(int(saved["stale_size"]), dtype=bool)
+                self._changed, self._changed_postings = {}, {}
+                self._questions = int(saved["questions"])
+                self.loaded = True
+                return self._questions
+
+    def ensure_loaded(self, db: Session) -> None:
+        if not self.loaded:
+            self.load(db)
+        question_sync.sync(db)
+
+    def refresh(self, db: Session, question_ids: List[int]) -> None:
+        """
+        Reloads the given questions from the database (question_sync listener).
+        """
+        if not self.loaded:
+            return
+        rows = question_rows(db, question_ids, models.Question.enunciado, models.Question.assunto)
+        self.set_many(rows)
+        for q_id in set(question_ids).difference(row[0] for row in rows):
+            self.remove(q_id)
+
+    def _build_postings(self, question_ids: np.ndarray, term_ids: np.ndarray, weights: np.ndarray) -> None:
+        # Must be called with the lock held; arrays are replaced, never changed in place
+        order = np.argsort(term_ids, kind="stable")
+        self._term_ptr = np.searchsorted(term_ids[order], np.arange(len(self._vocabulary) + 1)).astype(np.int64)
+        self._post_ids = question_ids[order].astype(np.int32)
+        self._post_weights = weights[order].astype(np.float32)
+
+    def _merge_changes(self) -> None:
+        # Must be called with the lock held
+        post_terms = np.repeat(np.arange(len(self._term_ptr) - 1), np.diff(self._term_ptr))
+        keep = ~self._stale[self._post_ids]
+        changed = [(q_id, term, weight) for q_id, vector in self._changed.items() for term, weight in vector.items()]
+        changed_ids, changed_terms, changed_weights = zip(*changed) if changed else ((), (), ())
+        self._build_postings(
+            np.concatenate((self._post_ids[keep], np.asarray(changed_ids, dtype=np.int32))),
+            np.concatenate((post_terms[keep], np.asarray(changed_terms, dtype=np.int64))),
+            np.concatenate((self._post_weights[keep], np.asarray(changed_weights, dtype=np.float32))),
+        )
+        self._stale = np.zeros(len(self._stale), dtype=bool)
+        self._changed, self._changed_postings = {}, {}
+
+    def _vector(self, question_terms: List[str], add_terms: bool = False) -> Dict[int, float]:
+        # Must be called with the lock held; the same weighting and pruning as build()
+        weights: Dict[int, float] = {}
+        for term, count in Counter(question_terms).items():
+            term_id = self._vocabulary.get(term)
+            if term_id is None:
+                if not add_terms:
+                    continue
+                term_id = self._vocabulary[term] = len(self._vocabulary)
+                self._idf = np.append(self._idf, np.float32(self._new_term_idf))
+            if self._idf[term_id] > 0:
+                weights[term_id] = (1 + math.log(count)) * float(self._idf[term_id])
+        if len(weights) > MAX_TERMS_PER_QUESTION:
+            weights = dict(heapq.nlargest(MAX_TERMS_PER_QUESTION, weights.items(), key=lambda item: item[1]))
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {term_id: w / norm for term_id, w in weights.items()}
+
+    def set_many(self, rows: Iterable[Tuple[int, Optional[str], Optional[str]]]) -> None:
+        """
+        Indexes (id, enunciado, assunto) rows after questions are created or updated.
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        vectors = [(q_id, terms(enunciado, assunto)) for q_id, enunciado, assunto in rows]
+        with self._lock:
+            max_id = max(q_id for q_id, _ in vectors)
+            if max_id >= len(self._stale):
+                stale = np.zeros(max(max_id + 1, int(len(self._stale) * 1.5) + 1), dtype=bool)
+                stale[:len(self._stale)] = self._stale
+                self._stale = stale
+            for q_id, question_terms in vectors:
+                self._replace(q_id, self._vector(question_terms, add_terms=True))
+            if len(self._changed) > max(1000, len(self._post_ids) // (10 * MAX_TERMS_PER_QUESTION)):
+                self._merge_changes()
+
+    def set(self, question_id: int, enunciado: Optional[str], assunto: Optional[str]) -> None:
+        self.set_many([(question_id, enunciado, assunto)])
+
+    def remove(self, question_id: int) -> None:
+        with self._lock:
+            if question_id < len(self._stale):
+                self._replace(question_id, {})
+
+    def _replace(self, question_id: int, vector: Dict[int, float]) -> None:
+        # Must be called with the lock held
+        for term in self._changed.get(question_id, ()):
+            self._changed_postings[term].pop(question_id, None)
+        self._changed[question_id] = vector
+        for term, weight in vector.items():
+            self._changed_postings.setdefault(term, {})[question_id] = weight
+        self._stale[question_id] = True
+
+    def similar(self, question_id: int, enunciado: Optional[str], assunto: Optional[str],
+                limit: int = 10) -> List[Tuple[int, float]]:
+        """
+        [(question ID, cosine similarity)] of the indexed questions most similar to the
+        given text, most similar first; `question_id` itself is left out.
+        """
+        with self._lock:
+            vector = self._vector(terms(enunciado, assunto))
+            term_ptr, post_ids, post_weights, stale = self._term_ptr, self._post_ids, self._post_weights, self._stale
+            changed = [(list(self._changed_postings[t]), list(self._changed_postings[t].values()), w)
+                       for t, w in vector.items() if t in self._changed_postings]
+        ids, weights = [], []
+        for term, weight in vector.items():
+            if term < len(term_ptr) - 1:
+                start, stop = term_ptr[term], term_ptr[term + 1]
+                ids.append(post_ids[start:stop])
+                weights.append(post_weights[start:stop] * weight)
+        if ids:
+            ids, weights = np.concatenate(ids), np.concatenate(weights)
+            keep = ~stale[ids]
+            ids, weights = ids[keep], weights[keep]
+        else:
+            ids, weights = _EMPTY_IDS, _EMPTY_WEIGHTS
+        # Questions written since the arrays were built: their current vectors
+        for changed_ids, changed_weights, weight in changed:
+            ids = np.concatenate((ids, np.asarray(changed_ids, dtype=np.int32)))
+            weights = np.concatenate((weights, np.asarray(changed_weights, dtype=np.float32) * weight))
+        if not len(ids):
+            return []
+        scores = np.bincount(ids, weights=weights)
+        if question_id < len(scores):
+            scores[question_id] = 0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit)[:limit]]
+        ranked = sorted(zip(candidates.tolist(), scores[candidates].tolist()), key=lambda pair: -pair[1])
+        return [(q_id, round(min(score, 1.0), 3)) for q_id, score in ranked]
+
+similar_question_index = SimilarQuestionIndex()
+question_sync.register(similar_question_index.refresh)
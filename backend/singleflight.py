@@ -0,0 +1,111 @@
+"""
+Request coalescing ("single flight") for expensive read functions.
+
+Concurrent calls with the same normalized arguments share one execution: the
+first caller runs the function and the others wait for its result. With `ttl`
+the result is also kept for that many seconds, so calls arriving right after
+are answered from memory.
+
+Meant for crud functions that return plain data (dicts, lists, numbers): the
+same object is handed to every caller and must not be mutated or be bound to
+a session. The `db` argument is not part of the key; the leader's session runs
+the query.
+"""
+from concurrent.futures import Future
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable
+import inspect
+import threading
+
+from backend import metrics
+from backend.cache import TTLCache
+
+_MISSING = object()
+
+def _normalize(value: Any) -> Hashable:
+    """
+    Turns an argument into a hashable key; lists are order-insensitive (filters use IN).
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _normalize(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        items = [_normalize(v) for v in value]
+        try:
+            return tuple(sorted(items))
+        except TypeError:
+            return tuple(items)
+    if hasattr(value, "model_dump"):
+        return _normalize(value.model_dump())
+    return value
+
+def single_flight(ttl: float = 0, maxsize: int = 1024, ignore: tuple = ("db",)):
+    """
+    Decorator. `ttl` > 0 enables the result cache; `ignore` lists arguments left out of the key.
+    """
+    def decorator(fn: Callable[..., Any]):
+        signature = inspect.signature(fn)
+        name = fn.__name__
+        in_flight: Dict[Hashable, Future] = {}
+        lock = threading.Lock()
+        results = TTLCache(maxsize=maxsize, ttl=ttl) if ttl > 0 else None
+
+        def make_key(args, kwargs) -> Hashable:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return tuple((k, _normalize(v)) for k, v in bound.arguments.items() if k not in ignore)
+
+        counts = {"calls": 0, "executions": 0}
+
+        def record(outcome: str) -> None:
+            metrics.incr(f"singleflight.{name}.calls")
+            metrics.incr(f"singleflight.{name}.{outcome}")
+            with lock:
+                counts["calls"] += 1
+                if outcome == "executions":
+                    counts["executions"] += 1
+                # Share of calls answered without running the function
+                ratio = 1 - counts["executions"] / counts["calls"]
+            metrics.set_gauge(f"singleflight.{name}.coalescing_ratio", round(ratio, 4))
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            if results is not None:
+                cached = results.get(key, _MISSING)
+                if cached is not _MISSING:
+                    record("cache_hits")
+                    return cached
+
+            with lock:
+                future = in_flight.get(key)
+                leader = future is None
+                if leader:
+                    future = in_flight[key] = Future()
+
+            if not leader:
+                record("coalesced")
+                return future.result()
+
+            record("executions")
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            else:
+                if results is not None:
+                    results.set(key, result)
+                future.set_result(result)
+                return result
+            finally:
+                with lock:
+                    in_flight.pop(key, None)
+
+        def invalidate() -> None:
+            """Drops the cached results (in-flight executions are not affected)."""
+            if results is not None:
+                results.clear()
+
+        wrapper.invalidate = invalidate
+        return wrapper
+    return decorator
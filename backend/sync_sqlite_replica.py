@@ -0,0 +1,42 @@
+"""
+Local read-replica setup with two SQLite files.
+
+Copies the primary database into the replica file with SQLite's online backup
+API, once or every --interval seconds, to emulate replication lag:
+
+    python backend/sync_sqlite_replica.py --primary meubanco.db --replica meubanco_replica.db --interval 5
+
+Then start the API with:
+
+    REPLICA_DATABASE_URL=sqlite:///./meubanco_replica.db uvicorn backend.main:app
+
+Endpoints using get_read_db read from the replica; everything else, and every
+write, uses the primary.
+"""
+import argparse
+import sqlite3
+import time
+
+def sync(primary: str, replica: str) -> None:
+    source = sqlite3.connect(primary)
+    target = sqlite3.connect(replica)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--primary", default="meubanco.db")
+    parser.add_argument("--replica", default="meubanco_replica.db")
+    parser.add_argument("--interval", type=float, help="Seconds between copies; copies once when omitted")
+    args = parser.parse_args()
+
+    while True:
+        start = time.perf_counter()
+        sync(args.primary, args.replica)
+        print(f"Replica {args.replica} updated from {args.primary} in {time.perf_counter() - start:.2f}s")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
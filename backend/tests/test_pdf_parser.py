@@ -0,0 +1,43 @@
+"""
+Regression cases for the PDF question parser (backend/pdf_parser.py).
+
+    python -m pytest backend/tests
+"""
+from backend import pdf_parser
+
+HEADER = "CONCURSO PÚBLICO - PROVA OBJETIVA"
+
+def _exam_pages(pages: int = 12, per_page: int = 3, repeated_alternatives: bool = True):
+    # Pages with a running header, a page number and questions whose last alternatives
+    # (D and E) are the same on every question and end each page
+    result, number = [], 1
+    for page in range(1, pages + 1):
+        lines = [HEADER]
+        for _ in range(per_page):
+            lines += [f"Questão {number}", f"Enunciado da questão {number}.",
+                      f"(A) Primeira {number}", f"(B) Segunda {number}", f"(C) Terceira {number}"]
+            if repeated_alternatives:
+                lines += ["(D) Todas as anteriores", "(E) Nenhuma das anteriores"]
+            else:
+                lines += [f"(D) Quarta {number}", f"(E) Quinta {number}"]
+            number += 1
+        lines.append(f"Página {page} de {pages}")
+        result.append("\n".join(lines))
+    return result
+
+def test_strips_running_header_and_page_numbers():
+    cleaned = pdf_parser._strip_running_lines(_exam_pages())
+    assert all(HEADER not in page and "Página" not in page for page in cleaned)
+
+def test_repeated_alternatives_at_page_end_are_kept():
+    for repeated in (True, False):
+        text = "\n".join(pdf_parser._strip_running_lines(_exam_pages(repeated_alternatives=repeated)))
+        questions = pdf_parser.segment_questions(text)
+        assert len(questions) == 36
+        assert all(all(f"item_{letter}" in q for letter in "abcde") for q in questions)
+        assert all("Nenhuma das anteriores" in q["item_e"] for q in questions) == repeated
+
+def test_repeated_line_in_the_body_is_kept():
+    pages = [f"{HEADER}\nTexto {n}\n{HEADER}\nmais texto {n}\nfim {n}" for n in range(6)]
+    cleaned = pdf_parser._strip_running_lines(pages)
+    assert all(page.count(HEADER) == 1 for page in cleaned)
@@ -0,0 +1,16 @@
+"""
+Regression cases for the outline parser of the assunto taxonomy (backend/topic_tree.py).
+
+    python -m pytest backend/tests
+"""
+from backend.topic_tree import parse_outline
+
+def test_numbered_items_get_their_level():
+    items = ["1 Controle de Constitucionalidade", "1.1 Controle Difuso", "1.2. - Controle Concentrado", "2) Poder Constituinte"]
+    assert parse_outline(items) == [
+        (1, "Controle de Constitucionalidade"), (2, "Controle Difuso"), (2, "Controle Concentrado"), (1, "Poder Constituinte"),
+    ]
+
+def test_leading_years_and_law_numbers_are_names():
+    items = ["2023 Lei 8.112", "10.520 Pregão", "Lei 8.112/90"]
+    assert parse_outline(items) == [(1, "2023 Lei 8.112"), (1, "10.520 Pregão"), (1, "Lei 8.112/90")]
@@ -0,0 +1,181 @@
+"""
+Hierarchical assunto taxonomy (topics + topic_closure).
+
+Every (materia, assunto) pair used by a question is a node of its materia's
+tree, and questions point to it through Question.topic_id. The closure table
+keeps one row per (ancestor, descendant) pair, the node itself included, so
+"all of Controle de Constitucionalidade" is one indexed join instead of an
+`IN (...)` of every sub-assunto:
+
+    questions JOIN topic_closure ON topic_closure.descendant_id = questions.topic_id
+    WHERE topic_closure.ancestor_id = :topic_id
+
+Nodes are matched by their normalized name (question_text.normalize), so
+"Habeas corpus" and "Habeas Corpus" are the same assunto. A node created for
+a new assunto starts as a root. The hierarchy comes from numbered outlines in
+the format of an edital's conteudo ({materia: ["1 Controle de
+Constitucionalidade", "1.1 Controle Difuso", ...]}, the numbering that
+EditalVerticalizado indents by), imported with `import_outline`, which also
+moves the existing nodes under their outline parent.
+"""
+from sqlalchemy import delete, insert, select, true
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, aliased
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+import re
+
+from backend import models, question_text
+
+logger = logging.getLogger(__name__)
+
+# Numbering is a short number ("1", "1.2.3", components of up to two digits) followed by a space,
+# or any number followed by a separator ("1.", "10)", "2023 -"), so "2023 Lei 8.112" is a name
+_NUMBERING = re.compile(r"^\s*(?=\d{1,2}(?:\.\d{1,2})*\.?\s|\d+(?:\.\d+)*\s*(?:\.(?!\d)|[)\-–]))(\d+(?:\.\d+)*)\.?\s*(?:[-–)]\s*)?")
+
+# (materia, chave) -> ID of committed nodes. Nodes are never deleted. A session does not cache the
+# nodes it created (listed in db.info["created_topics"]): its transaction may still roll back.
+# Other sessions only see them once committed.
+_ids: Dict[Tuple[str, str], int] = {}
+
+# INSERT ... ON CONFLICT DO NOTHING, so a node created meanwhile by another transaction is
+# neither an error nor a reason for a SAVEPOINT (which pysqlite would commit on RELEASE)
+_INSERT_IGNORING_CONFLICTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+def chave(nome: str) -> str:
+    return question_text.normalize(nome)
+
+def parse_outline(items: Iterable[str]) -> List[Tuple[int, str]]:
+    """
+    (level, name) of each non-empty outline item: "1.2.3 Nome" is ("Nome", level 3);
+    items without numbering (see _NUMBERING) are level 1.
+    """
+    outline = []
+    for item in items:
+        match = _NUMBERING.match(item or "")
+        nome = (item[match.end():] if match else item or "").strip()
+        if nome:
+            outline.append((len(match.group(1).split(".")) if match else 1, nome))
+    return outline
+
+def _find(db: Session, materia: str, nome: str) -> Optional[models.Topic]:
+    return db.query(models.Topic).filter(models.Topic.materia == materia, models.Topic.chave == chave(nome)).first()
+
+def _create(db: Session, materia: str, nome: str, parent_id: Optional[int] = None, posicao: int = 0) -> Optional[int]:
+    # ID of a new node, or None when another transaction created it first
+    values = dict(materia=materia, nome=nome, chave=chave(nome), parent_id=parent_id, posicao=posicao)
+    dialect_insert = _INSERT_IGNORING_CONFLICTS.get(db.get_bind().dialect.name)
+    if dialect_insert is None:
+        topic = models.Topic(**values)
+        db.add(topic)
+        db.flush()
+        new_id = topic.id
+    else:
+        new_id = db.scalar(
+            dialect_insert(models.Topic).values(**values)
+            .on_conflict_do_nothing(index_elements=["materia", "chave"])
+            .returning(models.Topic.id)
+        )
+        if new_id is None:
+            return None
+    closure = models.TopicClosure
+    rows = [{"ancestor_id": new_id, "descendant_id": new_id, "depth": 0}]
+    if parent_id is not None:
+        rows += [{"ancestor_id": ancestor_id, "descendant_id": new_id, "depth": depth + 1}
+                 for ancestor_id, depth in db.query(closure.ancestor_id, closure.depth).filter(closure.descendant_id == parent_id)]
+    db.execute(insert(closure), rows)
+    return new_id
+
+def topic_id(db: Session, materia: str, assunto: str) -> int:
+    """
+    ID of the node of an assunto, created as a root of the materia when missing. Does not
+    commit: the node is created inside the caller's transaction.
+    """
+    key = (materia, chave(assunto))
+    cached = _ids.get(key)
+    if cached is not None:
+        return cached
+    created = db.info.setdefault("created_topics", set())
+    topic = _find(db, materia, assunto)
+    if topic is None:
+        new_id = _create(db, materia, assunto)
+        if new_id is not None:
+            created.add(new_id)
+            return new_id
+        topic = _find(db, materia, assunto) # Created meanwhile by another transaction, now committed
+    if topic.id not in created:
+        _ids[key] = topic.id
+    return topic.id
+
+def topic_ids(db: Session, pairs: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], int]:
+    """
+    {(materia, assunto): node ID} for many pairs (see topic_id).
+    """
+    return {pair: topic_id(db, *pair) for pair in set(pairs)}
+
+def is_descendant(db: Session, topic_id: int, ancestor_id: int) -> bool:
+    closure = models.TopicClosure
+    return db.query(closure.depth).filter(closure.ancestor_id == ancestor_id, closure.descendant_id == topic_id).first() is not None
+
+def move(db: Session, topic_id: int, parent_id: Optional[int]) -> None:
+    """
+    Moves a node, with its subtree, under `parent_id` (None makes it a root). Raises
+    ValueError when the parent is in the node's own subtree. Does not commit.
+    """
+    if parent_id is not None and is_descendant(db, parent_id, topic_id):
+        raise ValueError(f"Topic {parent_id} is in the subtree of topic {topic_id}")
+    closure = models.TopicClosure
+    subtree = select(closure.descendant_id).where(closure.ancestor_id == topic_id).scalar_subquery()
+    # Detaches the subtree from the node's current ancestors, then links it to the new ones
+    db.execute(delete(closure).where(closure.descendant_id.in_(subtree), closure.ancestor_id.not_in(subtree)))
+    if parent_id is not None:
+        above, below = aliased(closure), aliased(closure)
+        db.execute(insert(closure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            # Every new ancestor (above) with every node of the subtree (below)
+            select(above.ancestor_id, below.descendant_id, above.depth + below.depth + 1)
+            .select_from(above).join(below, true())
+            .where(above.descendant_id == parent_id, below.ancestor_id == topic_id)
+        ))
+    db.get(models.Topic, topic_id).parent_id = parent_id
+
+def import_outline(db: Session, conteudo: Dict[str, List[str]]) -> Dict[str, int]:
+    """
+    Adds the numbered outline of each materia ({materia: [items]}, like an edital's conteudo)
+    to the tree: missing nodes are created and existing ones are moved under their outline
+    parent. Moves that would put a node inside its own subtree are skipped. Returns the
+    summary: criados, movidos, ignorados.
+    """
+    summary = {"criados": 0, "movidos": 0, "ignorados": 0}
+    for materia, items in conteudo.items():
+        path: List[Tuple[int, int]] = [] # (level, node ID) from the root to the last item
+        for posicao, (level, nome) in enumerate(parse_outline(items)):
+            while path and path[-1][0] >= level:
+                path.pop()
+            parent_id = path[-1][1] if path else None
+            topic = _find(db, materia, nome)
+            node_id = _create(db, materia, nome, parent_id, posicao) if topic is None else None
+            if node_id is not None:
+                summary["criados"] += 1
+            else:
+                if topic is None:
+                    topic = _find(db, materia, nome) # Created meanwhile by another transaction (topic_id), now committed
+                node_id = topic.id
+                topic.posicao = posicao
+                if topic.parent_id != parent_id:
+                    if parent_id is not None and is_descendant(db, parent_id, node_id):
+                        summary["ignorados"] += 1
+                    else:
+                        move(db, node_id, parent_id)
+                        summary["movidos"] += 1
+            path.append((level, node_id))
+    db.commit()
+    logger.info(f"Topic outline imported: {summary}")
+    return summary
+
+def filter_subtree(query, topic_id: int):
+    """
+    Restricts a query on `questions` to the questions of a node and of all its descendants.
+    """
+    closure = models.TopicClosure
+    return query.join(closure, closure.descendant_id == models.Question.topic_id).filter(closure.ancestor_id == topic_id)
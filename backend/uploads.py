@@ -0,0 +1,94 @@
+"""
+Bounded handling of file uploads (PDF and question bank imports).
+
+Starlette already spools multipart files to a temporary file past 1 MB, so
+memory per upload is bounded; what is left is not spending disk and CPU on
+files that are too large or of the wrong type:
+
+  - UploadSizeLimit rejects requests to the upload paths whose Content-Length
+    exceeds the path's limit with 413, before the body is read;
+  - save_upload copies the spooled file to the job directory in chunks,
+    checking the file signature in the first bytes and the size as it goes
+    (also covering chunked requests without Content-Length).
+"""
+from fastapi import UploadFile
+from typing import Callable, Dict, Optional
+import logging
+import os
+
+from backend import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024 # Per PDF file
+MAX_IMPORT_BYTES = int(os.getenv("MAX_IMPORT_MB", "500")) * 1024 * 1024 # Question bank files (JSONL/CSV)
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+HEAD_BYTES = 1024 # Bytes given to the signature check
+MULTIPART_OVERHEAD_BYTES = 64 * 1024 # Form fields and part headers around the files
+
+class UploadTooLarge(Exception):
+    """Raised when an uploaded file exceeds its size limit."""
+
+class InvalidUpload(ValueError):
+    """Raised when the first bytes of an uploaded file do not match the expected type."""
+
+def save_upload(
+    upload: UploadFile,
+    path: str,
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    check_head: Optional[Callable[[bytes], bool]] = None
+) -> int:
+    """
+    Copies an uploaded file to `path` in chunks; returns its size. Raises InvalidUpload
+    when check_head rejects the first HEAD_BYTES and UploadTooLarge past max_bytes,
+    removing the partial copy.
+    """
+    size = 0
+    try:
+        with open(path, "wb") as out:
+            head = upload.file.read(HEAD_BYTES)
+            if check_head is not None and not check_head(head):
+                raise InvalidUpload()
+            chunk = head
+            while chunk:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge()
+                out.write(chunk)
+                chunk = upload.file.read(UPLOAD_CHUNK_BYTES)
+    except Exception:
+        os.unlink(path)
+        metrics.incr("uploads.rejected")
+        raise
+    metrics.incr("uploads.bytes", size)
+    return size
+
+def too_large_detail(max_bytes: int) -> str:
+    return f"Arquivo muito grande. Limite de {max_bytes // (1024 * 1024)} MB por arquivo."
+
+class UploadSizeLimit:
+    """
+    ASGI middleware: 413 for requests to the paths in `limits` ({path: (files, max bytes
+    per file)}) declaring a body larger than the files allowed plus the multipart overhead.
+    """
+
+    def __init__(self, app, limits: Dict[str, tuple]):
+        self.app = app
+        self.limits = {path: (files * max_bytes + MULTIPART_OVERHEAD_BYTES, max_bytes)
+                       for path, (files, max_bytes) in limits.items()}
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is not None:
+            length = dict(scope["headers"]).get(b"content-length")
+            if length is not None and length.isdigit() and int(length) > limit[0]:
+                logger.warning(f"Upload to {scope['path']} refused: {int(length)} bytes.")
+                metrics.incr("uploads.rejected")
+                body = ('{"detail":"' + too_large_detail(limit[1]) + '"}').encode()
+                await send({"type": "http.response.start", "status": 413, "headers": [
+                    (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                    (b"connection", b"close"),
+                ]})
+                await send({"type": "http.response.body", "body": body})
+                return
+        await self.app(scope, receive, send)
@@ -0,0 +1,219 @@
+"""
+Optional single-writer queue for SQLite deployments.
+
+SQLite allows one writer at a time; concurrent commits from the endpoint
+threads end in "database is locked". With SQLITE_WRITE_QUEUE=true, writes sent
+through `run_write` are executed by one dedicated thread that owns its own
+connection. Jobs waiting in the queue are group-committed: each job runs inside
+a SAVEPOINT (a failing job only rolls back its own changes) and the batch is
+committed once.
+
+The crud functions keep calling `db.commit()`; inside a batch that becomes a
+flush, and the real commit happens when the batch ends. Changes a job makes
+after its last commit are discarded, as they would be when a request session
+is closed without committing. Objects returned by a job are detached with their
+loaded attributes. Code that keeps state outside the database about a write it
+"committed" (e.g. answer_stats' pending counters) registers an `on_rollback`
+callback to restore it if the job or the batch is rolled back after all.
+
+Without the flag (or on other databases) `run_write` calls the function with
+the request session, as before.
+"""
+from concurrent.futures import Future
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from typing import Any, Callable, Optional
+import threading
+import queue
+import time
+import logging
+import os
+
+from backend import metrics
+from backend.database import SQLALCHEMY_DATABASE_URL, build_engine, is_sqlite
+
+logger = logging.getLogger(__name__)
+
+WRITE_QUEUE_ENABLED = os.getenv("SQLITE_WRITE_QUEUE", "false").lower() in ("1", "true", "yes") and is_sqlite(SQLALCHEMY_DATABASE_URL)
+MAX_BATCH = 64 # Jobs committed in one transaction
+BATCH_WINDOW_SECONDS = 0.002 # Wait for more jobs after the first one of a batch
+JOB_TIMEOUT_SECONDS = 30
+
+class GroupCommitSession(Session):
+    """
+    Session of the writer thread: during a batch, commit() only flushes and
+    rollback() undoes the current job's savepoint.
+    """
+
+    def commit(self):
+        if self.info.get("batching"):
+            self.flush()
+        else:
+            super().commit()
+
+    def rollback(self):
+        savepoint = self.info.get("savepoint")
+        if self.info.get("batching") and savepoint is not None:
+            _rollback_savepoint(self, savepoint)
+        else:
+            super().rollback()
+
+def _rollback_savepoint(session: Session, savepoint) -> None:
+    # Also covers a savepoint deactivated by a failed flush, which still has to be rolled back
+    if session.get_nested_transaction() is savepoint:
+        savepoint.rollback()
+    _run_callbacks(session.info.pop("rollback_callbacks", []))
+
+def _run_callbacks(callbacks) -> None:
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception:
+            logger.error("Write queue rollback callback failed.", exc_info=True)
+
+def on_rollback(session: Session, callback: Callable[[], None]) -> None:
+    """
+    Calls `callback` if the writes the current job already committed are rolled back
+    with its savepoint or its batch. Outside a batch commit() is final and nothing is registered.
+    """
+    if session.info.get("batching"):
+        session.info.setdefault("rollback_callbacks", []).append(callback)
+
+class _Job:
+    __slots__ = ("fn", "args", "kwargs", "future", "enqueued_at")
+
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+def _writer_engine():
+    # pysqlite does not emit BEGIN itself, which breaks SAVEPOINT; take over
+    # transaction control and start each batch with BEGIN IMMEDIATE (write lock up front).
+    writer_engine = build_engine(SQLALCHEMY_DATABASE_URL, pool_size=1, max_overflow=0)
+
+    @event.listens_for(writer_engine, "connect")
+    def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(writer_engine, "begin")
+    def _begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    return writer_engine
+
+class WriteQueue:
+    def __init__(self):
+        self._queue: "queue.Queue[Optional[_Job]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._engine = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._engine = _writer_engine()
+        self._thread = threading.Thread(target=self._loop, name="sqlite-writer", daemon=True)
+        self._thread.start()
+        logger.info("SQLite write queue started.")
+
+    def stop(self) -> None:
+        """
+        Finishes the queued jobs and stops the writer thread.
+        """
+        if not self.running:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._engine.dispose()
+        logger.info("SQLite write queue stopped.")
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        job = _Job(fn, args, kwargs)
+        self._queue.put(job)
+        metrics.set_gauge("write_queue.depth", self._queue.qsize())
+        return job.future
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None, True
+        batch = [first]
+        deadline = time.perf_counter() + BATCH_WINDOW_SECONDS
+        while len(batch) < MAX_BATCH:
+            try:
+                job = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if job is None:
+                return batch, True
+            batch.append(job)
+        return batch, False
+
+    def _loop(self) -> None:
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if batch:
+                self._run_batch(batch)
+            metrics.set_gauge("write_queue.depth", self._queue.qsize())
+
+    def _run_batch(self, batch) -> None:
+        session = GroupCommitSession(bind=self._engine, autoflush=False, expire_on_commit=False)
+        session.info["batching"] = True
+        results = []
+        committed_callbacks = [] # on_rollback callbacks of the jobs that succeeded
+        start = time.perf_counter()
+        try:
+            for job in batch:
+                savepoint = session.begin_nested()
+                session.info["savepoint"] = savepoint
+                try:
+                    result = job.fn(session, *job.args, **job.kwargs)
+                    # Changes after the job's last commit() are not persisted
+                    session.expunge_all()
+                    if savepoint.is_active:
+                        savepoint.commit()
+                    committed_callbacks.extend(session.info.pop("rollback_callbacks", []))
+                    results.append((job, result, None))
+                except Exception as e:
+                    _rollback_savepoint(session, savepoint)
+                    session.expunge_all()
+                    results.append((job, None, e))
+            session.info["batching"] = False
+            session.info.pop("savepoint", None)
+            session.commit()
+        except Exception as e:
+            logger.error(f"Write queue batch of {len(batch)} jobs failed to commit.", exc_info=True)
+            session.rollback()
+            _run_callbacks(committed_callbacks + session.info.pop("rollback_callbacks", []))
+            results = [(job, None, e) for job in batch]
+        finally:
+            session.close()
+
+        metrics.observe("write_queue.batch_commit", time.perf_counter() - start)
+        metrics.incr("write_queue.batches")
+        metrics.incr("write_queue.jobs", len(batch))
+        for job, result, error in results:
+            metrics.observe("write_queue.job_latency", time.perf_counter() - job.enqueued_at)
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+write_queue = WriteQueue()
+
+def run_write(db: Session, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Runs `fn(session, *args, **kwargs)` in the writer thread and waits for it
+    to be committed. Without the write queue, runs it with `db`.
+    """
+    if not write_queue.running:
+        return fn(db, *args, **kwargs)
+    return write_queue.submit(fn, *args, **kwargs).result(timeout=JOB_TIMEOUT_SECONDS)
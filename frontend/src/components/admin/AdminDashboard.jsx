@@ -556,7 +556,24 @@ export default function AdminDashboard({ token, onLogout }) {
                 throw new Error(errorData.detail || 'Falha ao processar o PDF.');
             }
 
-            setPdfUploadMessage('PDF enviado e processado com sucesso! Questões adicionadas.');
+            // A importação roda em segundo plano; acompanha a tarefa até terminar
+            let job = await response.json();
+            while (job.status === 'pending' || job.status === 'running') {
+                setPdfUploadMessage(`Processando PDF... ${Math.round(job.progress * 100)}%${job.message ? ` - ${job.message}` : ''}`);
+                await new Promise((resolve) => setTimeout(resolve, 1000));
+                const jobResponse = await fetch(`${API_URL}/api/jobs/${job.id}`, {
+                    headers: { 'Authorization': `Bearer ${token}` },
+                });
+                if (!jobResponse.ok) {
+                    throw new Error('Falha ao consultar o andamento da importação.');
+                }
+                job = await jobResponse.json();
+            }
+            if (job.status !== 'succeeded') {
+                throw new Error(job.error || 'Importação cancelada.');
+            }
+
+            setPdfUploadMessage(`PDF processado com sucesso! ${job.result.questoes_adicionadas} questões adicionadas.`);
             setPdfUploadMessageType('success');
             setFile(null); // Limpa o arquivo selecionado
             fetchQuestions(); // Recarrega a lista de questões
@@ -521,7 +521,7 @@ const mappedData = data.map(comment => ({
                     'Content-Type': 'application/json',
                     Authorization: `Bearer ${token}`,
                 },
-                body: JSON.stringify({ is_correct: acertou }),
+                body: JSON.stringify({ is_correct: acertou, resposta: respostaUsuario }),
             });
             if (resResposta.status === 401 || resResposta.status === 403) {
                 handleUnauthorized();